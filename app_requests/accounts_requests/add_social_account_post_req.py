@@ -8,5 +8,5 @@ class AddSocialAccountPostReq(BaseModel):
     noComments: int
     datePosted: str
     comments: List[str]
-    photos: List[str]
+    photos: List[str]  # the images in base64 format or the crop ids of the detected photos
     social_account_id: int
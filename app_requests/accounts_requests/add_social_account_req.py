@@ -7,4 +7,4 @@ class AddSocialAccountReq(BaseModel):
     no_followers: int
     no_following: int
     no_of_posts: int
-    profile_photo: str  # receive the image in base64 form frontend when adding it
+    profile_photo: str  # receive the image in base64 form frontend when adding it, or the crop id of the detected photo
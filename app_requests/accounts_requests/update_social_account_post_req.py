@@ -9,7 +9,7 @@ class PostComment(BaseModel):
 
 class PostPhoto(BaseModel):
     id: int
-    photo_url: str
+    photo_url: str  # the image in base64 format or the crop id of the detected photo
 
 
 class UpdateSocialAccountPostReq(BaseModel):
@@ -8,4 +8,4 @@ class UpdateSocialAccountReq(BaseModel):
     no_followers: int
     no_following: int
     no_of_posts: int
-    profile_photo: str
+    profile_photo: str  # the image in base64 format or the crop id of the detected photo
@@ -0,0 +1,5 @@
+from pydantic import BaseModel
+
+
+class AutoDetectionRequest(BaseModel):
+    image: str  # A SCREENSHOT OF AN INSTAGRAM PROFILE OR OF AN INSTAGRAM POST
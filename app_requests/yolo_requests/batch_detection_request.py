@@ -0,0 +1,7 @@
+from typing import List
+
+from pydantic import BaseModel
+
+
+class BatchDetectionRequest(BaseModel):
+    images: List[str]
@@ -0,0 +1,9 @@
+from typing import Literal
+
+from pydantic import BaseModel
+
+
+class DetectionJobRequest(BaseModel):
+    image: str
+    # WHAT THE SCREENSHOT IS: profile, post OR auto (CLASSIFIED ON THE SERVER, LIKE /yolo/auto)
+    type: Literal['profile', 'post', 'auto'] = 'auto'
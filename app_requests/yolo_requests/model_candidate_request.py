@@ -0,0 +1,6 @@
+from pydantic import BaseModel
+
+
+class ModelCandidateRequest(BaseModel):
+    weights_path: str  # THE PYTORCH WEIGHTS OF THE CANDIDATE, INSIDE YOLO_MODELS_DIR (e.g. ai_models/.../best.pt)
+    shadow_rate: float | None = None  # FRACTION OF THE DETECTIONS ALSO RUN BY THE CANDIDATE (None = THE DEFAULT)
@@ -0,0 +1,7 @@
+from typing import List
+
+from pydantic import BaseModel
+
+
+class PostSequenceDetectionRequest(BaseModel):
+    images: List[str]  # THE SCREENSHOTS OF THE SAME POST, IN THE SCROLL ORDER
@@ -0,0 +1,15 @@
+from typing import Literal
+
+from pydantic import BaseModel
+
+from app_responses.yolo_responses.post_detection_response import PostDetectionResponse
+from app_responses.yolo_responses.profile_detection_response import ProfileDetectionResponse
+
+
+class AutoDetectionResponse(BaseModel):
+    message: str
+    status_code: int
+
+    type: Literal['profile', 'post']  # THE KIND OF SCREENSHOT DETECTED
+    profile: ProfileDetectionResponse | None  # SET ONLY IF type IS profile
+    post: PostDetectionResponse | None  # SET ONLY IF type IS post
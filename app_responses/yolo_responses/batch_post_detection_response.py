@@ -0,0 +1,13 @@
+from typing import List
+
+from pydantic import BaseModel
+
+from app_responses.yolo_responses.post_detection_response import PostDetectionResponse
+
+
+class BatchPostDetectionResponse(BaseModel):
+    message: str
+    status_code: int
+
+    # ONE RESPONSE FOR EACH IMAGE, IN THE ORDER THE IMAGES WERE SENT (EACH WITH ITS OWN status_code)
+    results: List[PostDetectionResponse]
@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+
+
+class DetectionJobResponse(BaseModel):
+    message: str
+    status_code: int
+
+    job_id: str
+    kind: str  # profile, post OR auto
+    status: str  # queued, running, done OR failed
+    # WHEN done: THE ProfileDetectionResponse/PostDetectionResponse/AutoDetectionResponse OF THE SCREENSHOT
+    # WHEN failed: THE message AND status_code OF THE ERROR
+    result: dict | None
@@ -0,0 +1,8 @@
+from pydantic import BaseModel
+
+
+class DetectionMetricsResponse(BaseModel):
+    message: str
+    status_code: int
+
+    metrics: dict
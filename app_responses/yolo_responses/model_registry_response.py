@@ -0,0 +1,11 @@
+from pydantic import BaseModel
+
+
+class ModelRegistryResponse(BaseModel):
+    message: str
+    status_code: int
+
+    # THE active/previous/candidate WEIGHTS AND THE shadow_rate OF EACH KIND OF MODEL (profile, post)
+    state: dict
+    # THE LOADED MODELS AND THEIR SHADOW COMPARISON (LATENCY, BOX AGREEMENT), ONLY RETURNED BY GET /yolo/models
+    metrics: dict | None = None
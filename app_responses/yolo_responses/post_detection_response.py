@@ -5,7 +5,7 @@ class PostDetectionResponse(BaseModel):
     message: str
     status_code: int
 
-    post_photo: str | None  # THE IMAGE IS REPRESENTED AS base64
+    post_photo: str | None  # THE CROP ID OF THE STAGED IMAGE (base64 IF PHOTOS_STAGING IS DISABLED)
     description: str | None
     no_likes: int | None
     no_comments: int | None
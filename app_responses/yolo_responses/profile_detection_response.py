@@ -5,7 +5,7 @@ class ProfileDetectionResponse(BaseModel):
     message: str
     status_code: int
 
-    profile_photo: str | None  # THE IMAGE IS REPRESENTED AS base64
+    profile_photo: str | None  # THE CROP ID OF THE STAGED IMAGE (base64 IF PHOTOS_STAGING IS DISABLED)
     username: str | None
     description: str | None
     no_followers: int | None
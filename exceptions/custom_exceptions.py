@@ -5,5 +5,7 @@ class CustomHTTPException(Exception):
     Custom exception body
     """
     def __init__(self, status_code: int, message: str):
+        # THE ARGUMENTS ARE GIVEN TO Exception SO THAT THE EXCEPTION CAN BE PICKLED (RAISED IN A WORKER PROCESS)
+        super().__init__(status_code, message)
         self.status_code = status_code
         self.message = message
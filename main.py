@@ -1,3 +1,5 @@
+from contextlib import asynccontextmanager
+
 from exceptions.custom_exceptions import CustomHTTPException
 from routers import auth_router, social_accounts_router, yolo_detection_router, translate_router, \
     social_accounts_posts_router, user_router, photos_router, analysis_router
@@ -5,9 +7,25 @@ from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
+from service.utils.upload_utils import ImageUploadLimitMiddleware
+from service.yolo_services.yolo_worker_pool import start_detection_workers, shutdown_detection_pool
+
 from websocket.websocket_connection import websocket_endpoint
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Starts the processes of the detection workers before the app accepts requests and stops them when the app is
+    stopped
+    :param app: the app
+    """
+    start_detection_workers()
+    yield
+    shutdown_detection_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 # Allow all origins
 app.add_middleware(
     CORSMiddleware,
@@ -16,6 +34,8 @@ app.add_middleware(
     allow_methods=["*"],  # Allow all HTTP methods (GET, POST, PUT, DELETE, etc.)
     allow_headers=["*"],  # Allow all headers
 )
+# THE MULTIPART SCREENSHOTS ARE LIMITED BEFORE THEY ARE PARSED
+app.add_middleware(ImageUploadLimitMiddleware, paths=["/yolo/profile/upload", "/yolo/post/upload"])
 
 app.include_router(auth_router.router)
 app.include_router(social_accounts_router.router)
@@ -5,6 +5,7 @@ import os
 from logging_config import logger
 from security.jwt_token import verify_token
 from model.entities import User
+from service.utils.photos_utils import staged_photo_path
 
 
 router = APIRouter(prefix="/photo", tags=["PhotosAPI"])
@@ -29,3 +30,24 @@ def get_profile_photo(filename: str, user: User = Depends(verify_token)):
         raise HTTPException(status_code=404, detail="Image not found")
 
     return FileResponse(full_path, media_type="image/jpeg")
+
+
+@router.get("/staging/{crop_id}")
+def get_staged_photo(crop_id: str, user: User = Depends(verify_token)):
+    """
+    Searches a detected photo which was not saved yet (see photos_utils.stage_photo), used by the frontend app to
+    preview the photos returned by the detection as crop ids
+    :param crop_id: the crop id returned by the detection
+    :param user: for token validation, only the photos staged by the user are found
+    :return: FileResponse with the requested image
+    """
+    logger.info(f'Searching staged photo: {crop_id}')
+    full_path = staged_photo_path(crop_id, user.id)
+
+    # VERIFY IF THE IMAGE EXISTS (IT EXPIRES IF IT IS NOT SAVED IN TIME, OR IT WAS ALREADY SAVED,
+    # OR IT BELONGS TO ANOTHER USER)
+    if full_path is None or not os.path.isfile(full_path):
+        logger.error(f'staged image not found: {crop_id}')
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    return FileResponse(full_path, media_type="image/jpeg")
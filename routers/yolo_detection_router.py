@@ -1,22 +1,147 @@
-from fastapi import APIRouter
+import json
+
+from fastapi import APIRouter, File, Request, UploadFile
 from fastapi import Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from exceptions.custom_exceptions import CustomHTTPException
 
+from app_requests.yolo_requests.auto_detection_request import AutoDetectionRequest
+from app_requests.yolo_requests.batch_detection_request import BatchDetectionRequest
+from app_requests.yolo_requests.detection_job_request import DetectionJobRequest
+from app_requests.yolo_requests.model_candidate_request import ModelCandidateRequest
 from app_requests.yolo_requests.post_detection_request import PostDetectionRequest
+from app_requests.yolo_requests.post_sequence_detection_request import PostSequenceDetectionRequest
+from app_responses.yolo_responses.auto_detection_response import AutoDetectionResponse
+from app_responses.yolo_responses.batch_post_detection_response import BatchPostDetectionResponse
+from app_responses.yolo_responses.batch_profile_detection_response import BatchProfileDetectionResponse
+from app_responses.yolo_responses.detection_job_response import DetectionJobResponse
+from app_responses.yolo_responses.detection_metrics_response import DetectionMetricsResponse
+from app_responses.yolo_responses.model_registry_response import ModelRegistryResponse
 from app_responses.yolo_responses.post_detection_response import PostDetectionResponse
 from logging_config import logger
 from model.entities import User
-from security.jwt_token import verify_token
+from security.jwt_token import verify_token, verify_admin_token
+from service.utils.photos_utils import PHOTOS_STAGING, stage_photo, encoded_photo_to_base64
+from service.utils.upload_utils import read_image_upload, read_image_body
+from service.utils.video_utils import save_video_upload, remove_video
+from websocket.websocket_connection import notify_client
+from websocket.ws_types import WebsocketType
 from app_requests.yolo_requests.profile_detection_request import ProfileDetectionRequest
 from app_responses.yolo_responses.profile_detection_response import ProfileDetectionResponse
 
-from service.yolo_services.yolo_service import detect_from_profile_capture, detect_from_post_capture
+from service.yolo_services.yolo_worker_pool import detect_from_profile_capture, detect_from_post_capture, \
+    detect_from_profile_captures, detect_from_post_captures, get_detection_metrics, detect_from_profile_bytes, \
+    detect_from_post_bytes, detect_from_post_sequence, detect_from_post_video_progressive, \
+    detect_from_auto_capture, get_model_registry_metrics, detect_from_post_capture_progressive
+from service.yolo_services.yolo_jobs import submit_detection_job, get_detection_job
+from service.yolo_services.yolo_registry import get_registry_state, set_candidate_model, remove_candidate_model, \
+    promote_candidate_model, rollback_model
 
 router = APIRouter(prefix="/yolo", tags=["YoloAPI"])
 
 
+def detected_photo(photo, user_id: int, staged_photos: dict | None = None):
+    """
+    Stages a detected photo (see photos_utils.stage_photo), the client receives only its crop id and sends it back when
+    the social account/post is saved
+    The photos are staged here (after the detection cache), so each response gets its own staged photo
+    :param photo: the detected photo encoded as jpeg (bytes), or None if no photo was detected
+    :param user_id: the id of the user who requested the detection (the owner of the staged photo)
+    :param staged_photos: optional dictionary photo -> crop id, the same photo is staged only once (e.g. the partial
+    result and the complete result of a progressive detection)
+    :return: the crop id, the photo in base64 format if PHOTOS_STAGING is disabled, None if there is no photo
+    """
+    if photo is None:
+        return None
+    if not PHOTOS_STAGING:
+        return encoded_photo_to_base64(photo)
+    if staged_photos is None:
+        return stage_photo(photo, user_id)
+    if photo not in staged_photos:
+        staged_photos[photo] = stage_photo(photo, user_id)
+    return staged_photos[photo]
+
+
+def profile_detection_response(profile_data, user_id: int) -> ProfileDetectionResponse:
+    """
+    Creates the response of a profile detection, the profile photo is staged (see detected_photo)
+    :param profile_data: the tuple returned by detect_from_profile_capture
+    :param user_id: the id of the current user
+    :return: the ProfileDetectionResponse
+    """
+    profile_photo, username, description, followers, following, posts = profile_data
+    return ProfileDetectionResponse(
+        profile_photo=detected_photo(profile_photo, user_id),
+        username=username,
+        description=description,
+        no_followers=followers,
+        no_following=following,
+        no_of_posts=posts,
+
+        message="Profile data detected with success",
+        status_code=200,
+    )
+
+
+def post_detection_response(post_data, user_id: int, staged_photos: dict | None = None) -> PostDetectionResponse:
+    """
+    Creates the response of a post detection, the date is converted to ISO 8601 format and the post photo is staged
+    (see detected_photo)
+    :param post_data: the tuple returned by detect_from_post_capture
+    :param user_id: the id of the current user
+    :param staged_photos: the photos already staged for the same request (see detected_photo)
+    :return: the PostDetectionResponse
+    """
+    post_photo, description, no_likes, no_comments, date, comments = post_data
+    return PostDetectionResponse(
+        post_photo=detected_photo(post_photo, user_id, staged_photos),
+        description=description,
+        no_likes=no_likes,
+        no_comments=no_comments,
+        date=date.isoformat() if date else None,
+        comments=comments,
+
+        message="Post data detected with success",
+        status_code=200,
+    )
+
+
+def auto_detection_response(kind, data, user_id: int) -> AutoDetectionResponse:
+    """
+    Creates the response of a detection of a screenshot of unknown kind
+    :param kind: the kind of the screenshot returned by detect_from_auto_capture (profile/post)
+    :param data: the data returned by detect_from_auto_capture
+    :param user_id: the id of the current user
+    :return: the AutoDetectionResponse
+    """
+    return AutoDetectionResponse(
+        type=kind,
+        profile=profile_detection_response(data, user_id) if kind == 'profile' else None,
+        post=post_detection_response(data, user_id) if kind == 'post' else None,
+
+        message=f"{kind.capitalize()} data detected with success",
+        status_code=200,
+    )
+
+
+def detection_job_response(job, message: str) -> DetectionJobResponse:
+    """
+    Creates the response of a detection job endpoint
+    :param job: the DetectionJob
+    :param message: the message of the response
+    :return: the DetectionJobResponse
+    """
+    return DetectionJobResponse(
+        **job.to_dict(),
+
+        message=message,
+        status_code=200,
+    )
+
+
 @router.post("/profile")
-def detect_profile_data(body: ProfileDetectionRequest, user: User = Depends(verify_token)):
+async def detect_profile_data(body: ProfileDetectionRequest, user: User = Depends(verify_token)):
     """
     If the data wasn't detected in the image then the following invalid input will be assigned to each label:
     profile_photo: None
@@ -28,7 +153,8 @@ def detect_profile_data(body: ProfileDetectionRequest, user: User = Depends(veri
     :param body: the body of the request containing the image in base64 format
     :param user: used as dependency for token validation
     :return: ProfileDetectionResponse containing all the data detected in the provided image, the profile photo
-    will be sent in base64 format (because the user can change the photo in the frontend app if he wants)
+    is sent as a crop id (preview it with GET /photo/staging/{crop_id} and send it back when the account is saved,
+    the user can still replace it in the frontend app with a photo in base64 format)
 
     Throws 400 BAD_REQUEST if the image encoded in base64 doesn't represent a valid image
     Throws CustomHTTPException 403 FORBIDDEN if the user doesn't exist (invalid token)
@@ -36,24 +162,12 @@ def detect_profile_data(body: ProfileDetectionRequest, user: User = Depends(veri
     logger.info('Yolo detect profile')
 
     # print("image received:", body.image)
-    profile_photo, username, description, followers, following, posts = detect_from_profile_capture(body.image)
-
-    response = ProfileDetectionResponse(
-        profile_photo=profile_photo,
-        username=username,
-        description=description,
-        no_followers=followers,
-        no_following=following,
-        no_of_posts=posts,
-
-        message="Profile data detected with success",
-        status_code=200,
-    )
+    response = profile_detection_response(await detect_from_profile_capture(body.image), user.id)
     return JSONResponse(status_code=200, content=response.dict())
 
 
 @router.post("/post")
-def detect_post_data(body: PostDetectionRequest, user: User = Depends(verify_token)):
+async def detect_post_data(body: PostDetectionRequest, user: User = Depends(verify_token)):
     """
     If the data wasn't detected in the image then the following invalid input will be assigned to each label:
     post_photo: None
@@ -69,26 +183,511 @@ def detect_post_data(body: PostDetectionRequest, user: User = Depends(verify_tok
     :param body: the body of the request containing the image in base64 format
     :param user: used as dependency for token validation
     :return: PostDetectionResponse containing all the data detected in the provided image, the post photo
-    will be sent in base64 format (because the user can change the photo in the frontend app if he wants)
+    is sent as a crop id (preview it with GET /photo/staging/{crop_id} and send it back when the post is saved,
+    the user can still replace it in the frontend app with a photo in base64 format)
 
     Throws 400 BAD_REQUEST if the image encoded in base64 doesn't represent a valid image
     Throws CustomHTTPException 403 FORBIDDEN if the user doesn't exist (invalid token)
     """
     logger.info('Yolo detect post')
     # print("image received:", body.image)
-    post_photo, description, no_likes, no_comments, date,comments = detect_from_post_capture(body.image)
+    response = post_detection_response(await detect_from_post_capture(body.image), user.id)
+    return JSONResponse(status_code=200, content=response.dict())
 
-    date_iso_format = date.isoformat()if date else None
-    print('date iso format:', date_iso_format)
-    response = PostDetectionResponse(
-        post_photo=post_photo,
-        description=description,
-        no_likes=no_likes,
-        no_comments=no_comments,
-        date=date.isoformat() if date else None,
-        comments=comments,
 
-        message="Post data detected with success",
+@router.post("/auto")
+async def detect_auto_data(body: AutoDetectionRequest, user: User = Depends(verify_token)):
+    """
+    Detects the data of a screenshot which can be an instagram profile or an instagram post, the kind of screenshot is
+    classified on the server (cheap pass of both models on a reduced copy) and the screenshot is then detected like in
+    /yolo/profile or /yolo/post
+    The invalid input assigned to undetected labels is the same as for /yolo/profile and /yolo/post
+    :param body: the body of the request containing the image in base64 format
+    :param user: used as dependency for token validation
+    :return: AutoDetectionResponse with the detected type ('profile' or 'post') and the ProfileDetectionResponse or
+    the PostDetectionResponse of the screenshot
+
+    Throws 400 BAD_REQUEST if the image encoded in base64 doesn't represent a valid image
+    Throws CustomHTTPException 422 UNPROCESSABLE_ENTITY if the image is neither a profile nor a post
+    Throws CustomHTTPException 403 FORBIDDEN if the user doesn't exist (invalid token)
+    """
+    logger.info('Yolo detect profile or post')
+
+    response = auto_detection_response(*(await detect_from_auto_capture(body.image)), user.id)
+    return JSONResponse(status_code=200, content=response.dict())
+
+
+@router.post("/jobs")
+async def create_detection_job(body: DetectionJobRequest, user: User = Depends(verify_token)):
+    """
+    Starts the detection of a screenshot in background and returns immediately (status code 202) with the id of the
+    job, so the client doesn't keep the request open during the detection.
+    When the job is finished, its result is sent over the websocket (/ws) as a DETECTION_JOB_DONE message with the
+    job as payload (job_id, kind, status, result); it can also be retrieved with GET /yolo/jobs/{job_id}.
+    The post jobs also send their partial results (see /yolo/post/stream) as DETECTION_JOB_PROGRESS messages with the
+    payload: job_id, stage, data.
+    The jobs wait for their turn when many are submitted at once (YOLO_JOBS_CONCURRENCY run at the same time).
+    :param body: the image in base64 format and its type (profile, post or auto)
+    :param user: used as dependency for token validation
+    :return: DetectionJobResponse with the id of the job and its status (queued)
+
+    Throws CustomHTTPException 503 SERVICE_UNAVAILABLE if YOLO_JOBS_MAX_QUEUED jobs are already waiting or running
+    Throws CustomHTTPException 403 FORBIDDEN if the user doesn't exist (invalid token)
+    (the errors of the detection itself, e.g. 400 BAD_REQUEST for an invalid image, are the result of the job)
+    """
+    logger.info(f'Yolo create {body.type} detection job')
+
+    async def detect(job):
+        if body.type == 'profile':
+            return profile_detection_response(await detect_from_profile_capture(body.image), user.id).dict()
+        if body.type == 'post':
+            staged_photos = {}
+            async for stage, data in detect_from_post_capture_progressive(body.image):
+                if stage == 'result':
+                    return post_detection_response(data, user.id, staged_photos).dict()
+                if 'post_photo' in data:
+                    data['post_photo'] = detected_photo(data['post_photo'], user.id, staged_photos)
+                await notify_client(user.id, {'job_id': job.id, 'stage': stage, 'data': data},
+                                    WebsocketType.DETECTION_JOB_PROGRESS)
+        return auto_detection_response(*(await detect_from_auto_capture(body.image)), user.id).dict()
+
+    job = submit_detection_job(user.id, body.type, detect)
+    response = detection_job_response(job, "Detection job created with success")
+    return JSONResponse(status_code=202, content=response.dict())
+
+
+@router.get("/jobs/{job_id}")
+async def get_detection_job_status(job_id: str, user: User = Depends(verify_token)):
+    """
+    Returns the status of a detection job of the user and its result when it is finished (fallback for the clients
+    which missed the DETECTION_JOB_DONE websocket message)
+    :param job_id: the id of the job returned by POST /yolo/jobs
+    :param user: used as dependency for token validation
+    :return: DetectionJobResponse with the status of the job and its result (None while the job is not finished)
+
+    Throws CustomHTTPException 404 NOT_FOUND if the job doesn't exist, it expired or it belongs to another user
+    Throws CustomHTTPException 403 FORBIDDEN if the user doesn't exist (invalid token)
+    """
+    logger.info(f'Yolo get detection job {job_id}')
+
+    response = detection_job_response(get_detection_job(job_id, user.id), "Detection job retrieved with success")
+    return JSONResponse(status_code=200, content=response.dict())
+
+
+@router.post("/post/stream")
+async def detect_post_data_stream(body: PostDetectionRequest, user: User = Depends(verify_token)):
+    """
+    Same as /yolo/post, but the results are streamed as Server-Sent Events (text/event-stream) as soon as each stage
+    of the pipeline is finished, so the client can fill in the fields before the slow comments OCR is done:
+    event "partial", data {"stage": "fields", "post_photo": ..., "no_likes": ..., "date": ...}
+    event "partial", data {"stage": "description", "description": ...}
+    event "result", data PostDetectionResponse (the complete result, also sent alone if the result was cached)
+    event "error", data {"message": ..., "status_code": ...} if the detection failed (e.g. 400 for an invalid image,
+    500 for an unexpected error)
+    :param body: the body of the request containing the image in base64 format
+    :param user: used as dependency for token validation
+    :return: StreamingResponse with the events
+
+    Throws CustomHTTPException 403 FORBIDDEN if the user doesn't exist (invalid token)
+    """
+    logger.info('Yolo detect post (stream)')
+
+    async def events_stream():
+        # THE PHOTO OF THE PARTIAL RESULT AND OF THE COMPLETE RESULT IS STAGED ONLY ONCE
+        staged_photos = {}
+        try:
+            async for stage, data in detect_from_post_capture_progressive(body.image):
+                if stage == 'result':
+                    response = post_detection_response(data, user.id, staged_photos)
+                    yield f'event: result\ndata: {json.dumps(response.dict())}\n\n'
+                else:
+                    if 'post_photo' in data:
+                        data['post_photo'] = detected_photo(data['post_photo'], user.id, staged_photos)
+                    yield f'event: partial\ndata: {json.dumps({"stage": stage, **data})}\n\n'
+        except CustomHTTPException as e:
+            yield f'event: error\ndata: {json.dumps({"message": e.message, "status_code": e.status_code})}\n\n'
+        except Exception as e:
+            # THE RESPONSE HAS ALREADY STARTED, THE EXCEPTION HANDLERS OF THE APP CAN'T SEND THE ERROR ANYMORE
+            logger.error(f'post detection stream failed: {e}')
+            yield f'event: error\ndata: {json.dumps({"message": "Detection failed.", "status_code": 500})}\n\n'
+
+    return StreamingResponse(events_stream(), media_type='text/event-stream')
+
+
+@router.post("/profile/upload")
+async def detect_profile_data_upload(image: UploadFile = File(...), user: User = Depends(verify_token)):
+    """
+    Same as /yolo/profile, but the image is sent as a multipart/form-data file (field "image") instead of base64,
+    the bytes are decoded directly into the cv2 image
+    :param image: the uploaded screenshot (png/jpeg)
+    :param user: used as dependency for token validation
+    :return: ProfileDetectionResponse containing all the data detected in the provided image
+
+    Throws 400 BAD_REQUEST if the file doesn't represent a valid image
+    Throws CustomHTTPException 413 REQUEST_ENTITY_TOO_LARGE if the file is bigger than YOLO_IMAGE_MAX_BYTES
+    Throws CustomHTTPException 403 FORBIDDEN if the user doesn't exist (invalid token)
+    """
+    logger.info('Yolo detect profile (multipart upload)')
+
+    response = profile_detection_response(await detect_from_profile_bytes(await read_image_upload(image)), user.id)
+    return JSONResponse(status_code=200, content=response.dict())
+
+
+@router.post("/profile/raw")
+async def detect_profile_data_raw(request: Request, user: User = Depends(verify_token)):
+    """
+    Same as /yolo/profile, but the body of the request is the image itself (Content-Type: application/octet-stream),
+    the bytes are decoded directly into the cv2 image
+    :param request: the request, its body holds the screenshot (png/jpeg)
+    :param user: used as dependency for token validation
+    :return: ProfileDetectionResponse containing all the data detected in the provided image
+
+    Throws 400 BAD_REQUEST if the body doesn't represent a valid image
+    Throws CustomHTTPException 413 REQUEST_ENTITY_TOO_LARGE if the body is bigger than YOLO_IMAGE_MAX_BYTES
+    Throws CustomHTTPException 403 FORBIDDEN if the user doesn't exist (invalid token)
+    """
+    logger.info('Yolo detect profile (raw body)')
+
+    response = profile_detection_response(await detect_from_profile_bytes(await read_image_body(request)), user.id)
+    return JSONResponse(status_code=200, content=response.dict())
+
+
+@router.post("/post/upload")
+async def detect_post_data_upload(image: UploadFile = File(...), user: User = Depends(verify_token)):
+    """
+    Same as /yolo/post, but the image is sent as a multipart/form-data file (field "image") instead of base64,
+    the bytes are decoded directly into the cv2 image
+    :param image: the uploaded screenshot (png/jpeg)
+    :param user: used as dependency for token validation
+    :return: PostDetectionResponse containing all the data detected in the provided image
+
+    Throws 400 BAD_REQUEST if the file doesn't represent a valid image
+    Throws CustomHTTPException 413 REQUEST_ENTITY_TOO_LARGE if the file is bigger than YOLO_IMAGE_MAX_BYTES
+    Throws CustomHTTPException 403 FORBIDDEN if the user doesn't exist (invalid token)
+    """
+    logger.info('Yolo detect post (multipart upload)')
+
+    response = post_detection_response(await detect_from_post_bytes(await read_image_upload(image)), user.id)
+    return JSONResponse(status_code=200, content=response.dict())
+
+
+@router.post("/post/raw")
+async def detect_post_data_raw(request: Request, user: User = Depends(verify_token)):
+    """
+    Same as /yolo/post, but the body of the request is the image itself (Content-Type: application/octet-stream),
+    the bytes are decoded directly into the cv2 image
+    :param request: the request, its body holds the screenshot (png/jpeg)
+    :param user: used as dependency for token validation
+    :return: PostDetectionResponse containing all the data detected in the provided image
+
+    Throws 400 BAD_REQUEST if the body doesn't represent a valid image
+    Throws CustomHTTPException 413 REQUEST_ENTITY_TOO_LARGE if the body is bigger than YOLO_IMAGE_MAX_BYTES
+    Throws CustomHTTPException 403 FORBIDDEN if the user doesn't exist (invalid token)
+    """
+    logger.info('Yolo detect post (raw body)')
+
+    response = post_detection_response(await detect_from_post_bytes(await read_image_body(request)), user.id)
+    return JSONResponse(status_code=200, content=response.dict())
+
+
+@router.post("/post/sequence")
+async def detect_post_data_sequence(body: PostSequenceDetectionRequest, user: User = Depends(verify_token)):
+    """
+    Detects the data of ONE post from multiple screenshots of it (e.g. the post and its comments, scrolled down between
+    the screenshots), in the scroll order.
+    Only the region of each screenshot which wasn't visible in the previous one is processed, and the comments seen in
+    multiple screenshots are returned only once.
+    The invalid input assigned to undetected labels and the date format are the same as for /yolo/post
+    :param body: the body of the request containing the list of screenshots in base64 format
+    :param user: used as dependency for token validation
+    :return: PostDetectionResponse containing the data merged from all the screenshots
+
+    Throws 400 BAD_REQUEST if an image encoded in base64 doesn't represent a valid image
+    Throws CustomHTTPException 422 UNPROCESSABLE_ENTITY if the list of images is empty or too big
+    Throws CustomHTTPException 403 FORBIDDEN if the user doesn't exist (invalid token)
+    """
+    logger.info(f'Yolo detect post from a sequence of {len(body.images)} images')
+
+    response = post_detection_response(await detect_from_post_sequence(body.images), user.id)
+    return JSONResponse(status_code=200, content=response.dict())
+
+
+@router.post("/post/video")
+async def detect_post_data_video(video: UploadFile = File(...), user: User = Depends(verify_token)):
+    """
+    Detects the posts from a screen recording of a scroll-through (multipart/form-data file, field "video").
+    A few frames per second are sampled, the frames where the screen didn't move are dropped and the remaining
+    keyframes are split into posts (the keyframes of a post are scrolled copies of each other) while the recording
+    is read. Each post is detected like in /yolo/post/sequence and streamed as soon as it is ready.
+    The response is NDJSON (application/x-ndjson): one PostDetectionResponse per line, in the order of the recording,
+    a post which failed has its error message and status_code in its line.
+    The invalid input assigned to undetected labels and the date format are the same as for /yolo/post
+    :param video: the uploaded screen recording (mp4/webm/mov...)
+    :param user: used as dependency for token validation
+    :return: StreamingResponse with a PostDetectionResponse for each detected post
+
+    Throws 400 BAD_REQUEST if the file is not a valid video
+    Throws CustomHTTPException 413 REQUEST_ENTITY_TOO_LARGE if the video is bigger than YOLO_VIDEO_MAX_BYTES
+    Throws CustomHTTPException 422 UNPROCESSABLE_ENTITY if the video is longer than YOLO_VIDEO_MAX_SECONDS
+    Throws CustomHTTPException 403 FORBIDDEN if the user doesn't exist (invalid token)
+    """
+    logger.info('Yolo detect posts from a video')
+
+    video_path = await save_video_upload(video)
+    try:
+        # THE WORKER READS THE RECORDING AND SENDS EACH POST AS SOON AS IT IS DETECTED (AND REMOVES THE RECORDING)
+        events = detect_from_post_video_progressive(video_path)
+        # THE RECORDING IS VALIDATED BEFORE THE RESPONSE STARTS, SO AN INVALID VIDEO FAILS THE WHOLE REQUEST
+        await anext(events)
+    except BaseException:
+        remove_video(video_path)
+        raise
+
+    def failed_post_response(message, status_code):
+        return PostDetectionResponse(
+            post_photo=None,
+            description=None,
+            no_likes=None,
+            no_comments=None,
+            date=None,
+            comments=[],
+
+            message=message,
+            status_code=status_code,
+        )
+
+    async def posts_stream():
+        try:
+            async for stage, data in events:
+                if stage == 'post':
+                    yield json.dumps(post_detection_response(data, user.id).dict()) + '\n'
+                elif stage == 'error':
+                    yield json.dumps(failed_post_response(data['message'], data['status_code']).dict()) + '\n'
+        except CustomHTTPException as e:
+            yield json.dumps(failed_post_response(e.message, e.status_code).dict()) + '\n'
+        except Exception as e:
+            # THE RESPONSE HAS ALREADY STARTED, THE EXCEPTION HANDLERS OF THE APP CAN'T SEND THE ERROR ANYMORE
+            logger.error(f'video detection stream failed: {e}')
+            yield json.dumps(failed_post_response("Detection failed.", 500).dict()) + '\n'
+        finally:
+            remove_video(video_path)
+
+    return StreamingResponse(posts_stream(), media_type='application/x-ndjson')
+
+
+@router.post("/profile/batch")
+async def detect_profiles_data(body: BatchDetectionRequest, user: User = Depends(verify_token)):
+    """
+    Detects the profile data from multiple screenshots at once, the YOLO model runs over the whole batch and
+    the texts of the images are extracted concurrently.
+    Each image has its own ProfileDetectionResponse in the results list (same order as the request images), an
+    invalid image doesn't fail the whole request, only its response will have status_code 400.
+    The invalid input assigned to undetected labels is the same as for /yolo/profile
+    :param body: the body of the request containing the list of images in base64 format
+    :param user: used as dependency for token validation
+    :return: BatchProfileDetectionResponse with a ProfileDetectionResponse for each image
+
+    Throws CustomHTTPException 422 UNPROCESSABLE_ENTITY if the list of images is empty or too big
+    Throws CustomHTTPException 403 FORBIDDEN if the user doesn't exist (invalid token)
+    """
+    logger.info(f'Yolo detect profile batch of {len(body.images)} images')
+
+    results = []
+    for output in await detect_from_profile_captures(body.images):
+        if isinstance(output, CustomHTTPException):
+            results.append(ProfileDetectionResponse(
+                profile_photo=None,
+                username=None,
+                description=None,
+                no_followers=None,
+                no_following=None,
+                no_of_posts=None,
+
+                message=output.message,
+                status_code=output.status_code,
+            ))
+        else:
+            results.append(profile_detection_response(output, user.id))
+
+    response = BatchProfileDetectionResponse(
+        results=results,
+
+        message="Profiles batch processed",
+        status_code=200,
+    )
+    return JSONResponse(status_code=200, content=response.dict())
+
+
+@router.post("/post/batch")
+async def detect_posts_data(body: BatchDetectionRequest, user: User = Depends(verify_token)):
+    """
+    Detects the post data from multiple screenshots at once, the YOLO model runs over the whole batch and
+    the texts of the images are extracted concurrently.
+    Each image has its own PostDetectionResponse in the results list (same order as the request images), an
+    invalid image doesn't fail the whole request, only its response will have status_code 400.
+    The invalid input assigned to undetected labels and the date format are the same as for /yolo/post
+    :param body: the body of the request containing the list of images in base64 format
+    :param user: used as dependency for token validation
+    :return: BatchPostDetectionResponse with a PostDetectionResponse for each image
+
+    Throws CustomHTTPException 422 UNPROCESSABLE_ENTITY if the list of images is empty or too big
+    Throws CustomHTTPException 403 FORBIDDEN if the user doesn't exist (invalid token)
+    """
+    logger.info(f'Yolo detect post batch of {len(body.images)} images')
+
+    results = []
+    for output in await detect_from_post_captures(body.images):
+        if isinstance(output, CustomHTTPException):
+            results.append(PostDetectionResponse(
+                post_photo=None,
+                description=None,
+                no_likes=None,
+                no_comments=None,
+                date=None,
+                comments=[],
+
+                message=output.message,
+                status_code=output.status_code,
+            ))
+        else:
+            results.append(post_detection_response(output, user.id))
+
+    response = BatchPostDetectionResponse(
+        results=results,
+
+        message="Posts batch processed",
+        status_code=200,
+    )
+    return JSONResponse(status_code=200, content=response.dict())
+
+
+@router.get("/metrics")
+async def detection_metrics(user: User = Depends(verify_token)):
+    """
+    Returns the metrics of the detection pipeline (e.g. the queue depth and batch sizes of the YOLO schedulers)
+    With detection worker processes, the metrics of each worker are the last ones it published (every
+    YOLO_WORKER_METRICS_SECONDS), so this endpoint never waits for a free worker
+    :param user: used as dependency for token validation
+    :return: DetectionMetricsResponse with the metrics
+
+    Throws CustomHTTPException 403 FORBIDDEN if the user doesn't exist (invalid token)
+    """
+    logger.info('Yolo detection metrics')
+
+    response = DetectionMetricsResponse(
+        metrics=await get_detection_metrics(),
+
+        message="Detection metrics retrieved with success",
         status_code=200,
     )
     return JSONResponse(status_code=200, content=response.dict())
+
+
+def model_registry_response(state: dict, message: str, metrics: dict | None = None) -> ModelRegistryResponse:
+    """
+    Creates the response of a model registry endpoint
+    :param state: the state of the registry (see get_registry_state)
+    :param message: the message of the response
+    :param metrics: the metrics of the loaded models (see get_model_registry_metrics)
+    :return: the ModelRegistryResponse
+    """
+    return ModelRegistryResponse(
+        state=state,
+        metrics=metrics,
+
+        message=message,
+        status_code=200,
+    )
+
+
+@router.get("/models")
+async def get_models(user: User = Depends(verify_admin_token)):
+    """
+    Returns the active, previous and candidate weights of the profile and post models, and the metrics of the loaded
+    models: the latency of the active and candidate models and the agreement of their boxes (shadow mode)
+    :param user: used as dependency for token validation, must be an administrator
+    :return: ModelRegistryResponse with the state and the metrics
+
+    Throws CustomHTTPException 403 FORBIDDEN if the token is invalid or the user is not an administrator
+    """
+    logger.info('Yolo model registry')
+
+    response = model_registry_response(get_registry_state(), "Model registry retrieved with success",
+                                       await get_model_registry_metrics())
+    return JSONResponse(status_code=200, content=response.dict())
+
+
+@router.post("/models/{kind}/candidate")
+async def set_candidate(kind: str, body: ModelCandidateRequest, user: User = Depends(verify_admin_token)):
+    """
+    Sets the candidate weights of a model, the candidate runs in shadow mode over a sample of the detections (its
+    boxes are compared with the boxes of the active model but never returned), the workers load it without restarting
+    :param kind: profile or post
+    :param body: the weights of the candidate and the fraction of the detections it runs over
+    :param user: used as dependency for token validation, must be an administrator
+    :return: ModelRegistryResponse with the new state
+
+    Throws CustomHTTPException 404 NOT_FOUND if the kind is unknown or the weights file doesn't exist
+    Throws CustomHTTPException 422 UNPROCESSABLE_ENTITY if the weights are outside YOLO_MODELS_DIR or the shadow rate
+                                                        is not between 0 and 1
+    Throws CustomHTTPException 403 FORBIDDEN if the token is invalid or the user is not an administrator
+    """
+    logger.info(f'Yolo set {kind} candidate model {body.weights_path}')
+
+    state = set_candidate_model(kind, body.weights_path, body.shadow_rate)
+    response = model_registry_response(state, "Candidate model set with success")
+    return JSONResponse(status_code=200, content=response.dict())
+
+
+@router.delete("/models/{kind}/candidate")
+async def delete_candidate(kind: str, user: User = Depends(verify_admin_token)):
+    """
+    Removes the candidate of a model (stops its shadow mode)
+    :param kind: profile or post
+    :param user: used as dependency for token validation, must be an administrator
+    :return: ModelRegistryResponse with the new state
+
+    Throws CustomHTTPException 404 NOT_FOUND if the kind is unknown
+    Throws CustomHTTPException 403 FORBIDDEN if the token is invalid or the user is not an administrator
+    """
+    logger.info(f'Yolo remove {kind} candidate model')
+
+    response = model_registry_response(remove_candidate_model(kind), "Candidate model removed with success")
+    return JSONResponse(status_code=200, content=response.dict())
+
+
+@router.post("/models/{kind}/promote")
+async def promote_candidate(kind: str, user: User = Depends(verify_admin_token)):
+    """
+    The candidate of a model becomes its active model (the old active model is kept for rollback), the workers swap
+    the models without restarting and forget the cached results and layouts of the old model
+    :param kind: profile or post
+    :param user: used as dependency for token validation, must be an administrator
+    :return: ModelRegistryResponse with the new state
+
+    Throws CustomHTTPException 404 NOT_FOUND if the kind is unknown
+    Throws CustomHTTPException 409 CONFLICT if the model has no candidate
+    Throws CustomHTTPException 403 FORBIDDEN if the token is invalid or the user is not an administrator
+    """
+    logger.info(f'Yolo promote {kind} candidate model')
+
+    response = model_registry_response(promote_candidate_model(kind), "Candidate model promoted with success")
+    return JSONResponse(status_code=200, content=response.dict())
+
+
+@router.post("/models/{kind}/rollback")
+async def rollback(kind: str, user: User = Depends(verify_admin_token)):
+    """
+    The previous active model of a model becomes its active model again (undoes the last promotion)
+    :param kind: profile or post
+    :param user: used as dependency for token validation, must be an administrator
+    :return: ModelRegistryResponse with the new state
+
+    Throws CustomHTTPException 404 NOT_FOUND if the kind is unknown
+    Throws CustomHTTPException 409 CONFLICT if the model has no previous model
+    Throws CustomHTTPException 403 FORBIDDEN if the token is invalid or the user is not an administrator
+    """
+    logger.info(f'Yolo roll back {kind} model')
+
+    response = model_registry_response(rollback_model(kind), "Model rolled back with success")
+    return JSONResponse(status_code=200, content=response.dict())
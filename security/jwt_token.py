@@ -16,6 +16,9 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = float(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
+# COMMA SEPARATED USERNAMES ALLOWED TO USE THE ADMINISTRATION ENDPOINTS (e.g. THE YOLO MODEL REGISTRY)
+# NOBODY IF NOT SET
+ADMIN_USERNAMES = {username.strip() for username in os.getenv("ADMIN_USERNAMES", "").split(",") if username.strip()}
 
 
 def create_access_token(data: dict):
@@ -72,6 +75,22 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Security(security),
         )
 
 
+def verify_admin_token(user=Depends(verify_token)):
+    """
+    Function used to validate the token received in a request of an administration endpoint
+    :param user: the user of the token (validated by verify_token)
+    :return: the user if he is an administrator (his username is in ADMIN_USERNAMES)
+    Throws CustomHTTPException 403 FORBIDDEN if the token is invalid or the user is not an administrator
+    """
+    if user.username not in ADMIN_USERNAMES:
+        logger.error(f'user {user.username} is not an administrator')
+        raise CustomHTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            message="Administrator rights required"
+        )
+    return user
+
+
 def verify_token_websocket(token: str, db: Session):
     """
     Function used to validate the given token
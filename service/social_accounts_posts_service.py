@@ -9,7 +9,7 @@ from logging_config import logger
 from model.entities import Post
 from repo.social_account_post_repo import add_social_account_post, delete_social_account_post, \
     update_social_account_post
-from service.utils.photos_utils import save_profile_photo
+from service.utils.photos_utils import save_photo
 from validator.social_accounts_post_validator import validate_social_account_post_add, \
     validate_social_account_post_update
 
@@ -31,12 +31,13 @@ def add_social_account_post_service(social_account_post: AddSocialAccountPostReq
     """
     logger.info('add social account post')
     # VALIDATE THE POST
-    validate_social_account_post_add(social_account_post)
+    validate_social_account_post_add(social_account_post, user_id)
 
-    # SAVE THE POST PHOTOS ON THE FILESYSTEM, THEN PASS TO REPO THE FILE_PATH OF THE POST PHOTOS
+    # SAVE THE POST PHOTOS ON THE FILESYSTEM (OR MOVE THE STAGED DETECTED PHOTOS), THEN PASS TO REPO THE FILE_PATH OF
+    # THE POST PHOTOS
     post_photos_paths = []
-    for photo_base64 in social_account_post.photos:
-        photo_path = save_profile_photo(photo_base64)
+    for photo in social_account_post.photos:
+        photo_path = save_photo(photo, user_id)
         post_photos_paths.append(photo_path)
 
     created_post = add_social_account_post(social_account_post.description,
@@ -87,12 +88,13 @@ def update_social_account_post_service(post_to_update: UpdateSocialAccountPostRe
     """
     logger.info('update post')
     # VALIDATE THE POST
-    validate_social_account_post_update(post_to_update)
+    validate_social_account_post_update(post_to_update, user_id)
 
-    # SAVE THE POST PHOTOS ON THE FILESYSTEM, THEN PASS TO REPO THE POST PHOTOS WITH FILE_PATHS
+    # SAVE THE POST PHOTOS ON THE FILESYSTEM (OR MOVE THE STAGED DETECTED PHOTOS), THEN PASS TO REPO THE POST PHOTOS
+    # WITH FILE_PATHS
     post_photos_with_filenames: List[PostPhoto] = []
     for photo in post_to_update.photos:
-        photo_path = save_profile_photo(photo.photo_url)
+        photo_path = save_photo(photo.photo_url, user_id)
         post_photos_with_filenames.append(PostPhoto(
             id=photo.id,
             photo_url=photo_path
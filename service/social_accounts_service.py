@@ -12,7 +12,7 @@ from model.entities import Post, SocialMediaAccount
 
 from repo.social_account_repo import add_social_account, delete_social_account, get_user_social_account, \
     update_social_account_repo
-from service.utils.photos_utils import save_profile_photo
+from service.utils.photos_utils import save_photo
 from validator.social_accounts_validator import validate_social_account_add, validate_social_account_update
 
 STORAGE_DIR = os.getenv("STORAGE_DIR")
@@ -31,10 +31,11 @@ def add_social_account_service(social_account: AddSocialAccountReq, user_id: int
     logger.info('add social account')
 
     # VALIDATE THE SOCIAL ACCOUNT
-    validate_social_account_add(social_account)
+    validate_social_account_add(social_account, user_id)
 
-    # SAVE THE PHOTO ON THE FILESYSTEM, THEN PASS TO REPO THE FILE_PATH OF THE PROFILE PHOTO
-    photo_path = save_profile_photo(social_account.profile_photo)
+    # SAVE THE PHOTO ON THE FILESYSTEM (OR MOVE THE STAGED DETECTED PHOTO), THEN PASS TO REPO THE FILE_PATH OF THE
+    # PROFILE PHOTO
+    photo_path = save_photo(social_account.profile_photo, user_id)
 
     social_acc_created = add_social_account(social_account.username,
                                             social_account.profile_description,
@@ -163,10 +164,11 @@ def update_social_account(social_account: UpdateSocialAccountReq, user_id: int,
     logger.info('update social account')
 
     # VALIDATE THE SOCIAL ACCOUNT
-    validate_social_account_update(social_account)
+    validate_social_account_update(social_account, user_id)
 
-    # SAVE THE PHOTO ON THE FILESYSTEM, THEN PASS TO REPO THE FILE_PATH OF THE PROFILE PHOTO
-    photo_path = save_profile_photo(social_account.profile_photo)
+    # SAVE THE PHOTO ON THE FILESYSTEM (OR MOVE THE STAGED DETECTED PHOTO), THEN PASS TO REPO THE FILE_PATH OF THE
+    # PROFILE PHOTO
+    photo_path = save_photo(social_account.profile_photo, user_id)
 
     social_acc_updated, old_photo_filename = update_social_account_repo(
         social_account.id,
@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory cache with a maximum number of entries (the least recently used entry is evicted first)
+    and an optional time to live for each entry. Counts the hits, misses and evictions.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float | None = None):
+        """
+        :param max_entries: the maximum number of entries kept in memory (0 disables the cache)
+        :param ttl_seconds: how long an entry is valid, None = entries don't expire
+        """
+        self.max_entries = max(0, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        :param key: the key of the entry
+        :param default: returned if the key is not cached or if the entry expired
+        :return: the cached value or the default value
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, created = entry
+                if self.ttl_seconds is None or time.monotonic() - created <= self.ttl_seconds:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """
+        Adds/replaces the entry and evicts the least recently used entries if the cache is full
+        :param key: the key of the entry
+        :param value: the value to be cached
+        """
+        if self.max_entries == 0:
+            return
+        with self.lock:
+            self.entries[key] = (value, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def keys(self) -> list:
+        """
+        :return: the keys of the entries (including the expired ones not removed yet), from the least to the most
+        recently used
+        """
+        with self.lock:
+            return list(self.entries.keys())
+
+    def remove(self, key):
+        """
+        Removes the entry (if it exists)
+        :param key: the key of the entry
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        """
+        Removes all the entries (the counters are kept)
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        """
+        :return: the size and the hit/miss/eviction counters of the cache
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,314 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from uuid import uuid4
+
+import cv2
+import numpy as np
+
+from logging_config import logger
+from service.utils.cache_utils import LRUCache
+from service.utils.yolo_utils import perceptual_hash, hash_distance, image_thumbnail
+
+# MAXIMUM NUMBER OF DETECTION RESULTS KEPT IN MEMORY (FOR EACH MODEL) AND HOW LONG THEY ARE VALID
+YOLO_CACHE_MAX_ENTRIES = int(os.getenv("YOLO_CACHE_MAX_ENTRIES", "256"))
+YOLO_CACHE_TTL_SECONDS = float(os.getenv("YOLO_CACHE_TTL_SECONDS", "3600"))
+# OPTIONAL ON-DISK TIER (SHARED BY THE DETECTION WORKERS AND KEPT BETWEEN RESTARTS), DISABLED IF NOT SET
+YOLO_CACHE_DIR = os.getenv("YOLO_CACHE_DIR")
+# THE CACHED SCREENSHOTS OF THE SAME SIZE WHOSE HASH DIFFERS IN AT MOST THIS MANY BITS (OUT OF 256) ARE CANDIDATES
+# (A JPEG RE-ENCODE FLIPS THE FEW BITS WHICH ARE CLOSE TO THE MEDIAN), AT MOST YOLO_CACHE_MAX_CANDIDATES OF THEM (THE
+# CLOSEST ONES) ARE VERIFIED
+YOLO_CACHE_MAX_HASH_DISTANCE = int(os.getenv("YOLO_CACHE_MAX_HASH_DISTANCE", "12"))
+YOLO_CACHE_MAX_CANDIDATES = 3
+# A CANDIDATE IS THE SAME SCREENSHOT ONLY IF THEIR THUMBNAILS (GRAYSCALE, YOLO_CACHE_THUMBNAIL_WIDTH PIXELS WIDE) DON'T
+# DIFFER MORE THAN YOLO_CACHE_MAX_BLOCK_DIFF (MEAN GRAY LEVEL DIFFERENCE) IN ANY BLOCK OF 4x4 PIXELS
+# AT THIS WIDTH A CHANGED DIGIT (e.g. 1,234 followers vs 1,235 followers) DIFFERS BY ~100 IN ITS BLOCKS, THE NOISE OF A
+# JPEG RE-ENCODE BY LESS THAN ~5 (AT 128 PIXELS, THE DIGIT WAS ALMOST AS FAINT AS THE NOISE)
+YOLO_CACHE_THUMBNAIL_WIDTH = int(os.getenv("YOLO_CACHE_THUMBNAIL_WIDTH", "480"))
+YOLO_CACHE_MAX_BLOCK_DIFF = float(os.getenv("YOLO_CACHE_MAX_BLOCK_DIFF", "24"))
+YOLO_CACHE_BLOCK_SIZE = 4
+# EVERY HOW MANY WRITES THE EXPIRED FILES OF THE DISK TIER ARE REMOVED
+YOLO_CACHE_DISK_SWEEP_EVERY = 100
+# HOW OFTEN EACH PROCESS LISTS THE FILES OF THE DISK TIER AGAIN (TO SEE THE ENTRIES WRITTEN BY THE OTHER WORKERS), THE
+# LOOKUPS USE THE LAST LISTING INSTEAD OF LISTING THE DIRECTORY EACH TIME
+YOLO_CACHE_DISK_INDEX_SECONDS = float(os.getenv("YOLO_CACHE_DISK_INDEX_SECONDS", "10"))
+# THE ENTRIES OF THE DISK TIER ARE npz FILES WITHOUT PICKLED OBJECTS (THE DIRECTORY IS SHARED, LOADING A PICKLE WRITTEN
+# BY SOMEONE ELSE WOULD RUN ITS CODE): THE THUMBNAIL, THE RESULT AS JSON AND THE BYTES VALUES OF THE RESULT
+YOLO_CACHE_FILE_EXTENSION = '.npz'
+
+
+class DetectionCache:
+    """
+    Cache with the results of the detection pipeline, keyed by the perceptual hash of the decoded screenshot. A
+    screenshot is looked up among the cached screenshots with a close hash (hamming distance), so a re-uploaded
+    screenshot is found even if the client re-encoded it, then verified with its thumbnail.
+    In-memory LRU tier with TTL and an optional on-disk tier (YOLO_CACHE_DIR), the keys of the disk tier are listed
+    at most every YOLO_CACHE_DISK_INDEX_SECONDS.
+    The thumbnails are kept PNG encoded (a 480 pixels wide grayscale screenshot takes ~0.5MB decoded).
+    """
+
+    def __init__(self, name: str):
+        """
+        :param name: the name of the cache (the kind of screenshots it holds e.g. profile/post)
+        """
+        self.name = name
+        self.memory = LRUCache(YOLO_CACHE_MAX_ENTRIES, YOLO_CACHE_TTL_SECONDS)
+        self.disk_dir = YOLO_CACHE_DIR
+        self.disk_keys = set()
+        self.disk_keys_listed_at = None
+        self.lock = threading.Lock()
+        self.disk_hits = 0
+        self.disk_writes = 0
+        self.rejected = 0
+
+    def fingerprint(self, image):
+        """
+        :param image: the decoded screenshot (cv2)
+        :return: the key of the screenshot and its thumbnail (used to verify a cached entry)
+        """
+        height, width = image.shape[:2]
+        return f'{self.name}_{width}x{height}_{perceptual_hash(image)}', \
+            image_thumbnail(image, YOLO_CACHE_THUMBNAIL_WIDTH)
+
+    def get(self, key: str, thumbnail):
+        """
+        :param key: the key of the screenshot (see fingerprint)
+        :param thumbnail: the thumbnail of the screenshot (see fingerprint)
+        :return: the cached detection result or None
+        """
+        candidates = self.candidate_keys(key)
+        for candidate in candidates:
+            entry = self.memory.get(candidate)
+            if entry is None and self.disk_dir:
+                entry = self.read_from_disk(candidate)
+                if entry is not None:
+                    self.memory.put(candidate, entry)
+            # SCREENSHOTS WITH CLOSE HASHES (e.g. SAME PROFILE, ONE NUMBER CHANGED) ARE NOT ALWAYS THE SAME SCREENSHOT
+            if entry is not None and same_thumbnails(entry['thumbnail'], thumbnail):
+                logger.info(f'{self.name} detection cache hit')
+                return entry['result']
+
+        if candidates:
+            with self.lock:
+                self.rejected += 1
+        return None
+
+    def candidate_keys(self, key: str) -> list:
+        """
+        :param key: the key of the screenshot (see fingerprint)
+        :return: the keys of the cached screenshots of the same size whose hash differs in at most
+        YOLO_CACHE_MAX_HASH_DISTANCE bits, the closest YOLO_CACHE_MAX_CANDIDATES ones (the closest first)
+        """
+        prefix, image_hash = key.rsplit('_', 1)
+        keys = set(self.memory.keys())
+        if self.disk_dir:
+            keys.update(self.list_disk_keys())
+
+        distances = []
+        for cached_key in keys:
+            cached_prefix, cached_hash = cached_key.rsplit('_', 1)
+            if cached_prefix != prefix or len(cached_hash) != len(image_hash):
+                continue
+            distance = hash_distance(image_hash, cached_hash)
+            if distance <= YOLO_CACHE_MAX_HASH_DISTANCE:
+                distances.append((distance, cached_key))
+        distances.sort()
+        return [cached_key for _, cached_key in distances[:YOLO_CACHE_MAX_CANDIDATES]]
+
+    def put(self, key: str, thumbnail, result):
+        """
+        Caches the detection result of a screenshot
+        :param key: the key of the screenshot (see fingerprint)
+        :param thumbnail: the thumbnail of the screenshot (see fingerprint)
+        :param result: the detection result (a tuple of JSON values, bytes and datetimes for the disk tier)
+        """
+        _, encoded_thumbnail = cv2.imencode('.png', thumbnail)
+        entry = {'thumbnail': encoded_thumbnail.tobytes(), 'result': result}
+        self.memory.put(key, entry)
+        if self.disk_dir:
+            self.write_to_disk(key, entry)
+
+    def list_disk_keys(self) -> set:
+        """
+        :return: the keys of the entries of the disk tier, listed again if the last listing is older than
+        YOLO_CACHE_DISK_INDEX_SECONDS (the entries written by this process are added when they are written)
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.disk_keys_listed_at is None or now - self.disk_keys_listed_at > YOLO_CACHE_DISK_INDEX_SECONDS:
+                try:
+                    self.disk_keys = {filename[:-len(YOLO_CACHE_FILE_EXTENSION)]
+                                      for filename in os.listdir(self.disk_dir)
+                                      if filename.startswith(f'{self.name}_') and
+                                      filename.endswith(YOLO_CACHE_FILE_EXTENSION)}
+                except FileNotFoundError:
+                    self.disk_keys = set()
+                self.disk_keys_listed_at = now
+            return set(self.disk_keys)
+
+    def clear(self):
+        """
+        Removes all the cached results (e.g. when the model changes)
+        """
+        self.memory.clear()
+        with self.lock:
+            self.disk_keys = set()
+        if self.disk_dir and os.path.isdir(self.disk_dir):
+            for filename in os.listdir(self.disk_dir):
+                if filename.startswith(f'{self.name}_'):
+                    remove_file(os.path.join(self.disk_dir, filename))
+
+    def read_from_disk(self, key: str):
+        """
+        :param key: the key of the screenshot
+        :return: the entry stored on disk or None if it doesn't exist or it expired
+        """
+        file_path = os.path.join(self.disk_dir, f'{key}{YOLO_CACHE_FILE_EXTENSION}')
+        try:
+            if time.time() - os.path.getmtime(file_path) > YOLO_CACHE_TTL_SECONDS:
+                remove_file(file_path)
+                with self.lock:
+                    self.disk_keys.discard(key)
+                return None
+            with np.load(file_path, allow_pickle=False) as arrays:
+                entry = {
+                    'thumbnail': arrays['thumbnail'].tobytes(),
+                    'result': decode_result(arrays['result'].tobytes().decode('utf-8'),
+                                            [arrays[f'blob_{i}'].tobytes() for i in range(len(arrays.files) - 2)]),
+                }
+        except FileNotFoundError:
+            with self.lock:
+                self.disk_keys.discard(key)
+            return None
+        except Exception as e:
+            logger.error(f'Could not read detection cache file {file_path}: {e}')
+            return None
+        with self.lock:
+            self.disk_hits += 1
+        return entry
+
+    def write_to_disk(self, key: str, entry):
+        """
+        Writes the entry on disk (the file is written under a temporary name and then renamed, so the other workers
+        never read a partially written file)
+        :param key: the key of the screenshot
+        :param entry: the entry to be stored
+        """
+        file_path = os.path.join(self.disk_dir, f'{key}{YOLO_CACHE_FILE_EXTENSION}')
+        tmp_path = f'{file_path}.{uuid4().hex}.tmp'
+        try:
+            result_json, blobs = encode_result(entry['result'])
+            arrays = {f'blob_{i}': np.frombuffer(blob, np.uint8) for i, blob in enumerate(blobs)}
+            os.makedirs(self.disk_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, thumbnail=np.frombuffer(entry['thumbnail'], np.uint8),
+                         result=np.frombuffer(result_json.encode('utf-8'), np.uint8), **arrays)
+            os.replace(tmp_path, file_path)
+        except Exception as e:
+            logger.error(f'Could not write detection cache file {file_path}: {e}')
+            remove_file(tmp_path)
+            return
+
+        with self.lock:
+            self.disk_keys.add(key)
+            self.disk_writes += 1
+            sweep = self.disk_writes % YOLO_CACHE_DISK_SWEEP_EVERY == 0
+        if sweep:
+            self.remove_expired_files()
+
+    def remove_expired_files(self):
+        """
+        Removes the files of the disk tier older than the TTL
+        """
+        now = time.time()
+        for filename in os.listdir(self.disk_dir):
+            file_path = os.path.join(self.disk_dir, filename)
+            try:
+                if filename.startswith(f'{self.name}_') and \
+                        now - os.path.getmtime(file_path) > YOLO_CACHE_TTL_SECONDS:
+                    remove_file(file_path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        """
+        :return: the metrics of the memory tier, the disk hits and the entries rejected by the thumbnail check
+        """
+        with self.lock:
+            return {
+                **self.memory.stats(),
+                'disk_enabled': bool(self.disk_dir),
+                'disk_hits': self.disk_hits,
+                'rejected': self.rejected,
+            }
+
+
+def encode_result(result) -> tuple:
+    """
+    Encodes a detection result as JSON, the bytes values (e.g. the jpeg photos) are taken out of the JSON
+    :param result: the detection result, a tuple of JSON values, bytes (or bytearray) and datetimes
+    :return: the JSON text and the list with the bytes values (the JSON refers to them by their index)
+    Throws TypeError if the result has a value of another type
+    """
+    blobs = []
+
+    def encode_value(value):
+        if isinstance(value, (bytes, bytearray)):
+            blobs.append(bytes(value))
+            return {'bytes': len(blobs) - 1}
+        if isinstance(value, datetime):
+            return {'datetime': value.isoformat()}
+        if isinstance(value, (list, tuple)):
+            return [encode_value(item) for item in value]
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return value
+        raise TypeError(f'Cannot store a {type(value).__name__} in the detection cache')
+
+    return json.dumps([encode_value(value) for value in result]), blobs
+
+
+def decode_result(result_json: str, blobs: list) -> tuple:
+    """
+    :param result_json: the JSON text of a detection result (see encode_result)
+    :param blobs: the bytes values of the detection result
+    :return: the detection result
+    """
+    def decode_value(value):
+        if isinstance(value, dict):
+            if 'bytes' in value:
+                return blobs[value['bytes']]
+            return datetime.fromisoformat(value['datetime'])
+        if isinstance(value, list):
+            return [decode_value(item) for item in value]
+        return value
+
+    return tuple(decode_value(value) for value in json.loads(result_json))
+
+
+def same_thumbnails(encoded_thumbnail, thumbnail) -> bool:
+    """
+    :param encoded_thumbnail: the PNG encoded thumbnail of a cached screenshot
+    :param thumbnail: the thumbnail of a screenshot (see DetectionCache.fingerprint)
+    :return: True if no block of YOLO_CACHE_BLOCK_SIZE x YOLO_CACHE_BLOCK_SIZE pixels of the thumbnails differs more
+    than YOLO_CACHE_MAX_BLOCK_DIFF (the blocks average out the noise of a JPEG re-encode, not a changed glyph)
+    """
+    cached_thumbnail = cv2.imdecode(np.frombuffer(encoded_thumbnail, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if cached_thumbnail is None or cached_thumbnail.shape != thumbnail.shape:
+        return False
+    diff = cv2.absdiff(cached_thumbnail, thumbnail).astype(np.float32)
+    height, width = diff.shape
+    blocks = cv2.resize(diff, (max(1, width // YOLO_CACHE_BLOCK_SIZE), max(1, height // YOLO_CACHE_BLOCK_SIZE)),
+                        interpolation=cv2.INTER_AREA)
+    return float(blocks.max()) <= YOLO_CACHE_MAX_BLOCK_DIFF
+
+
+def remove_file(file_path: str):
+    """
+    Removes a file, ignoring it if it was already removed
+    """
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
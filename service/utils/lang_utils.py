@@ -83,13 +83,9 @@ def predict_text_language_lingua(text):
     The detection is made based on the included languages in the COMMON_LANGUAGES_LINGUA list
     If no language was detected, then english will be the default language returned
     :param text: the text from which we predict the language
-    :return: the predicted language
+    :return: the predicted language (see predict_text_language_lingua_with_confidence)
     """
-    # FIND THE LANGUAGE WITH LINGUA
-    detected_language = detector.detect_language_of(text)
-    if detected_language is None:
-        return 'eng'
-    return detected_language.iso_code_639_3.name.lower()
+    return predict_text_language_lingua_with_confidence(text)[0]
 
 
 def predict_text_language_fasttext_lid218(text):
@@ -98,15 +94,56 @@ def predict_text_language_fasttext_lid218(text):
     extracts the first language detected with the highest probability, that is also included in the COMMON_LANGUAGES
     list, if no common language was detected, then english will be the default language returned
     :param text: the text from which we predict the language
-    :return: the predicted language
+    :return: the predicted language (see predict_text_language_fasttext_lid218_with_confidence)
+    """
+    src_lang = predict_text_language_fasttext_lid218_with_confidence(text)[0]
+    print(f"Lang Detected:", src_lang)
+    return src_lang
+
+
+def predict_text_language_lingua_with_confidence(text):
+    """
+    Predicts the language of the given text with lingua model (very accurate for short and mixed texts), together with
+    the confidence of the prediction
+    The detection is made based on the included languages in the COMMON_LANGUAGES_LINGUA list
+    If no language was detected, then english will be the default language returned (with confidence 0)
+    :param text: the text from which we predict the language
+    :return: the predicted language and its confidence (0-1)
+    """
+    confidence_values = detector.compute_language_confidence_values(text)
+    if len(confidence_values) == 0 or confidence_values[0].value == 0:
+        return 'eng', 0.0
+    # THE CONFIDENCE VALUES ARE SORTED IN DESCENDING ORDER
+    return confidence_values[0].language.iso_code_639_3.name.lower(), confidence_values[0].value
+
+
+def predict_text_language_fasttext_lid218_with_confidence(text):
+    """
+    Predicts the language of the given text, the languages predicted by the lid218 model are filtered, and the function
+    extracts the first language detected with the highest probability, that is also included in the COMMON_LANGUAGES
+    list, if no common language was detected, then english will be the default language returned (with probability 0)
+    :param text: the text from which we predict the language
+    :return: the predicted language and its probability (0-1)
     """
-    src_lang = 'eng'
     # LIST WITH ALL THE LANGUAGES SORTED BASED ON PROBABILITIES
-    predictions = modelLID.predict(text, k=218)
-    for prediction in predictions[0]:
-        lang = prediction.replace('__label__', '').split('_')[0]
+    labels, probabilities = modelLID.predict(text, k=218)
+    for label, probability in zip(labels, probabilities):
+        lang = label.replace('__label__', '').split('_')[0]
         if lang in COMMON_LANGUAGES:
-            src_lang = prediction.replace('__label__', '').split('_')[0]
-            print(f"Lang Detected:", src_lang)
-            return src_lang
-    return src_lang
+            return lang, float(probability)
+    return 'eng', 0.0
+
+
+def predict_text_language_with_confidence(text):
+    """
+    Predicts the language of an already denoised text (see normalize_text_for_language_analysis), with lingua for
+    short texts and with lid218 for long texts
+    :param text: the denoised text
+    :return: the predicted language and its confidence (0-1)
+    """
+    # VERIFY IF IT IS A SHORT/LONG TEXT
+    if len(text) <= MAX_CHARACTERS_LENGTH_LINGUA:
+        # DETECT THE LANGUAGE WITH LINGUA
+        return predict_text_language_lingua_with_confidence(text)
+    # DETECT THE LANGUAGE WITH lid218
+    return predict_text_language_fasttext_lid218_with_confidence(text)
@@ -0,0 +1,188 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from logging_config import logger
+from service.utils.cache_utils import LRUCache
+from service.utils.yolo_utils import Detections
+
+# FAST PATH WHICH SKIPS YOLO FOR THE SCREENSHOTS WITH AN ALREADY KNOWN LAYOUT (SAME DEVICE, SAME APP VERSION, SAME
+# AMOUNT OF CONTENT), DISABLED BY DEFAULT
+YOLO_TEMPLATES_ENABLED = os.getenv("YOLO_TEMPLATES_ENABLED", "false").lower() == "true"
+# MAXIMUM NUMBER OF LAYOUTS KEPT (FOR EACH MODEL) AND HOW LONG THEY ARE VALID
+YOLO_TEMPLATE_MAX_ENTRIES = int(os.getenv("YOLO_TEMPLATE_MAX_ENTRIES", "32"))
+YOLO_TEMPLATE_TTL_SECONDS = float(os.getenv("YOLO_TEMPLATE_TTL_SECONDS", "86400"))
+# A LAYOUT IS LEARNED ONLY FROM A DETECTION WHERE ALL THE BOXES HAVE AT LEAST THIS CONFIDENCE
+YOLO_TEMPLATE_MIN_CONF = float(os.getenv("YOLO_TEMPLATE_MIN_CONF", "0.8"))
+# AFTER THIS MANY REUSES THE LAYOUT IS FORGOTTEN, SO THE NEXT SCREENSHOT IS DETECTED (AND LEARNED) AGAIN BY YOLO
+YOLO_TEMPLATE_MAX_HITS = int(os.getenv("YOLO_TEMPLATE_MAX_HITS", "50"))
+# THE EDGES OUTSIDE THE BOXES (THE STATIC INTERFACE: ICONS, BUTTONS, SEPARATORS AND THE EMPTY SPACE BETWEEN THE BOXES)
+# OF THE SCREENSHOT AND OF THE LAYOUT MAY DIFFER AT MOST THIS MUCH (FRACTION OF THEIR EDGE PIXELS)
+YOLO_TEMPLATE_MAX_MISMATCH = float(os.getenv("YOLO_TEMPLATE_MAX_MISMATCH", "0.1"))
+# THE WIDTH OF THE EDGE MAPS USED TO COMPARE THE SCREENSHOTS
+YOLO_TEMPLATE_EDGES_WIDTH = 256
+
+
+class LayoutTemplates:
+    """
+    Cache with the boxes detected by YOLO in confident detections, keyed by the resolution of the screenshot.
+    A new screenshot with the same resolution reuses the boxes only if its edges outside the boxes (the anchors of the
+    layout) match the edges of the learned screenshot and all its text boxes still contain text, otherwise YOLO is
+    used (and the new layout is learned).
+    """
+
+    def __init__(self, name: str):
+        """
+        :param name: the name of the templates (the kind of screenshots e.g. profile/post)
+        """
+        self.name = name
+        self.enabled = YOLO_TEMPLATES_ENABLED
+        self.templates = LRUCache(YOLO_TEMPLATE_MAX_ENTRIES, YOLO_TEMPLATE_TTL_SECONDS)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.rejected = 0
+        self.learned = 0
+
+    def key(self, image):
+        """
+        :param image: the decoded screenshot (cv2)
+        :return: the key of the layout of the screenshot (its resolution)
+        """
+        height, width = image.shape[:2]
+        return f'{self.name}_{width}x{height}'
+
+    @staticmethod
+    def edges(image):
+        """
+        :param image: the decoded screenshot (cv2)
+        :return: the edge map of a reduced copy of the screenshot (works the same for light and dark mode)
+        """
+        height, width = image.shape[:2]
+        edges_height = max(1, round(height * YOLO_TEMPLATE_EDGES_WIDTH / width))
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        small = cv2.resize(gray, (YOLO_TEMPLATE_EDGES_WIDTH, edges_height), interpolation=cv2.INTER_AREA)
+        return cv2.Canny(small, 50, 150) > 0
+
+    @staticmethod
+    def small_boxes(normalized_xyxy, edges_shape):
+        """
+        :param normalized_xyxy: the boxes with coordinates between 0 and 1
+        :param edges_shape: the shape of the edge map
+        :return: the integer coordinates of the boxes in the edge map
+        """
+        height, width = edges_shape
+        scale = np.array([width, height, width, height], dtype=np.float32)
+        return np.clip(np.round(normalized_xyxy * scale), 0, scale).astype(np.int64)
+
+    def learn(self, image, detections: Detections):
+        """
+        Stores the layout of the screenshot if YOLO detected it confidently
+        :param image: the decoded screenshot (cv2)
+        :param detections: the boxes detected by YOLO in the screenshot
+        """
+        if not self.enabled or len(detections.conf) == 0 or detections.conf.min() < YOLO_TEMPLATE_MIN_CONF:
+            return
+        height, width = image.shape[:2]
+        normalized_xyxy = detections.xyxy / np.array([width, height, width, height], dtype=detections.xyxy.dtype)
+        edges = self.edges(image)
+
+        outside = np.ones(edges.shape, dtype=bool)
+        has_text = []
+        for x1, y1, x2, y2 in self.small_boxes(normalized_xyxy, edges.shape):
+            outside[y1:y2, x1:x2] = False
+            has_text.append(edges[y1:y2, x1:x2].any())
+
+        self.templates.put(self.key(image), {
+            'normalized_xyxy': normalized_xyxy,
+            'cls': detections.cls,
+            'conf': detections.conf,
+            'edges': edges,
+            'outside': outside,
+            'has_text': np.array(has_text),
+            'hits': 0,
+        })
+        with self.lock:
+            self.learned += 1
+
+    def match(self, image):
+        """
+        :param image: the decoded screenshot (cv2)
+        :return: the Detections of the learned layout (in the coordinates of the screenshot) if the screenshot has the
+        same layout, or None (the screenshot must be detected by YOLO)
+        """
+        if not self.enabled:
+            return None
+        key = self.key(image)
+        template = self.templates.get(key)
+        if template is None:
+            return None
+
+        edges = self.edges(image)
+        if edges.shape != template['edges'].shape or not self.verify(edges, template):
+            with self.lock:
+                self.rejected += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+            template['hits'] += 1
+            expired = template['hits'] >= YOLO_TEMPLATE_MAX_HITS
+        if expired:
+            # FORGET THE LAYOUT AFTER THIS HIT, SO IT IS REFRESHED BY YOLO
+            self.templates.remove(key)
+        logger.info(f'{self.name} layout template hit')
+
+        height, width = image.shape[:2]
+        return Detections(
+            xyxy=template['normalized_xyxy'] * np.array([width, height, width, height],
+                                                        dtype=template['normalized_xyxy'].dtype),
+            cls=template['cls'],
+            conf=template['conf'],
+        )
+
+    def verify(self, edges, template) -> bool:
+        """
+        Verifies the anchors of the layout: the edges outside the boxes must match the edges of the learned screenshot
+        (a shifted box, an extra comment, a different app version move or add edges there) and each box which had text
+        must still contain edges
+        :param edges: the edge map of the screenshot
+        :param template: the learned layout
+        :return: True if the screenshot has the learned layout
+        """
+        learned_edges = template['edges']
+        outside = template['outside']
+        # 1 PIXEL OF TOLERANCE FOR THE RE-ENCODING/ANTI-ALIASING DIFFERENCES
+        kernel = np.ones((3, 3), dtype=np.uint8)
+        learned_dilated = cv2.dilate(learned_edges.astype(np.uint8), kernel) > 0
+        dilated = cv2.dilate(edges.astype(np.uint8), kernel) > 0
+        mismatch = ((edges & ~learned_dilated) | (learned_edges & ~dilated)) & outside
+        total = np.count_nonzero((edges | learned_edges) & outside)
+        if np.count_nonzero(mismatch) > YOLO_TEMPLATE_MAX_MISMATCH * max(1, total):
+            return False
+
+        boxes = self.small_boxes(template['normalized_xyxy'], edges.shape)
+        for (x1, y1, x2, y2), has_text in zip(boxes, template['has_text']):
+            if has_text and not edges[y1:y2, x1:x2].any():
+                return False
+        return True
+
+    def clear(self):
+        """
+        Forgets all the layouts (e.g. when the model changes)
+        """
+        self.templates.clear()
+
+    def stats(self) -> dict:
+        """
+        :return: the number of reused, rejected and learned layouts
+        """
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'size': self.templates.stats()['size'],
+                'hits': self.hits,
+                'rejected': self.rejected,
+                'learned': self.learned,
+            }
@@ -0,0 +1,531 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import contextmanager
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+from pytesseract import pytesseract
+
+from logging_config import logger
+from service.utils.cache_utils import LRUCache
+from service.utils.yolo_utils import OcrProfile
+
+# MAXIMUM NUMBER OF TESSERACT CALLS RUNNING AT THE SAME TIME (IN THIS PROCESS)
+# BOTH ENGINES RELEASE THE GIL WHILE TESSERACT RUNS (tesserocr IN C++, pytesseract WAITS FOR A SUBPROCESS)
+OCR_MAX_WORKERS = int(os.getenv("OCR_MAX_WORKERS", str(os.cpu_count() or 1)))
+# THE OCR ENGINE: tesserocr (LONG-LIVED TESSERACT API HANDLES, THE traineddata IS LOADED ONCE PER HANDLE),
+# pytesseract (A tesseract SUBPROCESS FOR EACH CALL) OR auto (tesserocr IF IT IS INSTALLED)
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto").lower()
+# MAXIMUM NUMBER OF tesserocr API HANDLES ALIVE IN THIS PROCESS (EACH ONE HOLDS THE traineddata OF ITS LANGUAGES,
+# TENS OF MB), THE LEAST RECENTLY USED IDLE HANDLE IS ENDED WHEN A HANDLE FOR ANOTHER OCR PROFILE IS NEEDED
+OCR_MAX_ENGINES = int(os.getenv("OCR_MAX_ENGINES", str(2 * max(1, OCR_MAX_WORKERS))))
+
+# THE CROPS ARE RESCALED SO THAT THEIR TEXT LINES ARE ~OCR_TARGET_LINE_HEIGHT PIXELS HIGH (FROM THE TOP OF THE
+# ASCENDERS TO THE BOTTOM OF THE DESCENDERS, ~20px x-height, WHERE TESSERACT IS MOST ACCURATE), WHATEVER THE SCREEN
+# RESOLUTION OF THE DEVICE WAS
+OCR_NORMALIZE = os.getenv("OCR_NORMALIZE", "true").lower() == "true"
+OCR_TARGET_LINE_HEIGHT = int(os.getenv("OCR_TARGET_LINE_HEIGHT", "40"))
+OCR_MIN_SCALE = float(os.getenv("OCR_MIN_SCALE", "0.25"))
+OCR_MAX_SCALE = float(os.getenv("OCR_MAX_SCALE", "4"))
+# BINARIZE THE CROPS (OTSU) BEFORE THE OCR
+OCR_BINARIZE = os.getenv("OCR_BINARIZE", "false").lower() == "true"
+# THE SCALE IS NOT CHANGED IF THE TEXT IS ALREADY THIS CLOSE TO THE TARGET HEIGHT (THE RESIZE WOULD COST MORE THAN IT
+# SAVES)
+OCR_SCALE_TOLERANCE = 0.15
+# THE SECOND, LANGUAGE-SPECIFIC OCR PASS OF A DESCRIPTION/COMMENT IS SKIPPED (THE FIRST PASS TEXT IS KEPT) IF THE
+# WORDS OF THE FIRST PASS HAVE A MEAN CONFIDENCE OF AT LEAST OCR_REUSE_MIN_TEXT_CONFIDENCE (0-100) AND THE LANGUAGE
+# WAS DETECTED WITH A CONFIDENCE OF AT LEAST OCR_REUSE_MIN_LANGUAGE_CONFIDENCE (0-1)
+OCR_REUSE_MIN_TEXT_CONFIDENCE = float(os.getenv("OCR_REUSE_MIN_TEXT_CONFIDENCE", "85"))
+OCR_REUSE_MIN_LANGUAGE_CONFIDENCE = float(os.getenv("OCR_REUSE_MIN_LANGUAGE_CONFIDENCE", "0.9"))
+# THE COMMENTS WITH THE SAME LANGUAGE ARE STACKED VERTICALLY INTO ONE IMAGE AND OCR'D WITH A SINGLE TESSERACT CALL
+# (AT MOST OCR_STACK_MAX_HEIGHT PIXELS HIGH, THE TALLER GROUPS ARE SPLIT INTO MULTIPLE IMAGES)
+OCR_STACK_COMMENTS = os.getenv("OCR_STACK_COMMENTS", "true").lower() == "true"
+OCR_STACK_MAX_HEIGHT = int(os.getenv("OCR_STACK_MAX_HEIGHT", "4000"))
+# THE STACKED IMAGE IS READ AS A SINGLE COLUMN OF TEXT OF VARIABLE SIZES (KEEPS THE ORDER OF THE CROPS)
+OCR_STACK_PSM = 4
+# CACHE OF THE OCR RESULTS, KEYED BY THE CONTENT OF THE CROP AND THE OCR PROFILE (THE SAME CROPS ARE READ AGAIN e.g.
+# RE-UPLOADED SCREENSHOTS), 0 ENTRIES DISABLES IT
+OCR_CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", "4096"))
+OCR_CACHE_TTL_SECONDS = float(os.getenv("OCR_CACHE_TTL_SECONDS", "3600"))
+# ROWS OF INK SHORTER THAN THIS ARE NOISE (UNDERLINES, BORDERS OF THE BOX), NOT TEXT LINES
+OCR_MIN_LINE_HEIGHT = 4
+
+
+
+class OcrResult(NamedTuple):
+    """
+    text: the text extracted by tesseract
+    confidence: the mean confidence (0-100) of the recognized words, None if it was not computed
+    """
+    text: str
+    confidence: float | None = None
+
+
+ocr_executor = ThreadPoolExecutor(max_workers=max(1, OCR_MAX_WORKERS), thread_name_prefix="ocr")
+ocr_cache = LRUCache(OCR_CACHE_MAX_ENTRIES, OCR_CACHE_TTL_SECONDS)
+
+
+def load_tesserocr():
+    """
+    :return: the tesserocr module, or None if the pytesseract engine is used (configured or tesserocr not installed)
+    """
+    if OCR_ENGINE == 'pytesseract':
+        return None
+    try:
+        # tesserocr IS IMPORTED ONLY WHEN NEEDED, IT IS NOT REQUIRED BY THE pytesseract ENGINE
+        import tesserocr
+        logger.info('OCR engine: tesserocr')
+        return tesserocr
+    except ImportError:
+        if OCR_ENGINE == 'tesserocr':
+            logger.error('tesserocr is not installed, using pytesseract')
+        return None
+
+
+class TesseractEnginePool:
+    """
+    The tesseract API handles (tesserocr) of the process, keyed by OCR profile (language set, PSM, whitelist).
+    A thread checks out an idle handle of the profile it needs (or a new one) and uses it alone (a handle cannot be
+    used by two threads at the same time), then gives it back. At most max_engines handles are alive: when a new
+    handle is needed and the pool is full, the least recently used idle handle is ended (End() frees its
+    traineddata); if all the handles are in use, the thread waits until one is given back.
+    """
+
+    def __init__(self, max_engines: int):
+        """
+        :param max_engines: the maximum number of handles alive at the same time
+        """
+        self.max_engines = max(1, max_engines)
+        self.condition = threading.Condition()
+        # THE IDLE HANDLES, FROM THE LEAST TO THE MOST RECENTLY USED: id(handle) -> (profile, handle)
+        self.idle = OrderedDict()
+        self.busy = 0
+        self.created = 0
+        self.evicted = 0
+
+    @contextmanager
+    def engine(self, profile: OcrProfile):
+        """
+        Checks out a handle for the profile, usage: with engine_pool.engine(profile) as engine: ...
+        :param profile: the OCR profile
+        :return: context manager giving the handle, which is given back to the pool at the end
+        """
+        engine = self.acquire(profile)
+        try:
+            yield engine
+        finally:
+            self.release(profile, engine)
+
+    def acquire(self, profile: OcrProfile):
+        """
+        :param profile: the OCR profile
+        :return: an idle handle of the profile, or a new one (created outside the lock, loading it takes time)
+        """
+        evicted = None
+        with self.condition:
+            while True:
+                engine = self.take_idle(profile)
+                if engine is not None:
+                    self.busy += 1
+                    return engine
+                if self.busy + len(self.idle) < self.max_engines:
+                    break
+                if self.idle:
+                    _, (_, evicted) = self.idle.popitem(last=False)
+                    self.evicted += 1
+                    break
+                self.condition.wait()
+            self.busy += 1
+
+        try:
+            if evicted is not None:
+                evicted.End()
+            engine = tesserocr.PyTessBaseAPI(lang=profile.lang, psm=profile.psm)
+            if profile.whitelist:
+                engine.SetVariable('tessedit_char_whitelist', profile.whitelist)
+        except BaseException:
+            with self.condition:
+                self.busy -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.created += 1
+        logger.debug(f'TESSERACT ENGINE LOADED: {profile}')
+        return engine
+
+    def take_idle(self, profile: OcrProfile):
+        """
+        :param profile: the OCR profile
+        :return: the most recently used idle handle of the profile (removed from the idle handles), or None
+        (called with the lock held)
+        """
+        for key, (engine_profile, engine) in reversed(self.idle.items()):
+            if engine_profile == profile:
+                del self.idle[key]
+                return engine
+        return None
+
+    def release(self, profile: OcrProfile, engine):
+        """
+        Gives the handle back to the pool (it becomes the most recently used idle handle)
+        :param profile: the OCR profile of the handle
+        :param engine: the handle
+        """
+        with self.condition:
+            self.idle[id(engine)] = (profile, engine)
+            self.busy -= 1
+            self.condition.notify()
+
+    def stats(self) -> dict:
+        """
+        :return: the number of alive/busy handles and the created/evicted counters
+        """
+        with self.condition:
+            return {
+                'max_engines': self.max_engines,
+                'alive': self.busy + len(self.idle),
+                'busy': self.busy,
+                'created': self.created,
+                'evicted': self.evicted,
+            }
+
+
+tesserocr = load_tesserocr()
+engine_pool = TesseractEnginePool(OCR_MAX_ENGINES)
+
+
+def tesserocr_image_to_string(image, profile: OcrProfile) -> OcrResult:
+    """
+    Extracts the text from the image with a tesseract API handle of the engine_pool
+    :param image: the image (grayscale or BGR)
+    :param profile: the OCR profile (languages, page segmentation mode, whitelist)
+    :return: the extracted text and the mean confidence of its words
+    """
+    image = np.ascontiguousarray(image)
+    height, width = image.shape[:2]
+    bytes_per_pixel = 1 if image.ndim == 2 else image.shape[2]
+    with engine_pool.engine(profile) as engine:
+        engine.SetImageBytes(image.tobytes(), width, height, bytes_per_pixel, image.strides[0])
+        try:
+            text = engine.GetUTF8Text()
+            return OcrResult(text, float(engine.MeanTextConf()))
+        finally:
+            engine.Clear()
+
+
+def pytesseract_config(profile: OcrProfile) -> str:
+    """
+    :param profile: the OCR profile
+    :return: the tesseract command line options of the profile
+    """
+    config = f'--psm {profile.psm}'
+    if profile.whitelist:
+        config += f' -c tessedit_char_whitelist={profile.whitelist}'
+    return config
+
+
+def estimate_line_height(ink):
+    """
+    Estimates the height of the text lines with the horizontal projection profile of the ink
+    :param ink: binary image (text = 255)
+    :return: the median height of the runs of rows which contain ink, or None if no text line was found
+    """
+    height, width = ink.shape
+    rows = np.count_nonzero(ink, axis=1) > max(1, width // 200)
+    # START/END OF EACH RUN OF INK ROWS
+    edges = np.diff(np.concatenate(([0], rows.astype(np.int8), [0])))
+    runs = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+    runs = runs[runs >= OCR_MIN_LINE_HEIGHT]
+    if len(runs) == 0:
+        return None
+    return float(np.median(runs))
+
+
+def normalize_roi(image):
+    """
+    Prepares a crop for tesseract: grayscale, dark text on light background (dark mode screenshots are inverted),
+    text lines rescaled to OCR_TARGET_LINE_HEIGHT pixels and, if OCR_BINARIZE is set, binarized
+    :param image: the crop (grayscale or BGR)
+    :return: the normalized crop (grayscale)
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    # MORE "INK" THAN BACKGROUND: LIGHT TEXT ON DARK BACKGROUND (DARK MODE)
+    if np.count_nonzero(ink) > ink.size // 2:
+        gray = cv2.bitwise_not(gray)
+        ink = cv2.bitwise_not(ink)
+
+    line_height = estimate_line_height(ink)
+    if line_height is not None:
+        scale = min(OCR_MAX_SCALE, max(OCR_MIN_SCALE, OCR_TARGET_LINE_HEIGHT / line_height))
+        if abs(scale - 1) > OCR_SCALE_TOLERANCE:
+            interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=interpolation)
+
+    if OCR_BINARIZE:
+        _, gray = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return gray
+
+
+def pytesseract_words(image, profile: OcrProfile):
+    """
+    Extracts the words from the image with pytesseract image_to_data
+    :param image: the image (grayscale)
+    :param profile: the OCR profile (languages, page segmentation mode, whitelist)
+    :return: list with the recognized words: (block, paragraph, line, top, bottom, text, confidence), in reading order
+    """
+    data = pytesseract.image_to_data(image, lang=profile.lang, config=pytesseract_config(profile),
+                                     output_type=pytesseract.Output.DICT)
+    return [(block, paragraph, line, top, top + height, text, float(conf))
+            for block, paragraph, line, top, height, text, conf in zip(
+                data['block_num'], data['par_num'], data['line_num'], data['top'], data['height'], data['text'],
+                data['conf'])
+            if text.strip() and float(conf) >= 0]
+
+
+def pytesseract_image_to_data(image, profile: OcrProfile) -> OcrResult:
+    """
+    Extracts the text from the image with pytesseract, together with the confidence of the words
+    (the text is rebuilt from the words: the lines are separated by newlines, the paragraphs by an empty line)
+    :param image: the image (grayscale)
+    :param profile: the OCR profile (languages, page segmentation mode, whitelist)
+    :return: the extracted text and the mean confidence of its words
+    """
+    lines = []
+    confidences = []
+    current_line = None
+    current_paragraph = None
+    for block, paragraph, line, _, _, text, conf in pytesseract_words(image, profile):
+        confidences.append(conf)
+        if (block, paragraph, line) != current_line:
+            if current_paragraph is not None and (block, paragraph) != current_paragraph:
+                lines.append('')
+            lines.append(text)
+            current_line = (block, paragraph, line)
+            current_paragraph = (block, paragraph)
+        else:
+            lines[-1] += ' ' + text
+    return OcrResult('\n'.join(lines), float(np.mean(confidences)) if confidences else 0.0)
+
+
+def text_lines(image, profile: OcrProfile):
+    """
+    Extracts the text lines from the image, with their vertical position
+    :param image: the image (grayscale, already normalized)
+    :param profile: the OCR profile (languages, page segmentation mode, whitelist)
+    :return: list with (top, bottom, text) for each recognized line
+    """
+    if tesserocr is not None:
+        image = np.ascontiguousarray(image)
+        height, width = image.shape[:2]
+        with engine_pool.engine(profile) as engine:
+            engine.SetImageBytes(image.tobytes(), width, height, 1, image.strides[0])
+            try:
+                engine.Recognize()
+                iterator = engine.GetIterator()
+                if iterator is None:
+                    return []
+                lines = []
+                for line in tesserocr.iterate_level(iterator, tesserocr.RIL.TEXTLINE):
+                    text = line.GetUTF8Text(tesserocr.RIL.TEXTLINE)
+                    bounding_box = line.BoundingBox(tesserocr.RIL.TEXTLINE)
+                    if text and bounding_box is not None:
+                        lines.append((bounding_box[1], bounding_box[3], text.strip()))
+                return lines
+            finally:
+                engine.Clear()
+
+    lines = {}
+    for block, paragraph, line, top, bottom, text, _ in pytesseract_words(image, profile):
+        key = (block, paragraph, line)
+        if key in lines:
+            line_top, line_bottom, line_text = lines[key]
+            lines[key] = (min(line_top, top), max(line_bottom, bottom), f'{line_text} {text}')
+        else:
+            lines[key] = (top, bottom, text)
+    return list(lines.values())
+
+
+def ocr_cache_key(image, profile: OcrProfile):
+    """
+    :param image: the crop (before the normalization)
+    :param profile: the OCR profile
+    :return: the key of the OCR result of the crop in the ocr_cache (the hash of the pixels and the shape of the crop,
+    and the profile: languages, page segmentation mode, whitelist)
+    """
+    digest = hashlib.blake2b(np.ascontiguousarray(image).tobytes(), digest_size=16).hexdigest()
+    return digest, image.shape, profile
+
+
+def run_ocr(image, profile: OcrProfile, with_confidence: bool = False) -> OcrResult:
+    """
+    Extracts the text from the image with the configured engine, in the current thread (the image is normalized first,
+    see normalize_roi)
+    (the tesseract API handles are shared by the threads, see TesseractEnginePool)
+    :param image: the image (grayscale)
+    :param profile: the OCR profile (languages, page segmentation mode, whitelist)
+    :param with_confidence: if the confidence of the text is needed (always computed by tesserocr, pytesseract needs
+    the slower image_to_data for it)
+    :return: the extracted text and its confidence
+    """
+    if image.size == 0:
+        return OcrResult('', 0.0)
+    key = ocr_cache_key(image, profile)
+    cached = ocr_cache.get(key)
+    # A RESULT CACHED WITHOUT CONFIDENCE CANNOT BE USED IF THE CONFIDENCE IS NEEDED
+    if cached is not None and (cached.confidence is not None or not with_confidence):
+        return cached
+
+    if OCR_NORMALIZE:
+        image = normalize_roi(image)
+    if tesserocr is not None:
+        result = tesserocr_image_to_string(image, profile)
+    elif with_confidence:
+        result = pytesseract_image_to_data(image, profile)
+    else:
+        result = OcrResult(pytesseract.image_to_string(image, lang=profile.lang, config=pytesseract_config(profile)))
+    ocr_cache.put(key, result)
+    return result
+
+
+def submit_ocr(image, profile: OcrProfile, with_confidence: bool = False) -> Future:
+    """
+    Schedules the text extraction of the image on the ocr_executor
+    :param image: the image (grayscale)
+    :param profile: the OCR profile (see label_ocr_profile)
+    :param with_confidence: if the confidence of the text is needed
+    :return: Future which will hold the OcrResult
+    """
+    return ocr_executor.submit(run_ocr, image, profile, with_confidence)
+
+
+def ocr_image(image, profile: OcrProfile, with_confidence: bool = False) -> OcrResult:
+    """
+    Extracts the text from the image with tesseract
+    :param image: the image (grayscale)
+    :param profile: the OCR profile (see label_ocr_profile)
+    :param with_confidence: if the confidence of the text is needed
+    :return: the extracted text and its confidence
+    """
+    return submit_ocr(image, profile, with_confidence).result()
+
+
+def ocr_images(requests, with_confidence: bool = False) -> list:
+    """
+    Extracts the text from all the images concurrently (on the ocr_executor)
+    :param requests: list with (image, OcrProfile) tuples
+    :param with_confidence: if the confidence of the texts is needed
+    :return: list with the OcrResult of each image, in the same order as the requests
+    """
+    futures = [submit_ocr(image, profile, with_confidence) for image, profile in requests]
+    return [future.result() for future in futures]
+
+
+def first_pass_is_reusable(text_confidence, language_confidence) -> bool:
+    """
+    :param text_confidence: the mean word confidence of the first (common languages) OCR pass, None if unknown
+    :param language_confidence: the confidence of the language detected from the first pass text
+    :return: True if the first pass text is good enough and the language-specific OCR pass can be skipped
+    """
+    return text_confidence is not None and text_confidence >= OCR_REUSE_MIN_TEXT_CONFIDENCE and \
+        language_confidence >= OCR_REUSE_MIN_LANGUAGE_CONFIDENCE
+
+
+def stack_images(images):
+    """
+    Stacks the images vertically, aligned to the left, on a white background, separated by an empty band as high as a
+    text line (so tesseract never merges the last line of a crop with the first line of the next crop)
+    :param images: list with grayscale images (dark text on light background)
+    :return: the stacked image and the list with the (top, bottom) rows of each image in it
+    """
+    separator = OCR_TARGET_LINE_HEIGHT
+    width = max(image.shape[1] for image in images) + 2 * separator
+    height = sum(image.shape[0] for image in images) + (len(images) + 1) * separator
+    stacked = np.full((height, width), 255, dtype=np.uint8)
+    offsets = []
+    top = separator
+    for image in images:
+        stacked[top:top + image.shape[0], separator:separator + image.shape[1]] = image
+        offsets.append((top, top + image.shape[0]))
+        top += image.shape[0] + separator
+    return stacked, offsets
+
+
+def run_stacked_ocr(images, profile: OcrProfile) -> list:
+    """
+    Extracts the texts of multiple images with a single tesseract call: the (normalized) images are stacked vertically
+    and each recognized line is given back to the image which contains its vertical center
+    (the images already in the ocr_cache are not stacked)
+    :param images: list with the images (grayscale)
+    :param profile: the OCR profile (the same for all the images, e.g. the language of the comments)
+    :return: list with the text of each image, in the same order
+    """
+    stacked_profile = profile._replace(psm=OCR_STACK_PSM)
+    texts = ['' for _ in images]
+    # THE INDEXES AND THE CACHE KEYS OF THE IMAGES WHICH MUST BE OCR'D
+    missing = []
+    for index, image in enumerate(images):
+        if image.size == 0:
+            continue
+        key = ocr_cache_key(image, stacked_profile)
+        cached = ocr_cache.get(key)
+        if cached is not None:
+            texts[index] = cached.text
+        else:
+            missing.append((index, key))
+    if len(missing) == 0:
+        return texts
+
+    normalized = [normalize_roi(images[index]) if OCR_NORMALIZE else images[index] for index, _ in missing]
+    stacked, offsets = stack_images(normalized)
+
+    lines = [[] for _ in missing]
+    for top, bottom, text in text_lines(stacked, stacked_profile):
+        center = (top + bottom) / 2
+        for position, (image_top, image_bottom) in enumerate(offsets):
+            if image_top <= center < image_bottom:
+                lines[position].append(text)
+                break
+
+    for (index, key), image_lines in zip(missing, lines):
+        texts[index] = '\n'.join(image_lines)
+        ocr_cache.put(key, OcrResult(texts[index]))
+    return texts
+
+
+def ocr_images_stacked(groups) -> list:
+    """
+    Extracts the texts of groups of images with as few tesseract calls as possible (see run_stacked_ocr), the images
+    of each group are split into stacks of at most OCR_STACK_MAX_HEIGHT pixels (measured before the normalization),
+    all the stacks are OCR'd concurrently
+    :param groups: list with (images, OcrProfile) tuples e.g. the comments of each language
+    :return: list with the list of texts of each group, in the same order as the groups and as their images
+    """
+    group_futures = []
+    for images, profile in groups:
+        chunks = []
+        chunk_height = 0
+        for image in images:
+            if len(chunks) == 0 or chunk_height + image.shape[0] > OCR_STACK_MAX_HEIGHT:
+                chunks.append([])
+                chunk_height = 0
+            chunks[-1].append(image)
+            chunk_height += image.shape[0]
+        group_futures.append([ocr_executor.submit(run_stacked_ocr, chunk, profile) for chunk in chunks])
+    return [[text for future in futures for text in future.result()] for futures in group_futures]
+
+
+def get_ocr_metrics():
+    """
+    :return: the configuration of the OCR and the metrics of the tesseract handles and of the ocr_cache
+    """
+    return {
+        'engine': 'tesserocr' if tesserocr is not None else 'pytesseract',
+        'max_workers': OCR_MAX_WORKERS,
+        'engines': engine_pool.stats(),
+        'cache': ocr_cache.stats(),
+    }
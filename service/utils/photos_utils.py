@@ -1,5 +1,7 @@
 import base64
 import os
+import re
+import time
 from uuid import uuid4
 
 from starlette import status
@@ -8,6 +10,19 @@ from exceptions.custom_exceptions import CustomHTTPException
 from logging_config import logger
 
 STORAGE_DIR = os.getenv("STORAGE_DIR")
+# THE DETECTED PHOTOS ARE STORED IN THIS SUB-DIRECTORY OF STORAGE_DIR (ONE DIRECTORY FOR EACH USER) AND ONLY THEIR
+# CROP ID IS SENT TO THE CLIENT, WHEN THE CLIENT SAVES THE SOCIAL ACCOUNT/POST WITH THE CROP ID, THE PHOTO IS MOVED TO
+# STORAGE_DIR (THE PHOTO DOESN'T TRAVEL TO THE CLIENT AND BACK IN base64 FORMAT)
+# 0 = THE DETECTED PHOTOS ARE SENT TO THE CLIENT IN base64 FORMAT
+PHOTOS_STAGING = os.getenv("PHOTOS_STAGING", "1") == "1"
+STAGING_DIR = os.path.join(STORAGE_DIR or '', 'staging')
+# THE STAGED PHOTOS WHICH WERE NOT SAVED AFTER THIS MANY SECONDS ARE REMOVED (CHECKED AT MOST ONCE PER CLEANUP INTERVAL)
+PHOTOS_STAGING_TTL_SECONDS = float(os.getenv("PHOTOS_STAGING_TTL_SECONDS", "3600"))
+PHOTOS_STAGING_CLEANUP_SECONDS = float(os.getenv("PHOTOS_STAGING_CLEANUP_SECONDS", "60"))
+
+CROP_ID_PREFIX = 'crop_'
+CROP_ID_PATTERN = re.compile(r'^crop_[0-9a-f]{32}$')
+last_staging_cleanup = 0.0
 
 
 def save_profile_photo(base64_str) -> str:
@@ -72,3 +87,131 @@ def get_photo_base64(filename: str) -> str:
             status_code=status.HTTP_400_BAD_REQUEST,
             message=f"Error reading or encoding file '{file_path}': {e}"
         )
+
+
+def is_crop_id(photo: str) -> bool:
+    """
+    :param photo: a photo received from the client
+    :return: True if the photo is the crop id of a staged photo, False if it is a photo in base64 format
+    (base64 doesn't contain '_')
+    """
+    return photo is not None and CROP_ID_PATTERN.match(photo) is not None
+
+
+def staged_photo_path(crop_id: str, user_id: int) -> str | None:
+    """
+    :param crop_id: the crop id of a staged photo
+    :param user_id: the id of the user who owns the photo (the photos of the other users are never found)
+    :return: the path of the staged photo, None if the crop id is not valid (the id is never used as a path as it is)
+    """
+    if not is_crop_id(crop_id):
+        return None
+    return os.path.join(STAGING_DIR, str(int(user_id)), f"{crop_id[len(CROP_ID_PREFIX):]}.jpg")
+
+
+def staged_photo_exists(crop_id: str, user_id: int) -> bool:
+    """
+    :param crop_id: the crop id of a staged photo
+    :param user_id: the id of the current user
+    :return: True if the user has a staged photo with this crop id (not expired, not saved yet)
+    """
+    staged_path = staged_photo_path(crop_id, user_id)
+    return staged_path is not None and os.path.isfile(staged_path)
+
+
+def stage_photo(photo_bytes: bytes, user_id: int) -> str:
+    """
+    Stores a detected photo in the staging directory of the user, from where it is moved to STORAGE_DIR when the user
+    saves it (see save_photo), the staged photos which are not saved expire after PHOTOS_STAGING_TTL_SECONDS
+    :param photo_bytes: the encoded photo (jpeg), written as it is
+    :param user_id: the id of the user who detected the photo (only he can preview and save it)
+    :return: the crop id of the staged photo
+    """
+    remove_expired_staged_photos()
+    crop_id = f"{CROP_ID_PREFIX}{uuid4().hex}"
+    file_path = staged_photo_path(crop_id, user_id)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    # THE PHOTO IS WRITTEN UNDER A TEMPORARY NAME, SO A PARTIALLY WRITTEN PHOTO IS NEVER SAVED/PREVIEWED
+    with open(file_path + '.tmp', "wb") as f:
+        f.write(photo_bytes)
+    os.replace(file_path + '.tmp', file_path)
+    return crop_id
+
+
+def encoded_photo_to_base64(photo_bytes: bytes) -> str:
+    """
+    :param photo_bytes: the encoded photo (jpeg)
+    :return: the photo in base64 format, with the data URI prefix (used when PHOTOS_STAGING is disabled)
+    """
+    return f"data:image/jpeg;base64,{base64.b64encode(photo_bytes).decode('utf-8')}"
+
+
+def remove_expired_staged_photos():
+    """
+    Removes the staged photos older than PHOTOS_STAGING_TTL_SECONDS (at most once per PHOTOS_STAGING_CLEANUP_SECONDS)
+    """
+    global last_staging_cleanup
+    now = time.time()
+    if now - last_staging_cleanup < PHOTOS_STAGING_CLEANUP_SECONDS:
+        return
+    last_staging_cleanup = now
+
+    try:
+        users_dirs = [entry.path for entry in os.scandir(STAGING_DIR) if entry.is_dir()]
+    except FileNotFoundError:
+        return
+    removed = 0
+    for user_dir in users_dirs:
+        try:
+            entries = list(os.scandir(user_dir))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            try:
+                if now - entry.stat().st_mtime > PHOTOS_STAGING_TTL_SECONDS:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                # SAVED OR REMOVED IN THE MEANTIME
+                continue
+    if removed:
+        logger.info(f'{removed} expired staged photos removed')
+
+
+def promote_staged_photo(crop_id: str, user_id: int) -> str:
+    """
+    Moves a staged photo to STORAGE_DIR (a rename, the photo is not decoded nor copied)
+    :param crop_id: the crop id of the staged photo
+    :param user_id: the id of the current user (only his own staged photos can be saved)
+    :return: the filename of the saved photo
+    Throws HTTP 422 UNPROCESSABLE_ENTITY if the user has no staged photo with this crop id (it expired or it was
+    already saved), like validate_staged_photo
+    """
+    staged_path = staged_photo_path(crop_id, user_id)
+    filename = f"{crop_id[len(CROP_ID_PREFIX):]}.jpg"
+    try:
+        if staged_path is None:
+            raise FileNotFoundError(crop_id)
+        os.replace(staged_path, os.path.join(STORAGE_DIR, filename))
+    except FileNotFoundError:
+        logger.error(f"Staged photo '{crop_id}' not found")
+        raise CustomHTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            message="The photo expired, detect it again."
+        )
+    return filename
+
+
+def save_photo(photo: str, user_id: int) -> str:
+    """
+    Stores a photo received in an add/update request: a crop id returned by the detection is moved from the staging
+    directory of the user (see promote_staged_photo), any other value is a photo in base64 format (see
+    save_profile_photo)
+    :param photo: the crop id or the photo in base64 format
+    :param user_id: the id of the current user
+    :return: the filename of the saved photo
+    Throws HTTP 422 UNPROCESSABLE_ENTITY if the staged photo expired
+    """
+    if is_crop_id(photo):
+        return promote_staged_photo(photo, user_id)
+    return save_profile_photo(photo)
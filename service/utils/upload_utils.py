@@ -0,0 +1,114 @@
+import os
+
+from fastapi import status, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse
+
+from exceptions.custom_exceptions import CustomHTTPException
+from logging_config import logger
+
+# MAXIMUM SIZE OF AN UPLOADED SCREENSHOT (MULTIPART FILE OR RAW BODY)
+# A RAW BODY IS STOPPED AS SOON AS IT IS EXCEEDED, A MULTIPART BODY IS PARSED (AND THE FILE SPOOLED) BEFORE THE HANDLER
+# RUNS, SO ITS SIZE IS LIMITED BEFORE THE PARSING BY ImageUploadLimitMiddleware
+YOLO_IMAGE_MAX_BYTES = int(os.getenv("YOLO_IMAGE_MAX_BYTES", str(20 * 1024 * 1024)))
+# A MULTIPART BODY ALSO HOLDS THE BOUNDARIES AND THE HEADERS OF ITS PARTS
+YOLO_MULTIPART_OVERHEAD_BYTES = 64 * 1024
+# THE UPLOADED FILE IS READ IN CHUNKS OF THIS SIZE
+YOLO_IMAGE_CHUNK_BYTES = 1024 * 1024
+
+
+def image_too_large() -> CustomHTTPException:
+    """
+    :return: the exception of an uploaded screenshot bigger than YOLO_IMAGE_MAX_BYTES
+    """
+    logger.error('Uploaded image is too big')
+    return CustomHTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        message=f"The image can have at most {YOLO_IMAGE_MAX_BYTES // (1024 * 1024)} MB."
+    )
+
+
+async def read_image_upload(image: UploadFile) -> bytes:
+    """
+    Reads an uploaded screenshot (multipart/form-data file, the body was limited by ImageUploadLimitMiddleware before
+    it was parsed, the file itself is checked here)
+    :param image: the uploaded screenshot
+    :return: the bytes of the screenshot
+    Throws 413 REQUEST_ENTITY_TOO_LARGE if the screenshot is bigger than YOLO_IMAGE_MAX_BYTES
+    """
+    chunks = []
+    size = 0
+    while chunk := await image.read(YOLO_IMAGE_CHUNK_BYTES):
+        size += len(chunk)
+        if size > YOLO_IMAGE_MAX_BYTES:
+            raise image_too_large()
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+async def read_image_body(request: Request) -> bytes:
+    """
+    Reads a screenshot sent as the body of the request (application/octet-stream), the body is received in chunks so
+    a body bigger than the limit is never fully read
+    :param request: the request
+    :return: the bytes of the screenshot
+    Throws 413 REQUEST_ENTITY_TOO_LARGE if the body is bigger than YOLO_IMAGE_MAX_BYTES
+    """
+    # THE DECLARED SIZE IS CHECKED FIRST, THE STREAM IS STILL COUNTED (CHUNKED BODIES DON'T HAVE A Content-Length)
+    content_length = request.headers.get('content-length')
+    if content_length is not None and content_length.isdigit() and int(content_length) > YOLO_IMAGE_MAX_BYTES:
+        raise image_too_large()
+
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > YOLO_IMAGE_MAX_BYTES:
+            raise image_too_large()
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+class ImageUploadLimitMiddleware:
+    """
+    Limits the size of the multipart bodies of the given paths before they are parsed (Starlette spools the whole
+    uploaded file before the handler runs): a body declaring a bigger Content-Length is rejected without being read,
+    a chunked body is stopped as soon as it gets bigger
+    """
+
+    def __init__(self, app, paths: list, max_bytes: int = YOLO_IMAGE_MAX_BYTES + YOLO_MULTIPART_OVERHEAD_BYTES):
+        """
+        :param app: the ASGI app
+        :param paths: the paths of the multipart upload endpoints
+        :param max_bytes: the maximum size of the body
+        """
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope['headers']).get(b'content-length', b'')
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            exc = image_too_large()
+            response = JSONResponse(status_code=exc.status_code,
+                                    content={"message": exc.message, "status_code": exc.status_code})
+            await response(scope, receive, send)
+            return
+
+        size = 0
+
+        async def limited_receive():
+            nonlocal size
+            message = await receive()
+            if message['type'] == 'http.request':
+                size += len(message.get('body', b''))
+                if size > self.max_bytes:
+                    exc = image_too_large()
+                    # AN HTTPException GOES THROUGH THE BODY PARSING OF FASTAPI (OTHER ERRORS BECOME 400)
+                    raise HTTPException(status_code=exc.status_code, detail=exc.message)
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,162 @@
+import os
+import tempfile
+
+import cv2
+from fastapi import status, UploadFile
+
+from exceptions.custom_exceptions import CustomHTTPException
+from logging_config import logger
+from service.utils.yolo_utils import perceptual_hash, hash_distance, estimate_scroll_offset
+
+# MAXIMUM SIZE AND DURATION OF AN UPLOADED SCREEN RECORDING
+YOLO_VIDEO_MAX_BYTES = int(os.getenv("YOLO_VIDEO_MAX_BYTES", str(200 * 1024 * 1024)))
+YOLO_VIDEO_MAX_SECONDS = float(os.getenv("YOLO_VIDEO_MAX_SECONDS", "300"))
+# HOW MANY FRAMES PER SECOND ARE SAMPLED FROM THE RECORDING (THE OTHER FRAMES ARE SKIPPED WITHOUT BEING CONVERTED)
+YOLO_VIDEO_SAMPLE_FPS = float(os.getenv("YOLO_VIDEO_SAMPLE_FPS", "2"))
+# A SAMPLED FRAME IS A KEYFRAME ONLY IF ITS PERCEPTUAL HASH DIFFERS FROM THE HASH OF THE LAST KEYFRAME IN MORE THAN
+# THIS MANY BITS (OUT OF 256), THE NEAR-DUPLICATE FRAMES (THE SCREEN DIDN'T MOVE) ARE DROPPED
+YOLO_VIDEO_MIN_HASH_DISTANCE = int(os.getenv("YOLO_VIDEO_MIN_HASH_DISTANCE", "12"))
+# MAXIMUM NUMBER OF KEYFRAMES PROCESSED FROM A RECORDING (THE REST OF THE RECORDING IS IGNORED)
+YOLO_VIDEO_MAX_KEYFRAMES = int(os.getenv("YOLO_VIDEO_MAX_KEYFRAMES", "60"))
+# THE UPLOADED RECORDING IS COPIED TO A TEMPORARY FILE IN CHUNKS OF THIS SIZE
+YOLO_VIDEO_CHUNK_BYTES = 1024 * 1024
+
+
+async def save_video_upload(video: UploadFile) -> str:
+    """
+    Copies the uploaded screen recording to a temporary file (cv2 reads videos only from files), the caller must
+    remove the file
+    :param video: the uploaded screen recording
+    :return: the path of the temporary file
+    Throws 413 REQUEST_ENTITY_TOO_LARGE if the recording is bigger than YOLO_VIDEO_MAX_BYTES
+    """
+    suffix = os.path.splitext(video.filename or '')[1] or '.mp4'
+    fd, video_path = tempfile.mkstemp(prefix='yolo_video_', suffix=suffix)
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while chunk := await video.read(YOLO_VIDEO_CHUNK_BYTES):
+                size += len(chunk)
+                if size > YOLO_VIDEO_MAX_BYTES:
+                    logger.error('Uploaded video is too big')
+                    raise CustomHTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        message=f"The video can have at most {YOLO_VIDEO_MAX_BYTES // (1024 * 1024)} MB."
+                    )
+                f.write(chunk)
+    except BaseException:
+        remove_video(video_path)
+        raise
+    return video_path
+
+
+def remove_video(video_path: str):
+    """
+    Removes the temporary file of a screen recording, ignoring it if it was already removed (or if it is still open
+    by the detection, which removes it when it is finished)
+    """
+    try:
+        os.remove(video_path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.info(f'video {video_path} not removed yet: {e}')
+
+
+def open_video(video_path: str) -> cv2.VideoCapture:
+    """
+    Opens a screen recording and validates it before any frame is read
+    :param video_path: the path of the screen recording
+    :return: the opened cv2.VideoCapture (released by video_keyframes)
+    Throws 400 BAD_REQUEST if the file is not a valid video
+    Throws 422 UNPROCESSABLE_ENTITY if the recording is longer than YOLO_VIDEO_MAX_SECONDS
+    """
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        capture.release()
+        logger.error('Invalid video file')
+        raise CustomHTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            message="Invalid video format."
+        )
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30
+    frames_count = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+    if frames_count > 0 and frames_count / fps > YOLO_VIDEO_MAX_SECONDS:
+        capture.release()
+        logger.error('Uploaded video is too long')
+        raise CustomHTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            message=f"The video can last at most {int(YOLO_VIDEO_MAX_SECONDS)} seconds."
+        )
+    return capture
+
+
+def video_keyframes(capture: cv2.VideoCapture):
+    """
+    Samples YOLO_VIDEO_SAMPLE_FPS frames per second from the recording and keeps only the keyframes: the frames whose
+    perceptual hash differs enough from the last keyframe (the frames where the screen didn't move are dropped, so the
+    detection pipeline runs only once for each screen)
+    The keyframes are yielded while the recording is read, so they can be processed before the end of the recording
+    :param capture: the recording opened with open_video (released at the end)
+    :return: generator with the keyframes (cv2), in the order of the recording
+    Throws 400 BAD_REQUEST if the recording has no frames
+    """
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30
+        step = max(1, round(fps / YOLO_VIDEO_SAMPLE_FPS))
+
+        no_keyframes = 0
+        last_hash = None
+        frame_index = 0
+        # grab() ONLY DEMUXES/DECODES THE FRAME, retrieve() CONVERTS IT TO A cv2 IMAGE (ONLY FOR THE SAMPLED FRAMES)
+        while capture.grab():
+            sampled = frame_index % step == 0
+            frame_index += 1
+            if not sampled:
+                continue
+            retrieved, frame = capture.retrieve()
+            if not retrieved:
+                continue
+            frame_hash = perceptual_hash(frame)
+            if last_hash is not None and hash_distance(frame_hash, last_hash) <= YOLO_VIDEO_MIN_HASH_DISTANCE:
+                continue
+            yield frame
+            no_keyframes += 1
+            last_hash = frame_hash
+            if no_keyframes >= YOLO_VIDEO_MAX_KEYFRAMES:
+                logger.info(f'video keyframes limit reached at frame {frame_index}')
+                break
+    finally:
+        capture.release()
+
+    if no_keyframes == 0:
+        logger.error('Video without frames')
+        raise CustomHTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            message="Invalid video format."
+        )
+    logger.info(f'{no_keyframes} keyframes sampled from {frame_index} frames')
+
+
+def split_post_keyframes(keyframes):
+    """
+    Splits the keyframes of a scroll-through into posts: consecutive keyframes belong to the same post while the
+    next one is the previous one scrolled (see estimate_scroll_offset), a keyframe which doesn't overlap the previous
+    one starts a new post
+    A post is yielded as soon as the first keyframe of the next post arrives (only one post is kept in memory)
+    :param keyframes: iterable with the keyframes (cv2), in the order of the recording
+    :return: generator with the keyframes of each post (list of cv2 images) and the scrolls between its consecutive
+    keyframes (list of ints, one less than the keyframes, see detect_from_post_images)
+    """
+    post_keyframes, scrolls = [], []
+    for keyframe in keyframes:
+        if post_keyframes:
+            scroll = estimate_scroll_offset(post_keyframes[-1], keyframe)
+            if scroll is None:
+                yield post_keyframes, scrolls
+                post_keyframes, scrolls = [], []
+            else:
+                scrolls.append(scroll)
+        post_keyframes.append(keyframe)
+    if post_keyframes:
+        yield post_keyframes, scrolls
@@ -1,11 +1,94 @@
+import os
 import re
 import base64
+from typing import NamedTuple
+
 import numpy as np
 from fastapi import status
 import cv2
 from exceptions.custom_exceptions import CustomHTTPException
 from logging_config import logger
 
+# THE IMAGE SIZE THE YOLO MODELS WERE TRAINED WITH (args.yaml: imgsz: 800)
+YOLO_IMGSZ = int(os.getenv("YOLO_IMGSZ", "800"))
+# FOR EACH TEXT LABEL ONLY THE BEST BOX (CONFIDENCE, THEN AREA) IS OCR'D, UNLESS OTHER BOXES OF THE SAME LABEL HAVE
+# A CONFIDENCE WITHIN YOLO_AMBIGUOUS_CONF_MARGIN OF IT, THEN AT MOST YOLO_AMBIGUOUS_TOP_K BOXES ARE OCR'D
+YOLO_AMBIGUOUS_TOP_K = int(os.getenv("YOLO_AMBIGUOUS_TOP_K", "2"))
+YOLO_AMBIGUOUS_CONF_MARGIN = float(os.getenv("YOLO_AMBIGUOUS_CONF_MARGIN", "0.1"))
+# BOXES OF THE SAME LABEL (comment, description) WITH AN IoU ABOVE YOLO_DEDUP_IOU OR WITH ONE BOX INSIDE THE OTHER
+# (INTERSECTION OVER THE SMALLER BOX ABOVE YOLO_DEDUP_CONTAINMENT) ARE MERGED BEFORE THE OCR
+YOLO_DEDUP_IOU = float(os.getenv("YOLO_DEDUP_IOU", "0.5"))
+YOLO_DEDUP_CONTAINMENT = float(os.getenv("YOLO_DEDUP_CONTAINMENT", "0.8"))
+# THE POST SCREENSHOTS TALLER THAN YOLO_TILE_MIN_ASPECT_RATIO x THEIR WIDTH (SCROLLING CAPTURES) ARE DETECTED IN TILES
+# OF YOLO_TILE_ASPECT_RATIO x THEIR WIDTH, WHICH OVERLAP BY YOLO_TILE_OVERLAP OF THE TILE HEIGHT
+YOLO_TILE_MIN_ASPECT_RATIO = float(os.getenv("YOLO_TILE_MIN_ASPECT_RATIO", "3"))
+YOLO_TILE_ASPECT_RATIO = float(os.getenv("YOLO_TILE_ASPECT_RATIO", "2"))
+YOLO_TILE_OVERLAP = float(os.getenv("YOLO_TILE_OVERLAP", "0.25"))
+# A BOX CLOSER THAN THIS (PIXELS) TO THE INNER EDGE OF A TILE IS CONSIDERED CUT BY THAT EDGE
+YOLO_TILE_SEAM_MARGIN = 4
+# ONLY THE TEXT BLOCKS WHICH CAN BE CUT IN TWO BY A SEAM ARE MERGED ACROSS THE TILES, THE OTHER LABELS KEEP ALL THEIR
+# BOXES SO rank_label_candidates CAN STILL CHOOSE BETWEEN THEM (A UNION OF TWO likes/date BOXES IS NEVER BETTER)
+YOLO_TILE_MERGE_LABELS = ['description', 'comment']
+# SCROLL ESTIMATION BETWEEN TWO CONSECUTIVE SCREENSHOTS OF THE SAME POST: THE HEADER AND FOOTER BANDS (FRACTIONS OF THE
+# HEIGHT, e.g. STATUS BAR, APP BAR, NAVIGATION BAR) DON'T SCROLL SO THEY ARE IGNORED; THE SCREENSHOTS MUST SHARE AT
+# LEAST YOLO_SEQUENCE_MIN_OVERLAP OF THE CONTENT BAND AND THE DIFFERENCE OF THEIR SHARED ROWS (ROOT MEAN SQUARE) MAY BE
+# AT MOST YOLO_SEQUENCE_MAX_RELATIVE_DIFF OF THE CONTRAST OF THESE ROWS (STANDARD DEVIATION OF THEIR GRAY LEVELS), SO
+# THE NOISE OF A JPEG RE-ENCODED SCREENSHOT IS TOLERATED (TWO UNRELATED SCREENS DIFFER BY ~1.4x THEIR CONTRAST)
+YOLO_SEQUENCE_HEADER = float(os.getenv("YOLO_SEQUENCE_HEADER", "0.1"))
+YOLO_SEQUENCE_FOOTER = float(os.getenv("YOLO_SEQUENCE_FOOTER", "0.08"))
+YOLO_SEQUENCE_MIN_OVERLAP = float(os.getenv("YOLO_SEQUENCE_MIN_OVERLAP", "0.1"))
+YOLO_SEQUENCE_MAX_RELATIVE_DIFF = float(os.getenv("YOLO_SEQUENCE_MAX_RELATIVE_DIFF", "0.25"))
+# THE SCREENSHOTS ARE REDUCED TO THIS MANY COLUMNS (THEIR HEIGHT IS KEPT, SO THE SCROLL IS FOUND TO THE PIXEL)
+YOLO_SEQUENCE_PROFILE_WIDTH = 16
+# THE SHARED ROWS MUST HAVE SOME CONTENT (STANDARD DEVIATION OF THE GRAY LEVELS), AN EMPTY BACKGROUND MATCHES ANY SCROLL
+YOLO_SEQUENCE_MIN_CONTENT_STD = 4
+
+
+class Detections(NamedTuple):
+    """
+    The boxes detected by YOLO in an image, as numpy arrays in the coordinates of the original (full resolution) image
+    xyxy: float array (N, 4) with the x1, y1, x2, y2 coordinates of the boxes
+    cls: int array (N,) with the class index of each box
+    conf: float array (N,) with the confidence of each box
+    """
+    xyxy: np.ndarray
+    cls: np.ndarray
+    conf: np.ndarray
+
+
+class OcrProfile(NamedTuple):
+    """
+    How tesseract reads the text of a box
+    lang: the tesseract languages e.g. 'eng+fra' (None = the languages given by the caller)
+    psm: the page segmentation mode (3 = automatic, the default of tesseract; 7 = a single line of text)
+    whitelist: the only characters tesseract may recognize ('' = all the characters)
+    """
+    lang: str | None
+    psm: int = 3
+    whitelist: str = ''
+
+
+# THE OCR PROFILES, THE TEXT PROFILE IS USED FOR THE LABELS WITHOUT A PROFILE (description, comment)
+OCR_PROFILES = {
+    'text': OcrProfile(lang=None),
+    # instagram numbers: 1,234 / 12.5K / 1.2M / 2B, SOMETIMES FOLLOWED BY A WORD (e.g. 1,234 likes)
+    # THE SUFFIXES ARE ALSO ALLOWED IN LOWERCASE (12.5k), parse_number IGNORES THEIR CASE
+    'numeric': OcrProfile(lang='eng', psm=7, whitelist='0123456789.,KMBkmb'),
+    # "March 5", "March 5, 2024", "2 days ago" (THE ENGLISH instagram INTERFACE)
+    'date': OcrProfile(lang='eng', psm=7),
+    # instagram usernames contain only lowercase letters, digits, periods and underscores
+    'username': OcrProfile(lang='eng', psm=7, whitelist='abcdefghijklmnopqrstuvwxyz0123456789._'),
+}
+# THE OCR PROFILE OF EACH LABEL (LOWER CASE)
+LABEL_OCR_PROFILES = {
+    'followers': 'numeric',
+    'following': 'numeric',
+    'posts': 'numeric',
+    'likes': 'numeric',
+    'date': 'date',
+    'username': 'username',
+}
+
 
 def parse_number(text):
     """
@@ -47,6 +130,24 @@ def parse_number(text):
         return None
 
 
+def cv2_img_to_bytes(cv2_img, image_format='jpeg') -> bytes:
+    """
+    Encodes a cv2 image, by default in jpeg format (the detected photos are staged/cached as they are encoded, without
+    base64)
+
+    :param cv2_img: OpenCV image (numpy array).
+    :param image_format: Image format (jpeg, png or jpg).
+    :return: the bytes of the encoded image
+    :raises: HTTP_400_BAD_REQUEST if the image could not be encoded
+    """
+    success, encoded_image = cv2.imencode(f'.{image_format}', cv2_img)
+    if not success:
+        logger.error('Could not encode the cv2 image')
+        raise CustomHTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                  message="Could not encode the image")
+    return encoded_image.tobytes()
+
+
 def cv2_img_to_base64(cv2_img, image_format='jpeg'):
     """
     Converts a cv2 image to a base64-encoded string, by default converts it to jpeg format
@@ -111,6 +212,27 @@ def base64_to_cv2_img(base64_str):
         )
 
 
+def bytes_to_cv2_img(image_bytes):
+    """
+    Decodes the bytes of an encoded image (png, jpeg...) into a cv2 image, without intermediate copies of the bytes
+    :param image_bytes: the encoded image (bytes, bytearray or memoryview)
+    :return: the image converted into cv2
+    Throws exception if the bytes don't represent a valid image
+    """
+    try:
+        # np.frombuffer ONLY CREATES A VIEW OVER THE BYTES, cv2.imdecode READS THEM DIRECTLY
+        img_cv2 = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    except Exception as e:
+        img_cv2 = None
+    if img_cv2 is None:
+        logger.error('Invalid image bytes')
+        raise CustomHTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            message="Invalid image format."
+        )
+    return img_cv2
+
+
 def languages_list_to_tesseract_lang(languages):
     """
     Converts a list of strings representing language names accepted by tesseract, into a single string
@@ -126,3 +248,389 @@ def languages_list_to_tesseract_lang(languages):
             tesseract_lang += languages[i]
 
     return tesseract_lang
+
+
+def perceptual_hash(image, hash_size=16):
+    """
+    Computes the perceptual hash (pHash) of an image: the low frequencies of the DCT of the small grayscale image are
+    compared with their median. Re-encoding or slightly resizing an image doesn't change its hash.
+    :param image: the cv2 image (BGR or grayscale)
+    :param hash_size: the hash has hash_size * hash_size bits
+    :return: the hash as a hex string
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    # THE IMAGE IS REDUCED TO (4 * hash_size)^2 PIXELS, ONLY THE TOP-LEFT hash_size^2 DCT COEFFICIENTS ARE KEPT
+    small = cv2.resize(gray, (hash_size * 4, hash_size * 4), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_frequencies = cv2.dct(small)[:hash_size, :hash_size]
+    bits = low_frequencies > np.median(low_frequencies)
+    return np.packbits(bits.flatten()).tobytes().hex()
+
+
+def hash_distance(hash1, hash2):
+    """
+    :param hash1: perceptual hash (hex string)
+    :param hash2: perceptual hash of the same size (hex string)
+    :return: the number of different bits of the hashes (hamming distance)
+    """
+    return bin(int(hash1, 16) ^ int(hash2, 16)).count('1')
+
+
+def image_thumbnail(image, width=128):
+    """
+    Reduces the image to a small grayscale image with the given width (keeping the aspect ratio)
+    :param image: the cv2 image (BGR or grayscale)
+    :param width: the width of the thumbnail
+    :return: the grayscale thumbnail
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    height = max(1, round(gray.shape[0] * width / gray.shape[1]))
+    return cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def downscale_for_inference(image, max_side=YOLO_IMGSZ):
+    """
+    Reduces the image so that its longest side is max_side (YOLO resizes its input to this size anyway), the original
+    image is kept for cropping the regions of interest at full resolution
+    :param image: the decoded image (cv2)
+    :param max_side: the longest side of the reduced image
+    :return: the reduced image and the x, y scale factors which map its coordinates back to the original image
+    """
+    height, width = image.shape[:2]
+    ratio = max_side / max(height, width)
+    if ratio >= 1:
+        return image, 1.0, 1.0
+
+    small_width = max(1, round(width * ratio))
+    small_height = max(1, round(height * ratio))
+    # INTER_AREA AVOIDS THE ALIASING OF THE SMALL TEXT WHEN REDUCING THE IMAGE
+    small = cv2.resize(image, (small_width, small_height), interpolation=cv2.INTER_AREA)
+    return small, width / small_width, height / small_height
+
+
+def results_to_detections(image_results, scale_x, scale_y, original_shape) -> Detections:
+    """
+    Converts the YOLO results of a (reduced) image into Detections in the coordinates of the original image
+    :param image_results: the YOLO results of the reduced image
+    :param scale_x: the x scale factor returned by downscale_for_inference
+    :param scale_y: the y scale factor returned by downscale_for_inference
+    :param original_shape: the shape of the original image
+    :return: the Detections of the original image
+    """
+    boxes = image_results.boxes
+    xyxy = boxes.xyxy.cpu().numpy().astype(np.float32) * np.array([scale_x, scale_y, scale_x, scale_y],
+                                                                    dtype=np.float32)
+    # THE BOXES MUST STAY INSIDE THE ORIGINAL IMAGE
+    height, width = original_shape[:2]
+    xyxy[:, [0, 2]] = np.clip(xyxy[:, [0, 2]], 0, width)
+    xyxy[:, [1, 3]] = np.clip(xyxy[:, [1, 3]], 0, height)
+    return Detections(
+        xyxy=xyxy,
+        cls=boxes.cls.cpu().numpy().astype(np.int64),
+        conf=boxes.conf.cpu().numpy().astype(np.float32),
+    )
+
+
+def box_coords(box):
+    """
+    :param box: a box (x1, y1, x2, y2) with float coordinates
+    :return: the integer coordinates of the box (used for slicing the image)
+    """
+    x1, y1, x2, y2 = (int(value) for value in box)
+    return x1, y1, x2, y2
+
+
+def boxes_areas(xyxy):
+    """
+    :param xyxy: float array (N, 4) with boxes
+    :return: float array (N,) with the areas of the boxes
+    """
+    return (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+
+
+def label_mask(detections: Detections, class_names, label_names):
+    """
+    :param detections: the detected boxes
+    :param class_names: dictionary with the class indexes as keys and the label names as values
+    :param label_names: the label names (lower case) to be selected
+    :return: boolean array (N,) which is True for the boxes with one of the given labels
+    """
+    class_indexes = [index for index, name in class_names.items() if name.lower() in label_names]
+    return np.isin(detections.cls, class_indexes)
+
+
+def largest_box(detections: Detections, class_names, label_name):
+    """
+    :param detections: the detected boxes
+    :param class_names: dictionary with the class indexes as keys and the label names as values
+    :param label_name: the label name (lower case)
+    :return: the coordinates of the box with the biggest area having the given label, or None
+    """
+    indexes = np.flatnonzero(label_mask(detections, class_names, [label_name]))
+    if len(indexes) == 0:
+        return None
+    return detections.xyxy[indexes[np.argmax(boxes_areas(detections.xyxy[indexes]))]]
+
+
+def rank_label_candidates(detections: Detections, class_names, label_names, top_k, conf_margin):
+    """
+    Groups the boxes by label and ranks the boxes of each label by confidence, then by area. Only the best box of a
+    label is kept, except when the label is ambiguous: the next boxes (up to top_k) whose confidence is within
+    conf_margin of the best box are also kept, so the caller can choose between them (e.g. the one with most text)
+    :param detections: the detected boxes
+    :param class_names: dictionary with the class indexes as keys and the label names as values
+    :param label_names: the label names (lower case) to be ranked, the other boxes are ignored
+    :param top_k: the maximum number of candidates kept for an ambiguous label
+    :param conf_margin: how close to the best confidence a box must be to stay a candidate
+    :return: dictionary with the label names as keys and the arrays with the indexes of their candidate boxes
+    """
+    areas = boxes_areas(detections.xyxy)
+    candidates = {}
+    for class_index in np.unique(detections.cls[label_mask(detections, class_names, label_names)]):
+        indexes = np.flatnonzero(detections.cls == class_index)
+        # lexsort USES THE LAST KEY AS THE PRIMARY KEY: CONFIDENCE DESCENDING, THEN AREA DESCENDING
+        ranked = indexes[np.lexsort((-areas[indexes], -detections.conf[indexes]))][:max(1, top_k)]
+        best_conf = detections.conf[ranked[0]]
+        candidates[class_names[int(class_index)]] = ranked[detections.conf[ranked] >= best_conf - conf_margin]
+    return candidates
+
+
+def boxes_overlaps(xyxy):
+    """
+    :param xyxy: float array (N, 4) with boxes
+    :return: two float arrays (N, N): the intersection over union of each pair of boxes and the containment of each
+    pair (intersection over the area of the smaller box, 1 if one box is inside the other)
+    """
+    top_left = np.maximum(xyxy[:, None, :2], xyxy[None, :, :2])
+    bottom_right = np.minimum(xyxy[:, None, 2:], xyxy[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    areas = boxes_areas(xyxy)
+    union = areas[:, None] + areas[None, :] - intersection
+    smaller_area = np.minimum(areas[:, None], areas[None, :])
+    iou = np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+    containment = np.divide(intersection, smaller_area, out=np.zeros_like(intersection), where=smaller_area > 0)
+    return iou, containment
+
+
+def boxes_agreement(first: Detections, second: Detections, iou_threshold):
+    """
+    Measures how much two detections of the same image agree: the boxes are matched one to one (greedily, by IoU)
+    with the boxes of the same label having at least iou_threshold IoU
+    :param first: the Detections of a model
+    :param second: the Detections of another model, in the same coordinates
+    :param iou_threshold: the minimum IoU of two matched boxes
+    :return: the number of matched boxes over the number of boxes of the detection with more boxes (1 if both are empty)
+    """
+    total = max(len(first.cls), len(second.cls))
+    if total == 0:
+        return 1.0
+    if len(first.cls) == 0 or len(second.cls) == 0:
+        return 0.0
+    iou = boxes_overlaps(np.concatenate([first.xyxy, second.xyxy]))[0][:len(first.cls), len(first.cls):]
+    iou[first.cls[:, None] != second.cls[None, :]] = 0
+
+    matched = 0
+    used_first, used_second = set(), set()
+    for i, j in zip(*np.unravel_index(np.argsort(-iou, axis=None), iou.shape)):
+        if iou[i, j] < iou_threshold:
+            break
+        if i not in used_first and j not in used_second:
+            used_first.add(i)
+            used_second.add(j)
+            matched += 1
+    return matched / total
+
+
+def dedup_boxes(detections: Detections, class_names, label_names, iou_threshold, containment_threshold,
+                seam_mask=None, tile_ids=None) -> Detections:
+    """
+    Merges the overlapping boxes of the same label: two boxes are duplicates if their IoU is at least iou_threshold or
+    if one of them is (almost) inside the other (containment at least containment_threshold). Each group of duplicates
+    (transitively) is replaced by the box which covers all of them, with the highest confidence of the group.
+    The boxes of the other labels are kept unchanged.
+    :param detections: the detected boxes
+    :param class_names: dictionary with the class indexes as keys and the label names as values
+    :param label_names: the label names (lower case) to be deduplicated e.g. comment, description
+    :param iou_threshold: the minimum IoU of two duplicate boxes
+    :param containment_threshold: the minimum containment of two duplicate boxes
+    :param seam_mask: optional boolean array (N,) which is True for the boxes cut by the edge of a tile (see
+    merge_tile_detections), such a box is also a duplicate of the boxes of the same label from another tile which
+    overlap it vertically and cover at least half of its width (the other part of the same object, detected in the
+    neighbour tile)
+    :param tile_ids: int array (N,) with the tile of each box (required with seam_mask)
+    :return: the detections without duplicates
+    """
+    mask = label_mask(detections, class_names, label_names)
+    xyxy = [detections.xyxy[~mask]]
+    cls = [detections.cls[~mask]]
+    conf = [detections.conf[~mask]]
+
+    for class_index in np.unique(detections.cls[mask]):
+        indexes = np.flatnonzero(detections.cls == class_index)
+        boxes = detections.xyxy[indexes]
+        iou, containment = boxes_overlaps(boxes)
+        duplicates = (iou >= iou_threshold) | (containment >= containment_threshold)
+        if seam_mask is not None:
+            cut = seam_mask[indexes]
+            tiles = tile_ids[indexes]
+            overlap_x = np.clip(np.minimum(boxes[:, None, 2], boxes[None, :, 2]) -
+                                np.maximum(boxes[:, None, 0], boxes[None, :, 0]), 0, None)
+            narrower_width = np.minimum(boxes[:, None, 2] - boxes[:, None, 0], boxes[None, :, 2] - boxes[None, :, 0])
+            overlap_y = (np.minimum(boxes[:, None, 3], boxes[None, :, 3]) -
+                         np.maximum(boxes[:, None, 1], boxes[None, :, 1])) > 0
+            duplicates |= (cut[:, None] | cut[None, :]) & (tiles[:, None] != tiles[None, :]) & overlap_y & \
+                (overlap_x >= 0.5 * narrower_width)
+
+        # GROUPS OF DUPLICATES (CONNECTED COMPONENTS OF THE DUPLICATES GRAPH)
+        groups = np.full(len(indexes), -1)
+        for start in range(len(indexes)):
+            if groups[start] != -1:
+                continue
+            groups[start] = start
+            stack = [start]
+            while stack:
+                current = stack.pop()
+                for neighbour in np.flatnonzero(duplicates[current] & (groups == -1)):
+                    groups[neighbour] = start
+                    stack.append(neighbour)
+
+        for group in np.unique(groups):
+            members = groups == group
+            xyxy.append(np.concatenate([boxes[members, :2].min(axis=0), boxes[members, 2:].max(axis=0)])[None, :])
+            cls.append(np.array([class_index], dtype=detections.cls.dtype))
+            conf.append(np.array([detections.conf[indexes][members].max()], dtype=detections.conf.dtype))
+
+    return Detections(
+        xyxy=np.concatenate(xyxy).astype(detections.xyxy.dtype, copy=False),
+        cls=np.concatenate(cls),
+        conf=np.concatenate(conf),
+    )
+
+
+def label_ocr_profile(label_name, lang) -> OcrProfile:
+    """
+    :param label_name: the label of the box e.g. followers, description
+    :param lang: the tesseract languages used if the profile of the label doesn't have its own languages
+    :return: the OCR profile of the label (see LABEL_OCR_PROFILES), with the languages set
+    """
+    profile = OCR_PROFILES[LABEL_OCR_PROFILES.get(label_name.lower(), 'text')]
+    if profile.lang is None:
+        profile = profile._replace(lang=lang)
+    return profile
+
+
+def tile_offsets(height, width):
+    """
+    Splits a tall image (height/width above YOLO_TILE_MIN_ASPECT_RATIO, e.g. a scrolling capture) into overlapping
+    tiles with the aspect ratio of a phone screen (YOLO_TILE_ASPECT_RATIO), so the boxes are not squashed when the image
+    is reduced to the size of the model
+    :param height: the height of the image
+    :param width: the width of the image
+    :return: the tile height and the list with the top row of each tile (a single tile for a normal image)
+    """
+    if height <= width * YOLO_TILE_MIN_ASPECT_RATIO:
+        return height, [0]
+    tile_height = int(width * YOLO_TILE_ASPECT_RATIO)
+    step = max(1, int(tile_height * (1 - YOLO_TILE_OVERLAP)))
+    offsets = list(range(0, height - tile_height, step))
+    offsets.append(height - tile_height)
+    return tile_height, offsets
+
+
+def merge_tile_detections(tiles_detections, offsets, tile_height, image_shape, class_names) -> Detections:
+    """
+    Merges the Detections of the tiles of an image into the Detections of the image: the boxes are moved to the
+    coordinates of the image and the text blocks (YOLO_TILE_MERGE_LABELS) detected twice in the overlap of two tiles,
+    or cut in two by the edge of a tile, are merged (see dedup_boxes), the boxes of the other labels are kept as they
+    are
+    :param tiles_detections: the Detections of each tile (in the coordinates of the tile)
+    :param offsets: the top row of each tile (see tile_offsets)
+    :param tile_height: the height of the tiles
+    :param image_shape: the shape of the image
+    :param class_names: dictionary with the class indexes as keys and the label names as values
+    :return: the Detections of the image
+    """
+    image_height = image_shape[0]
+    xyxy, cls, conf, seams, tile_ids = [], [], [], [], []
+    for tile_id, (detections, offset) in enumerate(zip(tiles_detections, offsets)):
+        boxes = detections.xyxy + np.array([0, offset, 0, offset], dtype=detections.xyxy.dtype)
+        # A BOX TOUCHING AN EDGE OF THE TILE WHICH IS NOT AN EDGE OF THE IMAGE WAS (PROBABLY) CUT BY THE TILE
+        cut_top = (offset > 0) & (boxes[:, 1] <= offset + YOLO_TILE_SEAM_MARGIN)
+        cut_bottom = (offset + tile_height < image_height) & \
+                     (boxes[:, 3] >= offset + tile_height - YOLO_TILE_SEAM_MARGIN)
+        xyxy.append(boxes)
+        cls.append(detections.cls)
+        conf.append(detections.conf)
+        seams.append(cut_top | cut_bottom)
+        tile_ids.append(np.full(len(boxes), tile_id))
+
+    merged = Detections(xyxy=np.concatenate(xyxy), cls=np.concatenate(cls), conf=np.concatenate(conf))
+    return dedup_boxes(merged, class_names, YOLO_TILE_MERGE_LABELS, YOLO_DEDUP_IOU, YOLO_DEDUP_CONTAINMENT,
+                       np.concatenate(seams), np.concatenate(tile_ids))
+
+
+def content_band(height):
+    """
+    :param height: the height of a screenshot
+    :return: the first and the last row (exclusive) of its scrolling content (without the header and footer bands)
+    """
+    return int(height * YOLO_SEQUENCE_HEADER), height - int(height * YOLO_SEQUENCE_FOOTER)
+
+
+def estimate_scroll_offset(previous, current):
+    """
+    Estimates how many pixels the content scrolled up between two consecutive screenshots of the same screen, by
+    comparing the row profiles of their content bands (the screenshots reduced to a few columns, at full height): the
+    scroll is the shift for which the rows of the current screenshot match best the rows of the previous one
+    The differences of all the shifts are computed at once: the sums of squares of the shared rows with cumulative
+    sums and their products with a cross-correlation (FFT), O(H log H) instead of comparing the rows for each shift
+    :param previous: the previous screenshot (cv2)
+    :param current: the current screenshot (cv2), taken after scrolling down
+    :return: the scroll in pixels of the current screenshot, or None if the screenshots don't overlap (or they don't
+    have the same size)
+    """
+    if previous.shape != current.shape:
+        return None
+    height = current.shape[0]
+    top, bottom = content_band(height)
+    rows = bottom - top
+    min_overlap = max(1, int(rows * YOLO_SEQUENCE_MIN_OVERLAP))
+    if rows < min_overlap:
+        return None
+
+    def row_profile(image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        profile = cv2.resize(gray, (YOLO_SEQUENCE_PROFILE_WIDTH, height), interpolation=cv2.INTER_AREA)
+        return profile[top:bottom].astype(np.float64)
+
+    previous_profile, current_profile = row_profile(previous), row_profile(current)
+    # FOR A SHIFT s, THE ROWS [s, rows) OF THE PREVIOUS PROFILE ARE COMPARED WITH THE ROWS [0, rows - s) OF THE CURRENT
+    shifts = np.arange(0, rows - min_overlap + 1)
+    overlaps = rows - shifts
+    elements = overlaps * YOLO_SEQUENCE_PROFILE_WIDTH
+
+    def cumulative(values):
+        return np.concatenate([[0.0], np.cumsum(values.sum(axis=1))])
+
+    current_sums = cumulative(current_profile)[overlaps]
+    current_squares = cumulative(current_profile ** 2)[overlaps]
+    previous_squares_cumulative = cumulative(previous_profile ** 2)
+    previous_squares = previous_squares_cumulative[rows] - previous_squares_cumulative[shifts]
+
+    # products[s] = SUM OF previous[r + s] * current[r] (ZERO PADDED TO 2 x rows, SO THE CORRELATION DOESN'T WRAP)
+    size = 1 << (2 * rows - 1).bit_length()
+    products = np.fft.irfft(np.fft.rfft(previous_profile, size, axis=0) *
+                            np.conj(np.fft.rfft(current_profile, size, axis=0)), size, axis=0).sum(axis=1)[shifts]
+
+    mean_square_diff = np.maximum(previous_squares + current_squares - 2 * products, 0) / elements
+    variance = np.maximum(current_squares / elements - (current_sums / elements) ** 2, 0)
+    # THE SHARED ROWS MUST HAVE SOME CONTENT, AN EMPTY BACKGROUND MATCHES ANY SCROLL
+    has_content = variance >= YOLO_SEQUENCE_MIN_CONTENT_STD ** 2
+    if not has_content.any():
+        return None
+    relative_diff = np.full(len(shifts), np.inf)
+    relative_diff[has_content] = np.sqrt(mean_square_diff[has_content] / variance[has_content])
+
+    best_shift = int(np.argmin(relative_diff))
+    if relative_diff[best_shift] > YOLO_SEQUENCE_MAX_RELATIVE_DIFF:
+        return None
+    return best_shift
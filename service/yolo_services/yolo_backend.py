@@ -0,0 +1,222 @@
+import os
+import re
+import time
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+from logging_config import logger
+from service.utils.yolo_utils import YOLO_IMGSZ
+
+# THE INFERENCE BACKEND OF THE YOLO MODELS: pytorch (the best.pt weights), onnx (ONNX Runtime) or openvino
+YOLO_BACKEND = os.getenv("YOLO_BACKEND", "pytorch").lower()
+# INT8 QUANTIZATION OF THE EXPORTED MODEL (onnx: static QDQ quantization, openvino: post-training quantization)
+YOLO_INT8 = os.getenv("YOLO_INT8", "false").lower() == "true"
+# DATASET YAML USED TO CALIBRATE THE OPENVINO INT8 QUANTIZATION (ultralytics uses coco8 if not given)
+YOLO_INT8_DATA = os.getenv("YOLO_INT8_DATA")
+# DIRECTORY WITH SCREENSHOTS (png/jpg) USED TO CALIBRATE THE ONNX INT8 QUANTIZATION, REQUIRED FOR onnx + YOLO_INT8
+# (THE DYNAMIC QUANTIZATION DOESN'T NEED ONE BUT IT PRODUCES ConvInteger NODES, WHICH ARE SLOWER THAN FP32 ON CPU)
+YOLO_INT8_CALIBRATION_DIR = os.getenv("YOLO_INT8_CALIBRATION_DIR")
+# MAXIMUM NUMBER OF CALIBRATION SCREENSHOTS
+YOLO_INT8_CALIBRATION_IMAGES = int(os.getenv("YOLO_INT8_CALIBRATION_IMAGES", "100"))
+
+# HOW LONG A PROCESS WAITS FOR ANOTHER PROCESS (e.g. ANOTHER DETECTION WORKER) WHICH IS EXPORTING THE SAME MODEL
+YOLO_EXPORT_WAIT_SECONDS = float(os.getenv("YOLO_EXPORT_WAIT_SECONDS", "600"))
+
+YOLO_BACKENDS = ['pytorch', 'onnx', 'openvino']
+
+
+def exported_model_path(weights_path: str, backend: str, int8: bool) -> str:
+    """
+    The path of the exported model, it is cached next to the weights
+    e.g. .../weights/best.pt => .../weights/best.onnx, .../weights/best_int8_openvino_model
+    :param weights_path: the path of the PyTorch weights
+    :param backend: onnx or openvino
+    :param int8: if the exported model is INT8-quantized
+    :return: the path of the exported model (file for onnx, directory for openvino)
+    """
+    base_path = os.path.splitext(weights_path)[0]
+    suffix = '_int8' if int8 else ''
+    if backend == 'onnx':
+        return f'{base_path}{suffix}.onnx'
+    return f'{base_path}{suffix}_openvino_model'
+
+
+def calibration_images(calibration_dir: str) -> list:
+    """
+    :param calibration_dir: the directory with the calibration screenshots
+    :return: the paths of the first YOLO_INT8_CALIBRATION_IMAGES screenshots of the directory (sorted by name)
+    """
+    names = sorted(name for name in os.listdir(calibration_dir)
+                   if name.lower().endswith(('.png', '.jpg', '.jpeg')))
+    return [os.path.join(calibration_dir, name) for name in names[:YOLO_INT8_CALIBRATION_IMAGES]]
+
+
+def calibration_input(image_path: str):
+    """
+    Preprocesses a calibration screenshot like ultralytics does before the forward pass: resized to fit YOLO_IMGSZ
+    (keeping the aspect ratio), padded with gray to YOLO_IMGSZ x YOLO_IMGSZ, RGB, CHW, values in [0, 1]
+    :param image_path: the path of the screenshot
+    :return: the input tensor (1 x 3 x YOLO_IMGSZ x YOLO_IMGSZ, float32), None if the image can't be read
+    """
+    image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    height, width = image.shape[:2]
+    scale = YOLO_IMGSZ / max(height, width)
+    resized_height, resized_width = round(height * scale), round(width * scale)
+    image = cv2.resize(image, (resized_width, resized_height), interpolation=cv2.INTER_LINEAR)
+    padded = np.full((YOLO_IMGSZ, YOLO_IMGSZ, 3), 114, dtype=np.uint8)
+    top, left = (YOLO_IMGSZ - resized_height) // 2, (YOLO_IMGSZ - resized_width) // 2
+    padded[top:top + resized_height, left:left + resized_width] = image
+    return np.ascontiguousarray(padded[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255
+
+
+def detection_head_nodes(model_path: str) -> list:
+    """
+    The nodes of the Detect module of an exported YOLO model (the last /model.N/ block: the box and class
+    convolutions, the DFL convolution and the decoding of the boxes)
+    :param model_path: the path of the ONNX model
+    :return: the names of the nodes of the detection head
+    """
+    # onnx IS INSTALLED WITH ONNX RUNTIME'S QUANTIZATION TOOLS
+    import onnx
+
+    node_names = [node.name for node in onnx.load(model_path).graph.node]
+    blocks = [int(match.group(1)) for match in (re.match(r'/model\.(\d+)/', name) for name in node_names) if match]
+    if len(blocks) == 0:
+        return []
+    head_prefix = f'/model.{max(blocks)}/'
+    return [name for name in node_names if name.startswith(head_prefix)]
+
+
+def quantize_onnx_model(model_path: str, target_path: str):
+    """
+    Quantizes an ONNX model to INT8 with static QDQ quantization (the activation ranges are calibrated on the
+    screenshots of YOLO_INT8_CALIBRATION_DIR), ONNX Runtime runs the QDQ pairs as fused INT8 convolutions
+    :param model_path: the path of the FP32 ONNX model
+    :param target_path: the path of the INT8 ONNX model
+    Throws ValueError if there is no calibration screenshot
+    """
+    # ONNX RUNTIME IS IMPORTED ONLY WHEN NEEDED, IT IS NOT REQUIRED BY THE OTHER BACKENDS
+    import onnxruntime
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    image_paths = calibration_images(YOLO_INT8_CALIBRATION_DIR)
+    if len(image_paths) == 0:
+        raise ValueError(f'No calibration screenshot in {YOLO_INT8_CALIBRATION_DIR}')
+    input_name = onnxruntime.InferenceSession(model_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+
+    class ScreenshotsDataReader(CalibrationDataReader):
+        def __init__(self):
+            self.inputs = (calibration_input(image_path) for image_path in image_paths)
+
+        def get_next(self):
+            for tensor in self.inputs:
+                if tensor is not None:
+                    return {input_name: tensor}
+            return None
+
+    logger.info(f'Calibrating the INT8 quantization on {len(image_paths)} screenshots')
+    # ONLY THE CONVOLUTIONS (AND THE MATMULS OF THE ATTENTION BLOCK) OF THE BACKBONE AND OF THE NECK ARE QUANTIZED,
+    # THE DETECTION HEAD (BOX/CLASS CONVOLUTIONS, DFL, DECODING OF THE BOXES) STAYS IN FP32 SO THE COORDINATES DON'T
+    # LOSE PRECISION
+    quantize_static(model_path, target_path, ScreenshotsDataReader(),
+                    quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8,
+                    per_channel=True,
+                    op_types_to_quantize=['Conv', 'MatMul'],
+                    nodes_to_exclude=detection_head_nodes(model_path))
+
+
+def export_model(weights_path: str, backend: str, int8: bool) -> str:
+    """
+    Exports the PyTorch weights to the given backend (with dynamic input shapes, so that batched forward passes work)
+    :param weights_path: the path of the PyTorch weights
+    :param backend: onnx or openvino
+    :param int8: if the exported model is INT8-quantized
+    :return: the path of the exported model
+    """
+    target_path = exported_model_path(weights_path, backend, int8)
+    model = YOLO(weights_path)
+
+    if backend == 'onnx':
+        exported_path = model.export(format='onnx', imgsz=YOLO_IMGSZ, dynamic=True)
+        if int8:
+            quantize_onnx_model(exported_path, target_path)
+            return target_path
+    else:
+        export_args = {'format': 'openvino', 'imgsz': YOLO_IMGSZ, 'dynamic': True, 'int8': int8}
+        if int8 and YOLO_INT8_DATA:
+            export_args['data'] = YOLO_INT8_DATA
+        exported_path = model.export(**export_args)
+
+    # ultralytics NAMES THE EXPORTED MODEL BY ITSELF, MOVE IT WHERE THE CACHE EXPECTS IT
+    if os.path.normpath(exported_path) != os.path.normpath(target_path):
+        os.replace(exported_path, target_path)
+    return target_path
+
+
+def export_model_once(weights_path: str, backend: str, int8: bool):
+    """
+    Exports the model, if multiple processes start at the same time only one of them makes the export (a lock file
+    is created next to the exported model) and the others wait for it
+    :param weights_path: the path of the PyTorch weights
+    :param backend: onnx or openvino
+    :param int8: if the exported model is INT8-quantized
+    Throws TimeoutError if the export made by another process takes more than YOLO_EXPORT_WAIT_SECONDS
+    """
+    model_path = exported_model_path(weights_path, backend, int8)
+    lock_path = f'{model_path}.lock'
+    try:
+        lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        logger.info(f'Waiting for the export of {model_path} made by another process')
+        deadline = time.monotonic() + YOLO_EXPORT_WAIT_SECONDS
+        while os.path.exists(lock_path):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'Export of {model_path} not finished (remove {lock_path} if it is stale)')
+            time.sleep(1)
+        return
+
+    try:
+        logger.info(f'Exporting {weights_path} to {backend} (int8={int8})')
+        export_model(weights_path, backend, int8)
+    finally:
+        os.close(lock_fd)
+        os.remove(lock_path)
+
+
+def load_yolo_model(weights_path: str, backend: str = YOLO_BACKEND, int8: bool = YOLO_INT8):
+    """
+    Loads a YOLO model with the given inference backend.
+    The exported model is cached next to the weights, so the export is made only at the first startup.
+    If the backend is unknown or the export/loading fails, the PyTorch weights are loaded instead.
+    :param weights_path: the path of the PyTorch weights (best.pt)
+    :param backend: pytorch, onnx or openvino
+    :param int8: if the exported model is INT8-quantized
+    :return: the YOLO model
+    """
+    if backend not in YOLO_BACKENDS:
+        logger.error(f'Unknown YOLO backend {backend}, using pytorch')
+        backend = 'pytorch'
+    if backend == 'pytorch':
+        return YOLO(weights_path)
+    if backend == 'onnx' and int8 and not YOLO_INT8_CALIBRATION_DIR:
+        logger.error('YOLO_INT8_CALIBRATION_DIR is required for the onnx INT8 quantization, using onnx FP32')
+        int8 = False
+
+    model_path = exported_model_path(weights_path, backend, int8)
+    try:
+        if not os.path.exists(model_path):
+            export_model_once(weights_path, backend, int8)
+        model = YOLO(model_path, task='detect')
+        # LOADS THE BACKEND NOW (AND FAILS NOW IF THE RUNTIME IS MISSING) INSTEAD OF AT THE FIRST REQUEST
+        model.names
+        logger.info(f'YOLO model loaded with {backend} backend: {model_path}')
+        return model
+    except Exception as e:
+        logger.error(f'Could not load {weights_path} with {backend} backend, using pytorch: {e}')
+        return YOLO(weights_path)
@@ -0,0 +1,186 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from logging_config import logger
+
+
+class YoloBatchScheduler:
+    """
+    Dynamic micro-batching in front of a YOLO model.
+    The callers (request threads) put their images in a queue and wait on a Future, a single worker thread takes the
+    first waiting image, collects the images that arrive in the next max_wait_ms milliseconds (or until
+    max_batch_size images are collected) and runs ONE batched forward pass for all of them, then hands each caller
+    its own Results object.
+    The images submitted with a different inference size (imgsz) than the default one of the model are run in their
+    own forward pass (one forward pass for each size found in the batch).
+    Because only the worker thread calls the model, the model is never used by two threads at the same time.
+    """
+
+    def __init__(self, model, name: str, max_batch_size: int, max_wait_ms: float):
+        """
+        :param model: the YOLO model (callable with a list of images, returns a list of Results)
+        :param name: the name of the scheduler (used for logging and metrics)
+        :param max_batch_size: the maximum number of images in a forward pass
+        :param max_wait_ms: how long the worker waits for other images after the first one arrived
+        """
+        self.model = model
+        self.name = name
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max(0.0, max_wait_ms)
+
+        self.queue = queue.Queue()
+        # AFTER close() NO IMAGE IS ACCEPTED ANYMORE (AN IMAGE QUEUED AFTER THE STOP SIGNAL WOULD WAIT FOREVER)
+        self.closed = False
+        self.close_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.max_queue_depth = 0
+        self.no_batches = 0
+        self.no_images = 0
+        self.last_batch_size = 0
+        self.total_wait_ms = 0.0
+        self.total_inference_ms = 0.0
+
+        self.worker = threading.Thread(target=self.run, name=f"yolo-batch-{name}", daemon=True)
+        self.worker.start()
+
+    def submit(self, image, imgsz=None) -> Future:
+        """
+        Adds the image to the queue of the next batch
+        :param image: the decoded image (cv2)
+        :param imgsz: the inference size of the image (None = the default size of the model)
+        :return: Future which will hold the Results of the image
+        Throws RuntimeError if the scheduler was closed
+        """
+        future = Future()
+        with self.close_lock:
+            if self.closed:
+                raise RuntimeError(f'{self.name} batch scheduler is closed')
+            self.queue.put((image, future, time.monotonic(), imgsz))
+        with self.stats_lock:
+            self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return future
+
+    def predict(self, image):
+        """
+        Runs the model over the given image, batched together with the images of the other callers
+        :param image: the decoded image (cv2)
+        :return: the Results of the image
+        """
+        return self.submit(image).result()
+
+    def predict_many(self, images, imgsz=None):
+        """
+        Runs the model over all the given images (they will be split into batches of at most max_batch_size)
+        :param images: list with decoded images (cv2)
+        :param imgsz: the inference size of the images (None = the default size of the model)
+        :return: list with the Results of each image, in the same order
+        """
+        futures = [self.submit(image, imgsz) for image in images]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """
+        Stops the worker thread (e.g. when the model is replaced): the batch already collected by the worker is still
+        run, the images still waiting in the queue are failed with RuntimeError (nobody waits forever for them)
+        """
+        with self.close_lock:
+            if self.closed:
+                return
+            self.closed = True
+            pending = []
+            while True:
+                try:
+                    pending.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.queue.put(None)
+
+        for _, future, *_ in pending:
+            future.set_exception(RuntimeError(f'{self.name} batch scheduler is closed'))
+
+    def collect_batch(self):
+        """
+        Blocks until an image is queued, then collects the images arriving in the next max_wait_ms milliseconds
+        (at most max_batch_size images)
+        :return: list with (image, future, enqueue_time, imgsz) items, or None if the scheduler was closed
+        """
+        item = self.queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self.queue.get(timeout=remaining)
+                else:
+                    # THE WAITING TIME IS OVER, BUT THE IMAGES ALREADY IN THE QUEUE ARE STILL TAKEN
+                    item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # THE SCHEDULER WAS CLOSED, THE IMAGES COLLECTED SO FAR ARE STILL PROCESSED
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def run(self):
+        """
+        The loop of the worker thread: collect a batch, run the forward pass, resolve the futures
+        """
+        while True:
+            batch = self.collect_batch()
+            if batch is None:
+                logger.info(f'{self.name} batch scheduler closed')
+                return
+            started = time.monotonic()
+            for imgsz in dict.fromkeys(imgsz for *_, imgsz in batch):
+                self.run_forward_pass([item for item in batch if item[3] == imgsz], imgsz)
+            finished = time.monotonic()
+
+            with self.stats_lock:
+                self.no_batches += 1
+                self.no_images += len(batch)
+                self.last_batch_size = len(batch)
+                self.total_wait_ms += sum((started - enqueued) * 1000 for _, _, enqueued, _ in batch)
+                self.total_inference_ms += (finished - started) * 1000
+
+    def run_forward_pass(self, batch, imgsz):
+        """
+        Runs one forward pass over the images of the batch and resolves their futures
+        :param batch: list with (image, future, enqueue_time, imgsz) items, all with the same imgsz
+        :param imgsz: the inference size of the images (None = the default size of the model)
+        """
+        try:
+            images = [image for image, *_ in batch]
+            results = self.model(images) if imgsz is None else self.model(images, imgsz=imgsz)
+            for (_, future, *_), image_results in zip(batch, results):
+                future.set_result(image_results)
+        except Exception as e:
+            logger.error(f'{self.name} batch inference failed: {e}')
+            for _, future, *_ in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def stats(self) -> dict:
+        """
+        :return: the tunables and the queue/batch metrics of the scheduler
+        """
+        with self.stats_lock:
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'queue_depth': self.queue.qsize(),
+                'max_queue_depth': self.max_queue_depth,
+                'no_batches': self.no_batches,
+                'no_images': self.no_images,
+                'last_batch_size': self.last_batch_size,
+                'avg_batch_size': self.no_images / self.no_batches if self.no_batches else 0.0,
+                'avg_queue_wait_ms': self.total_wait_ms / self.no_images if self.no_images else 0.0,
+                'avg_inference_ms': self.total_inference_ms / self.no_batches if self.no_batches else 0.0,
+                'avg_image_inference_ms': self.total_inference_ms / self.no_images if self.no_images else 0.0,
+            }
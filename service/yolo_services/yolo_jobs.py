@@ -0,0 +1,159 @@
+import asyncio
+import os
+import time
+from uuid import uuid4
+
+from fastapi import status
+
+from exceptions.custom_exceptions import CustomHTTPException
+from logging_config import logger
+from service.yolo_services.yolo_worker_pool import YOLO_INFERENCE_WORKERS
+from websocket.websocket_connection import notify_client
+from websocket.ws_types import WebsocketType
+
+# MAXIMUM NUMBER OF DETECTION JOBS WAITING OR RUNNING, THE NEXT ONES ARE REJECTED WITH 503
+YOLO_JOBS_MAX_QUEUED = int(os.getenv("YOLO_JOBS_MAX_QUEUED", "100"))
+# NUMBER OF JOBS RUNNING AT THE SAME TIME, THE OTHERS WAIT FOR THEIR TURN (A BURST IS QUEUED INSTEAD OF REJECTED)
+YOLO_JOBS_CONCURRENCY = int(os.getenv("YOLO_JOBS_CONCURRENCY", str(max(1, YOLO_INFERENCE_WORKERS))))
+# HOW LONG THE RESULT OF A FINISHED JOB CAN BE RETRIEVED
+YOLO_JOBS_TTL_SECONDS = float(os.getenv("YOLO_JOBS_TTL_SECONDS", "600"))
+# A JOB REJECTED BY THE DETECTION WORKERS (QUEUE FULL, 503) IS RETRIED AFTER THIS DELAY, AT MOST THIS MANY TIMES
+YOLO_JOBS_RETRY_SECONDS = float(os.getenv("YOLO_JOBS_RETRY_SECONDS", "1"))
+YOLO_JOBS_MAX_RETRIES = int(os.getenv("YOLO_JOBS_MAX_RETRIES", "30"))
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+class DetectionJob:
+    """
+    A detection running in background: the client gets its id immediately and receives the result over the websocket
+    (DETECTION_JOB_DONE) or with GET /yolo/jobs/{id}
+    """
+
+    def __init__(self, user_id: int, kind: str):
+        """
+        :param user_id: the id of the user who created the job (only he can see it)
+        :param kind: what is detected (profile/post/auto)
+        """
+        self.id = uuid4().hex
+        self.user_id = user_id
+        self.kind = kind
+        self.status = JOB_QUEUED
+        self.result = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self) -> dict:
+        """
+        :return: the job as it is sent to the client
+        """
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'result': self.result,
+        }
+
+
+# THE JOBS OF THIS API PROCESS (LIKE THE WEBSOCKET CONNECTIONS, THEY ARE KEPT IN MEMORY)
+detection_jobs: dict[str, DetectionJob] = {}
+# THE TASKS OF THE UNFINISHED JOBS (asyncio KEEPS ONLY WEAK REFERENCES TO THE TASKS)
+detection_job_tasks = set()
+detection_jobs_semaphore: asyncio.Semaphore | None = None
+
+
+def remove_expired_jobs():
+    """
+    Forgets the finished jobs older than YOLO_JOBS_TTL_SECONDS
+    """
+    now = time.time()
+    for job_id, job in list(detection_jobs.items()):
+        if job.finished_at is not None and now - job.finished_at > YOLO_JOBS_TTL_SECONDS:
+            detection_jobs.pop(job_id, None)
+
+
+def submit_detection_job(user_id: int, kind: str, detect) -> DetectionJob:
+    """
+    Creates a detection job and starts it in background (it waits for its turn if YOLO_JOBS_CONCURRENCY jobs are
+    running), the user is notified over the websocket when it is finished
+    :param user_id: the id of the user who created the job
+    :param kind: what is detected (profile/post/auto)
+    :param detect: async function(job) which runs the detection and returns the result (a dict)
+    :return: the created job
+    Throws 503 SERVICE_UNAVAILABLE if YOLO_JOBS_MAX_QUEUED jobs are already waiting or running
+    """
+    global detection_jobs_semaphore
+    remove_expired_jobs()
+    if len(detection_job_tasks) >= YOLO_JOBS_MAX_QUEUED:
+        logger.error('Detection jobs queue is full')
+        raise CustomHTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            message="Too many detection jobs in progress, try again later."
+        )
+    if detection_jobs_semaphore is None:
+        # CREATED AT THE FIRST USE, INSIDE THE EVENT LOOP OF THE APP
+        detection_jobs_semaphore = asyncio.Semaphore(YOLO_JOBS_CONCURRENCY)
+
+    job = DetectionJob(user_id, kind)
+    detection_jobs[job.id] = job
+    task = asyncio.create_task(run_detection_job(job, detect))
+    detection_job_tasks.add(task)
+    task.add_done_callback(detection_job_tasks.discard)
+    logger.info(f'detection job {job.id} ({kind}) queued for user {user_id}')
+    return job
+
+
+async def run_detection_job(job: DetectionJob, detect):
+    """
+    Runs the detection of the job (retrying while the detection workers are full), stores its result and notifies
+    the user
+    :param job: the job
+    :param detect: async function(job) which runs the detection and returns the result (a dict)
+    """
+    for attempt in range(YOLO_JOBS_MAX_RETRIES + 1):
+        retry = False
+        async with detection_jobs_semaphore:
+            job.status = JOB_RUNNING
+            try:
+                job.result = await detect(job)
+                job.status = JOB_DONE
+            except CustomHTTPException as e:
+                if e.status_code == status.HTTP_503_SERVICE_UNAVAILABLE and attempt < YOLO_JOBS_MAX_RETRIES:
+                    retry = True
+                else:
+                    job.result = {'message': e.message, 'status_code': e.status_code}
+                    job.status = JOB_FAILED
+            except Exception as e:
+                logger.error(f'detection job {job.id} failed: {e}')
+                job.result = {'message': "Detection failed.", 'status_code': status.HTTP_500_INTERNAL_SERVER_ERROR}
+                job.status = JOB_FAILED
+        if not retry:
+            break
+        # THE SLOT IS RELEASED DURING THE BACKOFF, SO THE OTHER JOBS CAN RUN WHILE THIS ONE WAITS
+        job.status = JOB_QUEUED
+        await asyncio.sleep(YOLO_JOBS_RETRY_SECONDS)
+    job.finished_at = time.time()
+    logger.info(f'detection job {job.id} {job.status}')
+
+    await notify_client(job.user_id, job.to_dict(), WebsocketType.DETECTION_JOB_DONE)
+
+
+def get_detection_job(job_id: str, user_id: int) -> DetectionJob:
+    """
+    :param job_id: the id of the job
+    :param user_id: the id of the user asking for the job
+    :return: the job
+    Throws 404 NOT_FOUND if the job doesn't exist, it expired or it belongs to another user
+    """
+    remove_expired_jobs()
+    job = detection_jobs.get(job_id)
+    if job is None or job.user_id != user_id:
+        logger.error(f'detection job {job_id} not found')
+        raise CustomHTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            message="Detection job not found."
+        )
+    return job
@@ -1,117 +1,133 @@
+import os
 import re
 from datetime import datetime, timedelta
+from difflib import SequenceMatcher
 
 import cv2
-import pytesseract
+import numpy as np
 
 from logging_config import logger
-from service.utils.yolo_utils import languages_list_to_tesseract_lang
+from service.utils.ocr_utils import ocr_images, submit_ocr, ocr_images_stacked, first_pass_is_reusable, \
+    OCR_STACK_COMMENTS
+from service.utils.yolo_utils import languages_list_to_tesseract_lang, label_ocr_profile, largest_box, \
+    rank_label_candidates, box_coords, label_mask, dedup_boxes, YOLO_AMBIGUOUS_TOP_K, YOLO_AMBIGUOUS_CONF_MARGIN, \
+    YOLO_DEDUP_IOU, YOLO_DEDUP_CONTAINMENT
 from service.utils.lang_utils import COMMON_LANGUAGES, normalize_text, normalize_text_for_language_analysis, \
-    predict_text_language_fasttext_lid218, MAX_CHARACTERS_LENGTH_LINGUA, predict_text_language_lingua
+    predict_text_language_with_confidence
 
+# TWO COMMENTS OF THE SAME POST ARE THE SAME COMMENT (SEEN IN TWO SCREENSHOTS) IF THEIR TEXTS ARE AT LEAST THIS SIMILAR
+# (THE OCR OF THE SAME COMMENT CAN DIFFER A LITTLE BETWEEN SCREENSHOTS)
+POST_COMMENTS_SIMILARITY = float(os.getenv("POST_COMMENTS_SIMILARITY", "0.9"))
 
-def extract_post_data(image, image_results, class_names):
+
+def extract_post_data(image, detections, class_names, on_fields=None):
     """
     Extracts the post photo and a dictionary with the rest of the images with their extracted text from with
     pytesseract (with common languages specified).
 
-    The bounding box for the post photo is selected based on the bounding box with the biggest area, and the bounding
-    boxes with texts (except comments which all have the same label), are selected based on the box that contains
-    the greatest amount of text for a specific label
+    The bounding box for the post photo is selected based on the bounding box with the biggest area. The boxes
+    of each text label (except comments which all have the same label) are ranked by confidence and area and only the
+    best one is OCR'd (or the top candidates when the label is ambiguous, then the box that contains the greatest
+    amount of text is selected)
 
     :param class_names: the names of the bounding boxes labels
     :param image: the image to which the results with bounding-boxes corresponds
-    :param image_results: the bounding boxes extracted from the image
-    :return: post photo, a dictionary with the rest of the images and their associated text:
-    description/likes/date: {image: ... , text: ...}
+    :param detections: the bounding boxes detected in the image (Detections, in the image coordinates)
+    :param on_fields: optional function(post photo, texts dictionary) called as soon as the photo and the texts of
+    description/likes/date are extracted, while the comments are still being OCR'd
+    :return: post photo, a dictionary with the rest of the images (grayscale) and their associated text:
+    description/likes/date: {image: ... , text: ... , confidence: ...}
     and returns a list with all the comment labels:
-    comment:[{image: ... , text: ...},{image: ... , text: ...} ...]
+    comment:[{image: ... , text: ... , confidence: ...},{image: ... , text: ... , confidence: ...} ...]
     """
-    # COORDINATES FOR PHOTO WITH BIGGEST AREA
-    photo_box_coords = None
-    max_photo_area = 0
+    # THE MODEL OFTEN DETECTS THE SAME COMMENT/DESCRIPTION MULTIPLE TIMES, THE OVERLAPPING BOXES ARE MERGED
+    # SO THAT EACH TEXT IS OCR'D ONLY ONCE
+    detections = dedup_boxes(detections, class_names, ["comment", "description"],
+                             YOLO_DEDUP_IOU, YOLO_DEDUP_CONTAINMENT)
+
+    # TRANSFORM THE IMAGE TO GREY SCALE FOR BETTER TEXT DETECTION (ONCE, FOR ALL THE BOXES)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    # THE PHOTO WITH BIGGEST AREA
+    photo_box = largest_box(detections, class_names, 'photo')
+
+    # EXTRACT THE TEXT FROM THE BOX IF IS: description, likes, date
+    # comments_background AND description_background ARE IGNORED
+    candidates = rank_label_candidates(detections, class_names, ["description", "likes", "date"],
+                                       YOLO_AMBIGUOUS_TOP_K, YOLO_AMBIGUOUS_CONF_MARGIN)
+
+    # ALL THE COMMENTS ARE OCR'D, IN THE ORDER THEY APPEAR ON THE SCREEN
+    comment_indexes = np.flatnonzero(label_mask(detections, class_names, ["comment"]))
+    comment_indexes = comment_indexes[np.argsort(detections.xyxy[comment_indexes, 1], kind='stable')]
+
+    # THE BOXES OF ALL THE CANDIDATES AND OF ALL THE COMMENTS ARE OCR'D CONCURRENTLY,
+    # WITH TESSERACT WITH COMMON LANGUAGES (OR WITH THE OCR PROFILE OF THE LABEL e.g. DIGITS ONLY FOR likes)
+    # THE CANDIDATES ARE QUEUED FIRST, SO THEIR TEXTS ARE READY BEFORE THE TEXTS OF THE COMMENTS
+    ocr_candidates = [(label_name, box_coords(detections.xyxy[index]))
+                      for label_name, indexes in candidates.items() for index in indexes]
+    comments_coords = [box_coords(detections.xyxy[index]) for index in comment_indexes]
+    common_lang = languages_list_to_tesseract_lang(COMMON_LANGUAGES)
+    # ONLY THE DESCRIPTION AND THE COMMENTS NEED THE CONFIDENCE OF THEIR TEXT (SEE first_pass_is_reusable),
+    # likes AND date KEEP THE FASTER OCR WITHOUT CONFIDENCE
+    candidates_futures = [submit_ocr(gray[y1:y2, x1:x2], label_ocr_profile(label_name, common_lang),
+                                     with_confidence=label_name.lower() == 'description')
+                          for label_name, (x1, y1, x2, y2) in ocr_candidates]
+    comments_futures = [submit_ocr(gray[y1:y2, x1:x2], label_ocr_profile('comment', common_lang),
+                                   with_confidence=True)
+                        for x1, y1, x2, y2 in comments_coords]
+
     # OBJECT WITH COORDINATED FOR TEXT BOXES
     best_text_boxes = {}
-    comments_boxes = []
-
-    # BOUNDING BOXES FROM RESULTS
-    boxes = image_results.boxes.xyxy
-    # LABELS FROM RESULTS
-    labels = image_results.boxes.cls
-
-    for box, label in zip(boxes, labels):
-        x1, y1, x2, y2 = map(int, box)
-        label_name = class_names[int(label)]
-
-        # THE REGION OF THE BOX IN THE IMAGE
-        roi = image[y1:y2, x1:x2]
-
-        # VERIFY THE PHOTO WITH BIGGEST AREA
-        if label_name.lower() == "photo":
-            area = (x2 - x1) * (y2 - y1)
-            if area > max_photo_area:
-                max_photo_area = area
-                photo_box_coords = (x1, y1, x2, y2)
-
-        # EXTRACT THE TEXT FROM THE BOX IF IS: description, likes, date, comment
-        # comments_background AND description_background ARE IGNORED
-        elif label_name.lower() in ["description", "likes", "date"]:
-            # TRANSFORM THE IMAGE TO GREY SCALE FOR BETTER TEXT DETECTION
-            gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-            # DETECT THE TEXT WITH TESSERACT WITH COMMON LANGUAGES
-            text = pytesseract.image_to_string(gray,
-                                               lang=languages_list_to_tesseract_lang(COMMON_LANGUAGES))
-            # Normalize only the description text
-            if label_name.lower() == 'description':
-                text = normalize_text(text)
-
-            # print('label:', label_name, ' text:', text)
-            # CALCULATE THE LENGTH OF THE TEXT
-            text_len = len(text.strip())
-
-            # UPDATE THE LIST WITH BOUNDING BOXES THAT CONTAINS THE GREATEST AMOUNT OF TEXT FOR THE CURRENT LABEL
-            if (label_name not in best_text_boxes) or (
-                    text_len > best_text_boxes[label_name]['text_len']):
-                best_text_boxes[label_name] = {
-                    'text': text,
-                    'coords': (x1, y1, x2, y2),
-                    'text_len': text_len
-                }
-        elif label_name.lower() in ["comment"]:
-            # TRANSFORM THE IMAGE TO GREY SCALE FOR BETTER TEXT DETECTION
-            gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-            text = pytesseract.image_to_string(gray,
-                                               lang=languages_list_to_tesseract_lang(COMMON_LANGUAGES))
-            # normalize the comment
+    for (label_name, (x1, y1, x2, y2)), future in zip(ocr_candidates, candidates_futures):
+        text, confidence = future.result()
+
+        # Normalize only the description text
+        if label_name.lower() == 'description':
             text = normalize_text(text)
-            # print('label:', label_name, ' text:', text)
 
-            # UPDATE THE LIST WITH COMMENTS BOUNDING BOXES (CONTAINS A LIST WITH ALL THE COMMENTS)
-            comments_boxes.append({
+        # print('label:', label_name, ' text:', text)
+        # CALCULATE THE LENGTH OF THE TEXT
+        text_len = len(text.strip())
+
+        # AMONG THE CANDIDATES OF A LABEL KEEP THE BOX THAT CONTAINS THE GREATEST AMOUNT OF TEXT
+        if (label_name not in best_text_boxes) or (
+                text_len > best_text_boxes[label_name]['text_len']):
+            best_text_boxes[label_name] = {
                 'text': text,
+                'confidence': confidence,
                 'coords': (x1, y1, x2, y2),
-            })
+                'text_len': text_len
+            }
 
     # COMPUTE THE DICTIONARY WHICH CONTAINS THE BOX IMAGES FOR EACH LABEL, ALONG WITH THEIR EXTRACTED TEXT
     texts_images = {}
     for key, value in best_text_boxes.items():
         x1, y1, x2, y2 = value['coords']
         texts_images[key] = {
-            'image': image[y1:y2, x1:x2],
-            'text': value['text']
+            'image': gray[y1:y2, x1:x2],
+            'text': value['text'],
+            'confidence': value['confidence']
         }
+
+    post_photo = None
+    if photo_box is not None:
+        x1, y1, x2, y2 = box_coords(photo_box)
+        post_photo = image[y1:y2, x1:x2]
+    if on_fields is not None:
+        on_fields(post_photo, texts_images)
+
+    # CONTAINS A LIST WITH ALL THE COMMENTS
     comments_images = []
-    for comm in comments_boxes:
-        x1, y1, x2, y2 = comm['coords']
+    for (x1, y1, x2, y2), future in zip(comments_coords, comments_futures):
+        text, confidence = future.result()
+        # normalize the comment
         comments_images.append({
-            'image': image[y1:y2, x1:x2],
-            'text': comm['text']
+            'image': gray[y1:y2, x1:x2],
+            'text': normalize_text(text),
+            'confidence': confidence
         })
 
-    if photo_box_coords:
-        x1, y1, x2, y2 = photo_box_coords
-        return image[y1:y2, x1:x2], texts_images, comments_images
-    return None, texts_images, comments_images
+    return post_photo, texts_images, comments_images
 
 
 def detect_comments_text_with_specified_language(comments_boxes):
@@ -119,12 +135,16 @@ def detect_comments_text_with_specified_language(comments_boxes):
         Receives a list of dictionaries of the detected comments containing the image
         (with which the comment was detected with) and the text extracted without language specified in tesseract model
         :param comments_boxes: list with dictionaries with the image and text associated with the comment
-        list: [{'image':image, 'text':text},{'image':image, 'text':text},{'image':image, 'text':text}...]
+        list: [{'image':image, 'text':text, 'confidence':confidence},{'image':image, 'text':text, ...}...]
+        (the images are in grey scale)
         :return: list with all the detected comments with specified language ['comm1','comm2','comm3','comm4',...]
         """
     if len(comments_boxes) == 0:
         return []
-    accurate_comments = []
+    # FIRST THE LANGUAGE OF EACH COMMENT IS DETECTED, THEN THE COMMENTS WHOSE FIRST PASS IS NOT GOOD ENOUGH ARE OCR'D
+    # AGAIN: STACKED BY LANGUAGE (ONE TESSERACT CALL FOR ALL THE COMMENTS OF A LANGUAGE) OR EACH ONE SEPARATELY
+    # (EACH ITEM IS THE REUSED TEXT OR THE LANGUAGE OF THE SECOND PASS)
+    pending_comments = []
     for box in comments_boxes:
         try:
             # comments contain the username of the account at the beginning, we remove it so that
@@ -132,28 +152,52 @@ def detect_comments_text_with_specified_language(comments_boxes):
             comment_without_username = ' '.join(box['text'].split()[1:])
             if len(comment_without_username) > 0:
                 comment_without_username_denoised = normalize_text_for_language_analysis(comment_without_username)
-                # VERIFY IF IT IS A SHORT/LONG TEXT
-                if len(comment_without_username_denoised) <= MAX_CHARACTERS_LENGTH_LINGUA:
-                    # DETECT THE LANGUAGE WITH LINGUA
-                    src_lang = predict_text_language_lingua(comment_without_username_denoised)
-                    print(f"Lang lingua for comment':", src_lang)
+                src_lang, lang_confidence = predict_text_language_with_confidence(comment_without_username_denoised)
+                print(f"Lang for comment':", src_lang, lang_confidence)
+
+                if first_pass_is_reusable(box.get('confidence'), lang_confidence):
+                    # THE TEXT DETECTED WITH THE COMMON LANGUAGES IS ALREADY GOOD (AND NORMALIZED)
+                    pending_comments.append((box, box['text'], None))
                 else:
-                    # DETECT THE LANGUAGE WITH lid218
-                    src_lang = predict_text_language_fasttext_lid218(comment_without_username_denoised)
-                    print(f"Lang lid218 for comment':", src_lang)
-
-                # DETECTS AGAIN THE TEXT WITH SPECIFIED LANGUAGE (BETTER ACCURACY)
-                gray = cv2.cvtColor(box['image'], cv2.COLOR_BGR2GRAY)
-                # normalize the text before giving it back
-                accurate_text = normalize_text(pytesseract.image_to_string(gray, lang=src_lang))
-                if len(accurate_text) > 0:
-                    accurate_comments.append(accurate_text)
-                print("comment with lang text: ", accurate_text)
+                    # DETECTS AGAIN THE TEXT WITH SPECIFIED LANGUAGE (BETTER ACCURACY), THE IMAGE IS ALREADY IN GREY
+                    # SCALE
+                    pending_comments.append((box, None, src_lang))
         except Exception as e:
             logger.error('prediction could not be made')
             # EXCEPTION IF THE PREDICTION COULD NOT BE MADE
             print(f"Error for comment: {e}")
 
+    # THE TEXTS OF THE SECOND PASS, IN THE ORDER OF THE COMMENTS WHICH NEED IT
+    second_pass = [(box['image'], src_lang) for box, text, src_lang in pending_comments if text is None]
+    second_pass_texts = []
+    try:
+        if OCR_STACK_COMMENTS:
+            languages = list(dict.fromkeys(src_lang for _, src_lang in second_pass))
+            groups = [([image for image, src_lang in second_pass if src_lang == language],
+                       label_ocr_profile('comment', language)) for language in languages]
+            language_texts = {language: iter(texts)
+                              for language, texts in zip(languages, ocr_images_stacked(groups))}
+            second_pass_texts = [next(language_texts[src_lang]) for _, src_lang in second_pass]
+        else:
+            second_pass_texts = [result.text for result in ocr_images(
+                [(image, label_ocr_profile('comment', src_lang)) for image, src_lang in second_pass])]
+    except Exception as e:
+        logger.error('prediction could not be made')
+        # EXCEPTION IF THE PREDICTION COULD NOT BE MADE
+        print(f"Error for comments: {e}")
+
+    accurate_comments = []
+    second_pass_texts = iter(second_pass_texts)
+    for box, text, src_lang in pending_comments:
+        if text is not None:
+            accurate_text = text
+        else:
+            # normalize the text before giving it back (NO TEXT IF THE SECOND PASS FAILED)
+            accurate_text = normalize_text(next(second_pass_texts, ''))
+        if len(accurate_text) > 0:
+            accurate_comments.append(accurate_text)
+        print("comment with lang text: ", accurate_text)
+
     return accurate_comments
 
 
@@ -191,3 +235,23 @@ def parse_posts_date(text):
             return parser(match)
 
     return None  # No match found
+
+
+def dedup_comments(comments_lists):
+    """
+    Merges the comments detected in multiple screenshots of the same post, the comments seen in more than one
+    screenshot are kept only once (see POST_COMMENTS_SIMILARITY)
+    :param comments_lists: list with the lists of comments of each screenshot, in the order of the screenshots
+    :return: the list with the distinct comments, in order
+    """
+    comments = []
+    comments_keys = []
+    for comments_list in comments_lists:
+        for comment in comments_list:
+            key = ' '.join(comment.lower().split())
+            if any(key == other or SequenceMatcher(None, key, other).ratio() >= POST_COMMENTS_SIMILARITY
+                   for other in comments_keys):
+                continue
+            comments.append(comment)
+            comments_keys.append(key)
+    return comments
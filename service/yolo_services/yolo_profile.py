@@ -1,90 +1,89 @@
 import cv2
-from pytesseract import pytesseract
 
 from logging_config import logger
-from service.utils.yolo_utils import languages_list_to_tesseract_lang
-from service.utils.lang_utils import normalize_text, COMMON_LANGUAGES, predict_text_language_fasttext_lid218, \
-    normalize_text_for_language_analysis, MAX_CHARACTERS_LENGTH_LINGUA, predict_text_language_lingua
+from service.utils.ocr_utils import submit_ocr, ocr_image, first_pass_is_reusable
+from service.utils.yolo_utils import languages_list_to_tesseract_lang, label_ocr_profile, largest_box, \
+    rank_label_candidates, box_coords, YOLO_AMBIGUOUS_TOP_K, YOLO_AMBIGUOUS_CONF_MARGIN
+from service.utils.lang_utils import normalize_text, COMMON_LANGUAGES, normalize_text_for_language_analysis, \
+    predict_text_language_with_confidence
 
 
-def extract_profile_data(image, image_results, class_names):
+def extract_profile_data(image, detections, class_names):
     """
     Extracts the profile photo and a dictionary with the rest of the images with their extracted text from it with
     pytesseract (with the common languages specified).
 
-    The bounding box for the profile image is selected based on the bounding box with the biggest area, and the bounding
-    boxes with texts, are selected based on the box that contains the greatest amount of text for a specific label
+    The bounding box for the profile image is selected based on the bounding box with the biggest area. The boxes
+    of each text label are ranked by confidence and area and only the best one is OCR'd (or the top candidates when
+    the label is ambiguous, then the box that contains the greatest amount of text is selected)
 
     :param class_names: the names of the bounding boxes labels
     :param image: the image to which the results with bounding-boxes corresponds
-    :param image_results: the bounding boxes extracted from the image
-    :return: profile photo, and a dictionary with the rest of the images
-    description/followers/following/posts/username: {image: ... , text: ...}
+    :param detections: the bounding boxes detected in the image (Detections, in the image coordinates)
+    :return: profile photo, and a dictionary with the rest of the images (grayscale)
+    description/followers/following/posts/username: {image: ... , text: ... , confidence: ...}
     """
-    # COORDINATES FOR PHOTO WITH BIGGEST AREA
-    photo_box_coords = None
-    max_photo_area = 0
+    # TRANSFORM THE IMAGE TO GREY SCALE FOR BETTER TEXT DETECTION (ONCE, FOR ALL THE BOXES)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    # THE PHOTO WITH BIGGEST AREA
+    photo_box = largest_box(detections, class_names, 'photo')
+
+    # EXTRACT THE TEXT FROM THE BOXES OF: description, followers, following, posts or username
+    # photo, background AND followed_by ARE IGNORED
+    text_labels = [name.lower() for name in class_names.values()
+                   if name.lower() not in ["photo", "background", "followed_by"]]
+    candidates = rank_label_candidates(detections, class_names, text_labels,
+                                       YOLO_AMBIGUOUS_TOP_K, YOLO_AMBIGUOUS_CONF_MARGIN)
+
+    # THE BOXES OF ALL THE CANDIDATES ARE OCR'D CONCURRENTLY, WITH TESSERACT WITH COMMON LANGUAGES
+    # (OR WITH THE OCR PROFILE OF THE LABEL e.g. DIGITS ONLY FOR followers)
+    ocr_candidates = [(label_name, box_coords(detections.xyxy[index]))
+                      for label_name, indexes in candidates.items() for index in indexes]
+    common_lang = languages_list_to_tesseract_lang(COMMON_LANGUAGES)
+    # ONLY THE DESCRIPTION NEEDS THE CONFIDENCE OF ITS TEXT (SEE detect_description_text_with_specified_language),
+    # THE OTHER LABELS KEEP THE FASTER OCR WITHOUT CONFIDENCE
+    ocr_futures = [submit_ocr(gray[y1:y2, x1:x2], label_ocr_profile(label_name, common_lang),
+                              with_confidence=label_name.lower() == 'description')
+                   for label_name, (x1, y1, x2, y2) in ocr_candidates]
+    ocr_results = [future.result() for future in ocr_futures]
+
     # OBJECT WITH COORDINATED FOR TEXT BOXES
     best_text_boxes = {}
-
-    # BOUNDING BOXES FROM RESULTS
-    boxes = image_results.boxes.xyxy
-    # LABELS FROM RESULTS
-    labels = image_results.boxes.cls
-
-    for box, label in zip(boxes, labels):
-        x1, y1, x2, y2 = map(int, box)
-        label_name = class_names[int(label)]
-
-        # THE REGION OF THE BOX IN THE IMAGE
-        roi = image[y1:y2, x1:x2]
-
-        # VERIFY THE PHOTO WITH BIGGEST AREA
-        if label_name.lower() == "photo":
-            area = (x2 - x1) * (y2 - y1)
-            if area > max_photo_area:
-                max_photo_area = area
-                photo_box_coords = (x1, y1, x2, y2)
-
-        # EXTRACT THE TEXT FROM THE BOX IF IS: description, followers, following, posts or username
-        # background AND followed_by ARE IGNORED
-        elif label_name.lower() not in ["background", "followed_by"]:
-            # TRANSFORM THE IMAGE TO GREY SCALE FOR BETTER TEXT DETECTION
-            gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-            # DETECT THE TEXT WITH TESSERACT WITH COMMON LANGUAGES
-            text = pytesseract.image_to_string(gray,
-                                               lang=languages_list_to_tesseract_lang(COMMON_LANGUAGES))
-            # Normalize only the description text
-            if label_name.lower() == 'description':
-                text = normalize_text(text)
-                # Remove description if FollowedBy box is confused by yolo model with Description box
-                if text.lower().startswith('followed by') | text.lower().startswith(' followed by'):
-                    text = ''
-            # print('label:',label_name,' text:',text)
-
-            # CALCULATE THE LENGTH OF THE TEXT
-            text_len = len(text.strip())
-
-            # UPDATE THE LIST WITH BOUNDING BOXES THAT CONTAINS THE GREATEST AMOUNT OF TEXT FOR THE CURRENT LABEL
-            if (label_name not in best_text_boxes) or (
-                    text_len > best_text_boxes[label_name]['text_len']):
-                best_text_boxes[label_name] = {
-                    'text': text,
-                    'coords': (x1, y1, x2, y2),
-                    'text_len': text_len
-                }
+    for (label_name, (x1, y1, x2, y2)), (text, confidence) in zip(ocr_candidates, ocr_results):
+        # Normalize only the description text
+        if label_name.lower() == 'description':
+            text = normalize_text(text)
+            # Remove description if FollowedBy box is confused by yolo model with Description box
+            if text.lower().startswith('followed by') | text.lower().startswith(' followed by'):
+                text = ''
+        # print('label:',label_name,' text:',text)
+
+        # CALCULATE THE LENGTH OF THE TEXT
+        text_len = len(text.strip())
+
+        # AMONG THE CANDIDATES OF A LABEL KEEP THE BOX THAT CONTAINS THE GREATEST AMOUNT OF TEXT
+        if (label_name not in best_text_boxes) or (
+                text_len > best_text_boxes[label_name]['text_len']):
+            best_text_boxes[label_name] = {
+                'text': text,
+                'confidence': confidence,
+                'coords': (x1, y1, x2, y2),
+                'text_len': text_len
+            }
 
     # COMPUTE THE DICTIONARY WHICH CONTAINS THE BOX IMAGES FOR EACH LABEL, ALONG WITH THEIR EXTRACTED TEXT
     texts_images = {}
     for key, value in best_text_boxes.items():
         x1, y1, x2, y2 = value['coords']
         texts_images[key] = {
-            'image': image[y1:y2, x1:x2],
-            'text': value['text']
+            'image': gray[y1:y2, x1:x2],
+            'text': value['text'],
+            'confidence': value['confidence']
         }
 
-    if photo_box_coords:
-        x1, y1, x2, y2 = photo_box_coords
+    if photo_box is not None:
+        x1, y1, x2, y2 = box_coords(photo_box)
         return image[y1:y2, x1:x2], texts_images
     return None, texts_images
 
@@ -94,8 +93,9 @@ def detect_description_text_with_specified_language(description_boxes):
     Receives a dictionary of the description containing the image (which the description was detected with) and
     the text extracted without language specified in tesseract model
     :param description_boxes: dictionary with the image and text associated with the description
-    dictionary: {'image':image, 'text':text}
-    :return: the description extracted with language specified in tesseract
+    dictionary: {'image':image, 'text':text, 'confidence':confidence} (the image is in grey scale)
+    :return: the description extracted with language specified in tesseract (or the given text, if both the text and
+    its detected language are confident enough, see first_pass_is_reusable)
     """
     if description_boxes is None:
         return ''
@@ -108,20 +108,18 @@ def detect_description_text_with_specified_language(description_boxes):
             print("non accurate text:", description_without_username)
             description_without_username_denoised = normalize_text_for_language_analysis(description_without_username)
             print("denoised text for language detection:", description_without_username_denoised)
-            # VERIFY IF IT IS A SHORT/LONG TEXT
-            if len(description_without_username_denoised) <= MAX_CHARACTERS_LENGTH_LINGUA:
-                # DETECT THE LANGUAGE WITH LINGUA
-                src_lang = predict_text_language_lingua(description_without_username_denoised)
-                print(f"Lang lingua for description:", src_lang)
+            src_lang, lang_confidence = predict_text_language_with_confidence(
+                description_without_username_denoised)
+            print(f"Lang for description:", src_lang, lang_confidence)
+
+            if first_pass_is_reusable(description_boxes.get('confidence'), lang_confidence):
+                # THE TEXT DETECTED WITH THE COMMON LANGUAGES IS ALREADY GOOD (AND NORMALIZED), NO NEED FOR ANOTHER PASS
+                accurate_text = description_boxes['text']
             else:
-                # DETECT THE LANGUAGE WITH lid218
-                src_lang = predict_text_language_fasttext_lid218(description_without_username_denoised)
-                print(f"Lang lid218 for description:", src_lang)
-
-            # DETECTS AGAIN THE TEXT WITH SPECIFIED LANGUAGE (BETTER ACCURACY)
-            gray = cv2.cvtColor(description_boxes['image'], cv2.COLOR_BGR2GRAY)
-            # normalize the text before giving it back
-            accurate_text = normalize_text(pytesseract.image_to_string(gray, lang=src_lang))
+                # DETECTS AGAIN THE TEXT WITH SPECIFIED LANGUAGE (BETTER ACCURACY), THE IMAGE IS ALREADY IN GREY SCALE
+                # normalize the text before giving it back
+                accurate_text = normalize_text(ocr_image(description_boxes['image'],
+                                                         label_ocr_profile('description', src_lang)).text)
             if len(accurate_text) > 0:
                 accurate_description = accurate_text
             # print("accurate text: ", accurate_text)
@@ -0,0 +1,412 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+from uuid import uuid4
+
+from fastapi import status
+
+from exceptions.custom_exceptions import CustomHTTPException
+from logging_config import logger
+from service.utils.yolo_utils import results_to_detections, boxes_agreement
+from service.yolo_services.yolo_batching import YoloBatchScheduler
+
+# THE WEIGHTS USED WHEN THE REGISTRY STATE FILE DOESN'T SAY OTHERWISE
+# (THE batch16 POST WEIGHTS ai_models/yolov11/insta_post_model/800px_no_augmentation_batch16_kaggle/weights/best.pt CAN
+# BE EVALUATED AS A CANDIDATE)
+YOLO_PROFILE_WEIGHTS = os.getenv(
+    "YOLO_PROFILE_WEIGHTS",
+    "ai_models/yolov11/insta_profile_model/800px_no_augmentation batch 16 kaggle/weights/best.pt")
+YOLO_POST_WEIGHTS = os.getenv(
+    "YOLO_POST_WEIGHTS",
+    "ai_models/yolov11/insta_post_model/800px_no_augmentation_batch8_kaggle/weights/best.pt")
+# THE WEIGHTS WHICH CAN BE REGISTERED AT RUNTIME MUST BE INSIDE THIS DIRECTORY
+YOLO_MODELS_DIR = os.getenv("YOLO_MODELS_DIR", "ai_models")
+# THE ACTIVE/PREVIOUS/CANDIDATE WEIGHTS OF EACH MODEL, WRITTEN BY THE ADMIN ENDPOINTS AND READ BY EVERY DETECTION
+# WORKER (THE WORKERS RELOAD IT WHEN IT CHANGES, SO NO RESTART IS NEEDED)
+YOLO_REGISTRY_STATE_FILE = os.getenv("YOLO_REGISTRY_STATE_FILE", "ai_models/yolo_registry.json")
+# FRACTION OF THE DETECTIONS ALSO RUN BY THE CANDIDATE MODEL (SHADOW MODE), IF NOT GIVEN WHEN THE CANDIDATE IS SET
+YOLO_SHADOW_SAMPLE_RATE = float(os.getenv("YOLO_SHADOW_SAMPLE_RATE", "0.05"))
+# THE SHADOW RUNS NEVER DELAY THE REQUESTS: IF THIS MANY ARE ALREADY WAITING, THE NEXT SAMPLES ARE SKIPPED
+YOLO_SHADOW_MAX_PENDING = int(os.getenv("YOLO_SHADOW_MAX_PENDING", "4"))
+# A MODEL NO LONGER USED IS RELEASED AFTER THIS DELAY (THE REQUESTS WHICH STARTED WITH IT MAY STILL NEED IT)
+YOLO_REGISTRY_RELEASE_DELAY_SECONDS = float(os.getenv("YOLO_REGISTRY_RELEASE_DELAY_SECONDS", "60"))
+# TWO BOXES OF THE SAME LABEL AGREE IF THEIR IoU IS AT LEAST THIS
+YOLO_SHADOW_AGREEMENT_IOU = 0.5
+
+DEFAULT_WEIGHTS = {
+    'profile': YOLO_PROFILE_WEIGHTS,
+    'post': YOLO_POST_WEIGHTS,
+}
+
+# SERIALIZES THE CHANGES OF THE STATE FILE MADE BY THE ADMIN ENDPOINTS OF THIS PROCESS
+registry_state_lock = threading.Lock()
+
+
+class YoloModel(NamedTuple):
+    """
+    A loaded YOLO model
+    weights_path: the path of its PyTorch weights
+    scheduler: the YoloBatchScheduler all its forward passes go through
+    class_names: dictionary with the class indexes as keys and the label names as values
+    """
+    weights_path: str
+    scheduler: YoloBatchScheduler
+    class_names: dict
+
+
+class YoloModelRegistry:
+    """
+    The models of one kind of screenshots (profile/post): the active model, the previous one (kept loaded for an
+    instant rollback) and an optional candidate which runs in shadow mode over a sample of the traffic (its boxes are
+    compared with the boxes of the active model, they are never returned to the clients).
+    The registry follows YOLO_REGISTRY_STATE_FILE: when the file changes, the new active/candidate weights are loaded
+    and swapped in atomically (the requests already running finish with the model they started with).
+    """
+
+    def __init__(self, name: str, max_batch_size: int, max_wait_ms: float):
+        """
+        :param name: the kind of screenshots of the models (profile/post)
+        :param max_batch_size: the maximum number of images in a forward pass (see YoloBatchScheduler)
+        :param max_wait_ms: how long a scheduler waits for other images (see YoloBatchScheduler)
+        """
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.lock = threading.Lock()
+        # FUNCTIONS CALLED AFTER THE ACTIVE MODEL CHANGED (e.g. CLEAR THE CACHED RESULTS OF THE OLD MODEL)
+        self.on_swap = []
+
+        self.state_mtime = None
+        state = read_registry_state().get(name, {})
+        self.active = self.load(state.get('active') or DEFAULT_WEIGHTS[name])
+        self.previous = None
+        self.candidate = None
+        self.shadow_rate = YOLO_SHADOW_SAMPLE_RATE
+        self.shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"yolo-shadow-{name}")
+        self.shadow_pending = 0
+        self.reset_shadow_stats()
+        self.sync()
+
+    def load(self, weights_path: str) -> YoloModel:
+        """
+        :param weights_path: the path of the PyTorch weights
+        :return: the loaded model with its own batch scheduler
+        """
+        # ultralytics IS IMPORTED ONLY BY THE PROCESSES WHICH RUN THE MODELS (NOT BY THE API PROCESS OF THE ADMIN
+        # ENDPOINTS, WHICH ONLY WRITE THE STATE FILE)
+        from service.yolo_services.yolo_backend import load_yolo_model
+        model = load_yolo_model(weights_path)
+        scheduler = YoloBatchScheduler(model, self.name, self.max_batch_size, self.max_wait_ms)
+        return YoloModel(weights_path=weights_path, scheduler=scheduler, class_names=model.names)
+
+    def reset_shadow_stats(self):
+        """
+        Resets the comparison between the active and the candidate model (called when one of them changes)
+        """
+        self.shadow_runs = 0
+        self.shadow_images = 0
+        self.shadow_skipped = 0
+        self.shadow_failed = 0
+        self.shadow_agreement_total = 0.0
+        self.shadow_min_agreement = None
+        self.shadow_active_ms = 0.0
+        self.shadow_candidate_ms = 0.0
+
+    def sync(self):
+        """
+        Applies the state file if it changed since the last call (only a stat() call when it didn't change)
+        """
+        try:
+            mtime = os.stat(YOLO_REGISTRY_STATE_FILE).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self.state_mtime:
+            return
+        with self.lock:
+            if mtime == self.state_mtime:
+                return
+            self.state_mtime = mtime
+            state = read_registry_state().get(self.name)
+            if state is not None:
+                self.apply(state)
+
+    def apply(self, state: dict):
+        """
+        Loads and swaps in the models of the state (the models already loaded are reused, so a promotion doesn't load
+        the candidate again), the models no longer used are released after YOLO_REGISTRY_RELEASE_DELAY_SECONDS
+        :param state: the state of this kind of models (active, previous, candidate, shadow_rate)
+        """
+        loaded = {model.weights_path: model for model in (self.active, self.previous, self.candidate)
+                  if model is not None}
+
+        def get_model(weights_path):
+            if weights_path in loaded:
+                return loaded[weights_path]
+            try:
+                loaded[weights_path] = self.load(weights_path)
+            except Exception as e:
+                logger.error(f'Could not load the {self.name} model {weights_path}: {e}')
+                return None
+            return loaded[weights_path]
+
+        active_path = state.get('active') or self.active.weights_path
+        if active_path != self.active.weights_path:
+            new_active = get_model(active_path)
+            if new_active is not None and new_active.class_names != self.active.class_names:
+                logger.error(f'The {self.name} model {active_path} has other labels, it cannot be activated')
+                new_active = None
+            if new_active is not None:
+                self.active = new_active
+                self.reset_shadow_stats()
+                logger.info(f'{self.name} active model is now {active_path}')
+                for callback in self.on_swap:
+                    callback()
+        # THE PREVIOUS MODEL IS KEPT ONLY IF IT IS STILL LOADED (A ROLLBACK LOADS IT AGAIN OTHERWISE)
+        self.previous = loaded.get(state.get('previous'))
+
+        candidate_path = state.get('candidate')
+        candidate = get_model(candidate_path) if candidate_path else None
+        if candidate is not None and candidate.class_names != self.active.class_names:
+            logger.error(f'The {self.name} model {candidate_path} has other labels, it cannot be a candidate')
+            candidate = None
+        if candidate is not self.candidate:
+            self.reset_shadow_stats()
+        self.candidate = candidate
+        self.shadow_rate = state.get('shadow_rate', YOLO_SHADOW_SAMPLE_RATE)
+
+        for model in loaded.values():
+            if model is not self.active and model is not self.previous and model is not self.candidate:
+                release_timer = threading.Timer(YOLO_REGISTRY_RELEASE_DELAY_SECONDS, model.scheduler.close)
+                release_timer.daemon = True
+                release_timer.start()
+
+    def shadow(self, inputs, detections, active_ms: float):
+        """
+        Runs the candidate model over the same inputs as the active model, in background and only for a sample of the
+        calls (YOLO_SHADOW_SAMPLE_RATE)
+        :param inputs: list with (reduced image, scale_x, scale_y, original shape) items given to the active model
+        :param detections: list with the Detections of the active model for each input
+        :param active_ms: how long the active model took for the inputs
+        """
+        candidate = self.candidate
+        if candidate is None or len(inputs) == 0 or random.random() >= self.shadow_rate:
+            return
+        with self.lock:
+            if self.shadow_pending >= YOLO_SHADOW_MAX_PENDING:
+                self.shadow_skipped += 1
+                return
+            self.shadow_pending += 1
+        self.shadow_executor.submit(self.run_shadow, candidate, inputs, detections, active_ms)
+
+    def run_shadow(self, candidate: YoloModel, inputs, detections, active_ms: float):
+        """
+        Runs the candidate model and records its latency and the agreement of its boxes with the active model
+        (see shadow)
+        """
+        try:
+            started = time.monotonic()
+            results = candidate.scheduler.predict_many([small for small, _, _, _ in inputs])
+            candidate_ms = (time.monotonic() - started) * 1000
+            agreements = [boxes_agreement(active_detections,
+                                          results_to_detections(image_results, scale_x, scale_y, shape),
+                                          YOLO_SHADOW_AGREEMENT_IOU)
+                          for (_, scale_x, scale_y, shape), active_detections, image_results
+                          in zip(inputs, detections, results)]
+        except Exception as e:
+            logger.error(f'{self.name} shadow detection failed: {e}')
+            with self.lock:
+                self.shadow_failed += 1
+                self.shadow_pending -= 1
+            return
+
+        with self.lock:
+            self.shadow_pending -= 1
+            if candidate is not self.candidate:
+                # THE CANDIDATE CHANGED WHILE IT RAN, ITS RESULTS DON'T BELONG TO THE CURRENT COMPARISON
+                return
+            self.shadow_runs += 1
+            self.shadow_images += len(inputs)
+            self.shadow_agreement_total += sum(agreements)
+            if self.shadow_min_agreement is not None:
+                agreements.append(self.shadow_min_agreement)
+            self.shadow_min_agreement = min(agreements)
+            self.shadow_active_ms += active_ms
+            self.shadow_candidate_ms += candidate_ms
+
+    def stats(self) -> dict:
+        """
+        :return: the weights and the scheduler metrics of the loaded models and the comparison between the active and
+        the candidate model (average latency per image of both, average and minimum agreement of their boxes)
+        """
+        with self.lock:
+            images = self.shadow_images
+            return {
+                'active': {'weights': self.active.weights_path, **self.active.scheduler.stats()},
+                'previous': self.previous.weights_path if self.previous is not None else None,
+                'candidate': {'weights': self.candidate.weights_path, **self.candidate.scheduler.stats()}
+                if self.candidate is not None else None,
+                'shadow': {
+                    'sample_rate': self.shadow_rate,
+                    'runs': self.shadow_runs,
+                    'images': images,
+                    'skipped': self.shadow_skipped,
+                    'failed': self.shadow_failed,
+                    'avg_agreement': self.shadow_agreement_total / images if images else None,
+                    'min_agreement': self.shadow_min_agreement,
+                    'active_avg_image_ms': self.shadow_active_ms / images if images else None,
+                    'candidate_avg_image_ms': self.shadow_candidate_ms / images if images else None,
+                },
+            }
+
+
+def read_registry_state() -> dict:
+    """
+    :return: the content of the state file ({} if it doesn't exist or it is invalid)
+    """
+    try:
+        with open(YOLO_REGISTRY_STATE_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.error(f'Could not read the model registry state {YOLO_REGISTRY_STATE_FILE}: {e}')
+        return {}
+
+
+def write_registry_state(state: dict):
+    """
+    Writes the state file under a temporary name and renames it, so the workers never read a partially written file
+    :param state: the new content of the state file
+    """
+    tmp_path = f'{YOLO_REGISTRY_STATE_FILE}.{uuid4().hex}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, YOLO_REGISTRY_STATE_FILE)
+
+
+def get_registry_state() -> dict:
+    """
+    :return: the state of each kind of models (the defaults for the kinds missing from the state file)
+    """
+    state = read_registry_state()
+    return {kind: {
+        'active': state.get(kind, {}).get('active') or weights_path,
+        'previous': state.get(kind, {}).get('previous'),
+        'candidate': state.get(kind, {}).get('candidate'),
+        'shadow_rate': state.get(kind, {}).get('shadow_rate', YOLO_SHADOW_SAMPLE_RATE),
+    } for kind, weights_path in DEFAULT_WEIGHTS.items()}
+
+
+def update_registry_state(kind: str, update) -> dict:
+    """
+    Changes the state of a kind of models
+    :param kind: profile or post
+    :param update: function(kind_state) which changes the state of the kind in place
+    :return: the new state of all the kinds
+    Throws 404 NOT_FOUND if the kind is unknown
+    """
+    if kind not in DEFAULT_WEIGHTS:
+        logger.error(f'Unknown model kind {kind}')
+        raise CustomHTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            message="Unknown model, it must be profile or post."
+        )
+    with registry_state_lock:
+        state = get_registry_state()
+        update(state[kind])
+        write_registry_state(state)
+    logger.info(f'{kind} model registry state changed: {state[kind]}')
+    return state
+
+
+def set_candidate_model(kind: str, weights_path: str, shadow_rate: float | None = None) -> dict:
+    """
+    Sets the candidate model of a kind, it will run in shadow mode over shadow_rate of the detections
+    :param kind: profile or post
+    :param weights_path: the path of the PyTorch weights of the candidate (inside YOLO_MODELS_DIR)
+    :param shadow_rate: the fraction of the detections also run by the candidate (None = YOLO_SHADOW_SAMPLE_RATE)
+    :return: the new state of all the kinds
+    Throws 404 NOT_FOUND if the kind is unknown or the weights file doesn't exist
+    Throws 422 UNPROCESSABLE_ENTITY if the weights are outside YOLO_MODELS_DIR or the rate is not between 0 and 1
+    """
+    models_dir = os.path.realpath(YOLO_MODELS_DIR)
+    if os.path.commonpath([models_dir, os.path.realpath(weights_path)]) != models_dir:
+        logger.error(f'Weights {weights_path} outside {YOLO_MODELS_DIR}')
+        raise CustomHTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            message=f"The weights must be inside {YOLO_MODELS_DIR}."
+        )
+    if not os.path.isfile(weights_path):
+        logger.error(f'Weights {weights_path} not found')
+        raise CustomHTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            message="Weights file not found."
+        )
+    if shadow_rate is not None and not 0 <= shadow_rate <= 1:
+        logger.error(f'Invalid shadow rate {shadow_rate}')
+        raise CustomHTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            message="The shadow rate must be between 0 and 1."
+        )
+
+    def update(kind_state):
+        kind_state['candidate'] = weights_path
+        kind_state['shadow_rate'] = shadow_rate if shadow_rate is not None else YOLO_SHADOW_SAMPLE_RATE
+    return update_registry_state(kind, update)
+
+
+def remove_candidate_model(kind: str) -> dict:
+    """
+    Stops the shadow mode of a kind of models
+    :param kind: profile or post
+    :return: the new state of all the kinds
+    Throws 404 NOT_FOUND if the kind is unknown
+    """
+    def update(kind_state):
+        kind_state['candidate'] = None
+    return update_registry_state(kind, update)
+
+
+def promote_candidate_model(kind: str) -> dict:
+    """
+    The candidate model becomes the active model, the active model becomes the previous model (for rollback)
+    :param kind: profile or post
+    :return: the new state of all the kinds
+    Throws 404 NOT_FOUND if the kind is unknown
+    Throws 409 CONFLICT if the kind has no candidate model
+    """
+    def update(kind_state):
+        if not kind_state['candidate']:
+            logger.error(f'No {kind} candidate model to promote')
+            raise CustomHTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                message="There is no candidate model to promote."
+            )
+        kind_state['previous'] = kind_state['active']
+        kind_state['active'] = kind_state['candidate']
+        kind_state['candidate'] = None
+    return update_registry_state(kind, update)
+
+
+def rollback_model(kind: str) -> dict:
+    """
+    The previous model becomes the active model again (undoes the last promotion)
+    :param kind: profile or post
+    :return: the new state of all the kinds
+    Throws 404 NOT_FOUND if the kind is unknown
+    Throws 409 CONFLICT if the kind has no previous model
+    """
+    def update(kind_state):
+        if not kind_state['previous']:
+            logger.error(f'No {kind} previous model to roll back to')
+            raise CustomHTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                message="There is no previous model to roll back to."
+            )
+        kind_state['active'] = kind_state['previous']
+        kind_state['previous'] = None
+    return update_registry_state(kind, update)
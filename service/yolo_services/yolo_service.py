@@ -1,24 +1,77 @@
+import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from ultralytics import YOLO
+from fastapi import status
 
+from exceptions.custom_exceptions import CustomHTTPException
 from logging_config import logger
+from service.utils.detection_cache import DetectionCache
+from service.utils.layout_templates import LayoutTemplates
+from service.utils.ocr_utils import get_ocr_metrics
+from service.utils.video_utils import open_video, video_keyframes, split_post_keyframes, remove_video
+from service.yolo_services.yolo_registry import YoloModelRegistry
 from service.yolo_services.yolo_posts import extract_post_data, detect_comments_text_with_specified_language, \
-    parse_posts_date
+    parse_posts_date, dedup_comments
 from service.yolo_services.yolo_profile import extract_profile_data, detect_description_text_with_specified_language
-from service.utils.yolo_utils import base64_to_cv2_img, parse_number, cv2_img_to_base64
+from service.utils.yolo_utils import base64_to_cv2_img, parse_number, cv2_img_to_bytes, bytes_to_cv2_img, \
+    downscale_for_inference, results_to_detections, tile_offsets, merge_tile_detections, estimate_scroll_offset, \
+    content_band, label_mask
 
-yolo_model_profile = YOLO(
-    'ai_models/yolov11/insta_profile_model/800px_no_augmentation batch 16 kaggle/weights/best.pt')
-# yolo_model_post = YOLO("ai_models/yolov11/insta_post_model/800px_no_augmentation_batch16_kaggle/weights/best.pt")
-yolo_model_post = YOLO("ai_models/yolov11/insta_post_model/800px_no_augmentation_batch8_kaggle/weights/best.pt")
+# MAXIMUM NUMBER OF IMAGES ACCEPTED BY A BATCH DETECTION REQUEST
+YOLO_MAX_BATCH_IMAGES = int(os.getenv("YOLO_MAX_BATCH_IMAGES", "40"))
+# MAXIMUM NUMBER OF SCREENSHOTS OF THE SAME POST ACCEPTED BY A SEQUENCE DETECTION REQUEST
+YOLO_MAX_SEQUENCE_IMAGES = int(os.getenv("YOLO_MAX_SEQUENCE_IMAGES", "10"))
+# THE NEW REGION OF A SCREENSHOT OF A SEQUENCE ALSO INCLUDES THIS MUCH (FRACTION OF THE HEIGHT) OF THE ALREADY SEEN
+# REGION, SO THE COMMENT CUT BY THE BOTTOM OF THE PREVIOUS SCREENSHOT IS DETECTED WHOLE
+YOLO_SEQUENCE_MARGIN = float(os.getenv("YOLO_SEQUENCE_MARGIN", "0.05"))
+# THE AUTOMATIC DETECTION CLASSIFIES THE SCREENSHOT (PROFILE OR POST) BY RUNNING BOTH MODELS AT THIS REDUCED SIZE, THE
+# LABELS FOUND ONLY BY ONE OF THE MODELS MUST HAVE AT LEAST THIS TOTAL CONFIDENCE
+YOLO_CLASSIFY_IMGSZ = int(os.getenv("YOLO_CLASSIFY_IMGSZ", "320"))
+YOLO_CLASSIFY_MIN_SCORE = float(os.getenv("YOLO_CLASSIFY_MIN_SCORE", "0.5"))
+# MICRO-BATCHING OF THE YOLO FORWARD PASSES: THE MAXIMUM NUMBER OF IMAGES IN A FORWARD PASS (ALSO BOUNDS THE MEMORY
+# USED BY A BATCH REQUEST) AND HOW LONG TO WAIT FOR THE IMAGES OF OTHER REQUESTS BEFORE RUNNING A FORWARD PASS
+YOLO_BATCH_MAX_SIZE = int(os.getenv("YOLO_BATCH_MAX_SIZE", "8"))
+YOLO_BATCH_MAX_WAIT_MS = float(os.getenv("YOLO_BATCH_MAX_WAIT_MS", "5"))
+# NUMBER OF IMAGES OF A BATCH REQUEST WHOSE TEXT EXTRACTION (OCR + LANGUAGE DETECTION) RUNS AT THE SAME TIME
+YOLO_BATCH_OCR_WORKERS = int(os.getenv("YOLO_BATCH_OCR_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# THE ACTIVE (AND CANDIDATE) WEIGHTS OF EACH MODEL ARE GIVEN BY THE REGISTRY STATE FILE (DEFAULTS: YOLO_PROFILE_WEIGHTS,
+# YOLO_POST_WEIGHTS), THE BACKEND (pytorch/onnx/openvino) IS CHOSEN WITH THE YOLO_BACKEND AND YOLO_INT8 VARIABLES
+# ALL THE FORWARD PASSES OF A MODEL GO THROUGH ITS SCHEDULER, SO CONCURRENT REQUESTS SHARE BATCHED FORWARD PASSES
+yolo_registry_profile = YoloModelRegistry('profile', YOLO_BATCH_MAX_SIZE, YOLO_BATCH_MAX_WAIT_MS)
+yolo_registry_post = YoloModelRegistry('post', YOLO_BATCH_MAX_SIZE, YOLO_BATCH_MAX_WAIT_MS)
 logger.debug('YOLO MODELS LOADED')
 
+# THREAD POOL USED TO EXTRACT THE TEXTS OF THE IMAGES OF A BATCH CONCURRENTLY
+# (pytesseract RUNS TESSERACT AS A SUBPROCESS SO THE THREADS DON'T BLOCK EACH OTHER ON THE GIL)
+batch_ocr_executor = ThreadPoolExecutor(max_workers=YOLO_BATCH_OCR_WORKERS, thread_name_prefix="yolo-batch-ocr")
+
+
+# RESULTS OF THE ALREADY PROCESSED SCREENSHOTS (CLIENTS RE-UPLOAD THE SAME SCREENSHOT e.g. AFTER A FAILED SAVE)
+detection_cache_profile = DetectionCache('profile')
+detection_cache_post = DetectionCache('post')
 
+# LAYOUTS OF THE SCREENSHOTS DETECTED CONFIDENTLY BY YOLO, THE SCREENSHOTS WITH THE SAME LAYOUT SKIP YOLO
+layout_templates_profile = LayoutTemplates('profile')
+layout_templates_post = LayoutTemplates('post')
+
+# THE CACHED RESULTS AND THE LEARNED LAYOUTS COME FROM THE OLD MODEL, THEY ARE FORGOTTEN WHEN THE MODEL IS SWAPPED
+yolo_registry_profile.on_swap += [detection_cache_profile.clear, layout_templates_profile.clear]
+yolo_registry_post.on_swap += [detection_cache_post.clear, layout_templates_post.clear]
 
 # DICTIONARY WITH CLASS INDEXES AS KEYS AND LABEL NAMES AS VALUES
-class_names_labels_profile = yolo_model_profile.names
-class_names_labels_post = yolo_model_post.names
+# (THE REGISTRY SWAPS IN ONLY MODELS WITH THE SAME LABELS, SO THEY DON'T CHANGE)
+class_names_labels_profile = yolo_registry_profile.active.class_names
+class_names_labels_post = yolo_registry_post.active.class_names
+
+# THE LABELS DETECTED ONLY BY ONE OF THE MODELS (e.g. followers FOR PROFILES, comment FOR POSTS) ARE THE SIGNATURE OF
+# THE KIND OF SCREENSHOT
+signature_labels_profile = {name.lower() for name in class_names_labels_profile.values()} - \
+                           {name.lower() for name in class_names_labels_post.values()}
+signature_labels_post = {name.lower() for name in class_names_labels_post.values()} - \
+                        {name.lower() for name in class_names_labels_profile.values()}
 
 
 def detect_from_profile_capture(image_base64):
@@ -26,7 +79,8 @@ def detect_from_profile_capture(image_base64):
     Detects the description, no_followers, no_following, no_posts, username and the profile photo from a screen_shot
     of an instagram profile encoded in base64
     :param image_base64: the screen_shot encoded
-    :return: the profile photo base64 encoded, the texts of:description and username, and the numbers of followers, following and posts
+    :return: the profile photo encoded as jpeg (bytes), the texts of:description and username, and the numbers of
+    followers, following and posts
     Throws 400 BAD_REQUEST if the image is not a valid base64 format
 
     If data wasn't detected in the image then the following invalid input will be assigned to each label:
@@ -38,12 +92,444 @@ def detect_from_profile_capture(image_base64):
     posts = -1
     """
     logger.info('detect from profile capture')
-    image_cv = base64_to_cv2_img(image_base64)
+    return detect_from_profile_image(base64_to_cv2_img(image_base64))
+
+
+def detect_from_profile_bytes(image_bytes):
+    """
+    Same as detect_from_profile_capture, but the screen_shot is given as the bytes of the encoded image (png/jpeg)
+    :param image_bytes: the encoded screen_shot
+    :return: the same data as detect_from_profile_capture
+    Throws 400 BAD_REQUEST if the bytes don't represent a valid image
+    """
+    logger.info('detect from profile capture bytes')
+    return detect_from_profile_image(bytes_to_cv2_img(image_bytes))
+
+
+def detect_from_profile_image(image_cv):
+    """
+    Same as detect_from_profile_capture, but the screen_shot is already decoded
+    :param image_cv: the decoded screen_shot (cv2)
+    :return: the same data as detect_from_profile_capture
+    """
+    # A SCREENSHOT ALREADY PROCESSED RETURNS THE CACHED RESULT
+    cache_key, thumbnail = detection_cache_profile.fingerprint(image_cv)
+    cached_result = detection_cache_profile.get(cache_key, thumbnail)
+    if cached_result is not None:
+        return cached_result
 
     # DETECT FROM IMAGE USING YOLOv11 MODEL
-    results = yolo_model_profile(image_cv)
+    detections = detect_boxes(yolo_registry_profile, [image_cv], layout_templates_profile)[0]
+
+    profile_data = profile_data_from_detections(image_cv, detections)
+    detection_cache_profile.put(cache_key, thumbnail, profile_data)
+    return profile_data
+
+
+def detect_from_post_capture(image_base64):
+    """
+    Detects description, no_likes, date, comments and the post photo from a screen_shot of an instagram post
+    encoded in base64
+    :param image_base64: the screen_shot encoded
+    :return: the post photo encoded as jpeg (bytes), the texts of:description and comments, the no of likes,
+    the no of comments (cannot detect from image, so will always be -1 = private) and the date
+    Throws 400 BAD_REQUEST if the image is not a valid base64 format
+
+    If data wasn't detected in the image then the following invalid input will be assigned to each label:
+    post_photo: None
+    description = ''
+    comments: []
+    date = None
+    no_likes = -1
+    no_comments = -1
+    """
+    logger.info('detect from post capture')
+    return detect_from_post_image(base64_to_cv2_img(image_base64))
+
+
+def detect_from_post_capture_progressive(image_base64, progress_queue):
+    """
+    Same as detect_from_post_capture, but the partial results are put in the queue as soon as they are ready, as
+    (stage, data) tuples (see post_data_from_detections), while the slow stages (comments OCR) still run
+    :param image_base64: the screen_shot encoded
+    :param progress_queue: queue with a put() method (queue.Queue, or a multiprocessing Manager queue when the
+    function runs on a detection worker process)
+    :return: the same data as detect_from_post_capture
+    Throws 400 BAD_REQUEST if the image is not a valid base64 format
+    """
+    logger.info('detect from post capture (progressive)')
+    return detect_from_post_image(base64_to_cv2_img(image_base64),
+                                  lambda stage, data: progress_queue.put((stage, data)))
+
+
+def detect_from_post_bytes(image_bytes):
+    """
+    Same as detect_from_post_capture, but the screen_shot is given as the bytes of the encoded image (png/jpeg)
+    :param image_bytes: the encoded screen_shot
+    :return: the same data as detect_from_post_capture
+    Throws 400 BAD_REQUEST if the bytes don't represent a valid image
+    """
+    logger.info('detect from post capture bytes')
+    return detect_from_post_image(bytes_to_cv2_img(image_bytes))
+
+
+def detect_from_post_image(image_cv, on_progress=None):
+    """
+    Same as detect_from_post_capture, but the screen_shot is already decoded
+    :param image_cv: the decoded screen_shot (cv2)
+    :param on_progress: optional function(stage, data) which receives the partial results (see
+    post_data_from_detections), it is not called if the result was cached
+    :return: the same data as detect_from_post_capture
+    """
+    # A SCREENSHOT ALREADY PROCESSED RETURNS THE CACHED RESULT
+    cache_key, thumbnail = detection_cache_post.fingerprint(image_cv)
+    cached_result = detection_cache_post.get(cache_key, thumbnail)
+    if cached_result is not None:
+        return cached_result
+
+    # DETECT FROM IMAGE USING YOLOv11 MODEL
+    detections = detect_boxes(yolo_registry_post, [image_cv], layout_templates_post, class_names_labels_post)[0]
+
+    post_data = post_data_from_detections(image_cv, detections, on_progress)
+    detection_cache_post.put(cache_key, thumbnail, post_data)
+    return post_data
+
+
+def detect_from_post_sequence(images_base64):
+    """
+    Detects the data of ONE post from an ordered sequence of screenshots (e.g. the post and its comments, scrolled down
+    between the screenshots).
+    The first screenshot is processed whole, for the next ones the scroll from the previous screenshot is estimated
+    and only their new region is processed (if they don't overlap the previous one, they are processed whole).
+    The data is merged: the first detected photo, description, likes and date, and the comments of all the
+    screenshots, without the comments seen in multiple screenshots
+    :param images_base64: list with the screen_shots encoded in base64, in the scroll order
+    :return: the same data as detect_from_post_capture
+    Throws 400 BAD_REQUEST if an image is not a valid base64 format
+    Throws 422 UNPROCESSABLE_ENTITY if the list is empty or has more than YOLO_MAX_SEQUENCE_IMAGES images
+    """
+    logger.info(f'detect from a sequence of {len(images_base64)} post captures')
+    if len(images_base64) == 0 or len(images_base64) > YOLO_MAX_SEQUENCE_IMAGES:
+        logger.error(f"Sequence detection requires between 1 and {YOLO_MAX_SEQUENCE_IMAGES} images")
+        raise CustomHTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            message=f"Sequence detection requires between 1 and {YOLO_MAX_SEQUENCE_IMAGES} images."
+        )
+    return detect_from_post_images([base64_to_cv2_img(image_base64) for image_base64 in images_base64])
+
+
+def detect_from_post_images(images, scrolls=None):
+    """
+    Same as detect_from_post_sequence, but the screen_shots are already decoded
+    :param images: list with the decoded screen_shots (cv2), in the scroll order
+    :param scrolls: optional list with the scroll between each screenshot and the next one (see
+    estimate_scroll_offset, None = they don't overlap), if they were already estimated (e.g. see split_post_keyframes)
+    :return: the same data as detect_from_post_capture
+    """
+    if scrolls is None:
+        scrolls = [estimate_scroll_offset(previous, current) for previous, current in zip(images, images[1:])]
+
+    # THE REGION OF EACH SCREENSHOT WHICH WASN'T SEEN IN THE PREVIOUS SCREENSHOT
+    regions = [images[0]]
+    for current, scroll in zip(images[1:], scrolls):
+        if scroll is None:
+            logger.info('screenshot does not overlap the previous one, processed whole')
+            regions.append(current)
+        elif scroll > 0:
+            height = current.shape[0]
+            _, content_bottom = content_band(height)
+            region_top = max(0, content_bottom - scroll - int(height * YOLO_SEQUENCE_MARGIN))
+            regions.append(current[region_top:])
+        # NO SCROLL: THE SAME SCREEN AS THE PREVIOUS ONE, NOTHING NEW
+
+    # ALL THE REGIONS GO THROUGH THE MODEL TOGETHER, THEN THE DATA OF EACH REGION IS EXTRACTED CONCURRENTLY
+    regions_detections = detect_boxes(yolo_registry_post, regions, None, class_names_labels_post)
+    futures = [batch_ocr_executor.submit(post_data_from_detections, region, detections)
+               for region, detections in zip(regions, regions_detections)]
+    regions_data = [future.result() for future in futures]
+
+    post_photo, description, no_likes, no_comments, date = None, '', -1, -1, None
+    for region_photo, region_description, region_likes, _, region_date, _ in regions_data:
+        if post_photo is None:
+            post_photo = region_photo
+        if not description:
+            description = region_description
+        if no_likes == -1:
+            no_likes = region_likes
+        if date is None:
+            date = region_date
+    comments = dedup_comments([region_comments for *_, region_comments in regions_data])
+    return post_photo, description, no_likes, no_comments, date, comments
+
+
+def detect_from_post_video(video_path, progress_queue):
+    """
+    Detects the posts of a screen recording of a scroll-through. The keyframes are sampled (see video_keyframes) and
+    split into posts (see split_post_keyframes) while the recording is read, each post is detected as soon as its
+    keyframes are complete (see detect_from_post_keyframes) and put in the queue, so the first post is ready before
+    the whole recording is read:
+    ('started', {}) once the recording is validated, then for each post ('post', the same data as
+    detect_from_post_capture) or ('error', {'message': ..., 'status_code': ...}) if its detection failed
+    The recording is removed at the end
+    :param video_path: the path of the screen recording
+    :param progress_queue: queue with a put() method (see yolo_worker_pool.run_detection_with_progress)
+    :return: the number of detected posts
+    Throws 400 BAD_REQUEST if the file is not a valid video
+    Throws 422 UNPROCESSABLE_ENTITY if the recording is longer than YOLO_VIDEO_MAX_SECONDS
+    """
+    logger.info('detect the posts of a video')
+    try:
+        capture = open_video(video_path)
+        progress_queue.put(('started', {}))
+        no_posts = 0
+        for keyframes, scrolls in split_post_keyframes(video_keyframes(capture)):
+            try:
+                post_data = detect_from_post_keyframes(keyframes, scrolls)
+            except CustomHTTPException as e:
+                progress_queue.put(('error', {'message': e.message, 'status_code': e.status_code}))
+                continue
+            if post_data is not None:
+                progress_queue.put(('post', post_data))
+                no_posts += 1
+        return no_posts
+    finally:
+        remove_video(video_path)
+
+
+def detect_from_post_keyframes(keyframes, scrolls):
+    """
+    Detects the data of ONE post from its keyframes (see split_post_keyframes), like detect_from_post_sequence
+    :param keyframes: list with the keyframes of the post (cv2), in the order of the recording
+    :param scrolls: the scrolls between the consecutive keyframes, already estimated by split_post_keyframes
+    :return: the same data as detect_from_post_capture, or None if nothing was detected (e.g. the keyframes were taken
+    during the transition between two posts)
+    """
+    logger.info(f'detect from {len(keyframes)} post video keyframes')
+    post_data = detect_from_post_images(keyframes, scrolls)
+    post_photo, description, no_likes, _, date, comments = post_data
+    if post_photo is None and not description and no_likes == -1 and date is None and len(comments) == 0:
+        return None
+    return post_data
+
+
+def detect_from_auto_capture(image_base64):
+    """
+    Detects the data of a screen_shot which can be an instagram profile or an instagram post: the kind of screenshot
+    is classified first (see classify_capture), then the screenshot is detected only with the model of its kind
+    :param image_base64: the screen_shot encoded
+    :return: 'profile' and the same data as detect_from_profile_capture, or 'post' and the same data as
+    detect_from_post_capture
+    Throws 400 BAD_REQUEST if the image is not a valid base64 format
+    Throws 422 UNPROCESSABLE_ENTITY if the screenshot is neither a profile nor a post
+    """
+    logger.info('detect from capture of unknown kind')
+    image_cv = base64_to_cv2_img(image_base64)
+
+    # A SCREENSHOT ALREADY PROCESSED DOESN'T NEED TO BE CLASSIFIED
+    for kind, detection_cache in (('profile', detection_cache_profile), ('post', detection_cache_post)):
+        cached_result = detection_cache.get(*detection_cache.fingerprint(image_cv))
+        if cached_result is not None:
+            return kind, cached_result
+
+    kind = classify_capture(image_cv)
+    if kind == 'profile':
+        return kind, detect_from_profile_image(image_cv)
+    return kind, detect_from_post_image(image_cv)
+
+
+def classify_capture(image_cv):
+    """
+    Classifies a screenshot as profile or post: both models run over a reduced copy of the screenshot (at
+    YOLO_CLASSIFY_IMGSZ, much cheaper than a detection) and the confidences of the signature labels of each model
+    (the labels the other model doesn't have) are summed, the kind with the greatest sum wins
+    :param image_cv: the decoded screenshot (cv2)
+    :return: 'profile' or 'post'
+    Throws 422 UNPROCESSABLE_ENTITY if no model found its signature labels confidently enough
+    """
+    small, _, _ = downscale_for_inference(image_cv, YOLO_CLASSIFY_IMGSZ)
+    # BOTH FORWARD PASSES ARE QUEUED BEFORE WAITING, SO THEY RUN AT THE SAME TIME (EACH MODEL HAS ITS OWN SCHEDULER)
+    yolo_registry_profile.sync()
+    yolo_registry_post.sync()
+    profile_future = yolo_registry_profile.active.scheduler.submit(small, YOLO_CLASSIFY_IMGSZ)
+    post_future = yolo_registry_post.active.scheduler.submit(small, YOLO_CLASSIFY_IMGSZ)
+    profile_detections = results_to_detections(profile_future.result(), 1.0, 1.0, small.shape)
+    post_detections = results_to_detections(post_future.result(), 1.0, 1.0, small.shape)
 
-    profile_photo, text_boxes = extract_profile_data(image_cv, results[0], class_names_labels_profile)
+    profile_score = float(profile_detections.conf[
+        label_mask(profile_detections, class_names_labels_profile, signature_labels_profile)].sum())
+    post_score = float(post_detections.conf[
+        label_mask(post_detections, class_names_labels_post, signature_labels_post)].sum())
+    logger.info(f'screenshot classification scores: profile {profile_score:.2f}, post {post_score:.2f}')
+
+    if max(profile_score, post_score) < YOLO_CLASSIFY_MIN_SCORE:
+        logger.error('Screenshot is neither a profile nor a post')
+        raise CustomHTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            message="The image is neither an instagram profile nor an instagram post."
+        )
+    return 'profile' if profile_score >= post_score else 'post'
+
+
+def detect_from_profile_captures(images_base64):
+    """
+    Batched version of detect_from_profile_capture: all the valid screenshots are given to the YOLO model in
+    batched forward passes (at most YOLO_BATCH_MAX_SIZE images per pass) and the text extraction of each image is run
+    concurrently on the batch_ocr_executor
+    :param images_base64: list with the screen_shots encoded in base64
+    :return: a list with one element for each image, in the same order: the same tuple returned by
+    detect_from_profile_capture, or the CustomHTTPException raised for that image (e.g. invalid base64 format)
+    Throws 422 UNPROCESSABLE_ENTITY if the list is empty or has more than YOLO_MAX_BATCH_IMAGES images
+    """
+    logger.info(f'detect from {len(images_base64)} profile captures')
+    return detect_batch(images_base64, yolo_registry_profile, profile_data_from_detections, detection_cache_profile,
+                        layout_templates_profile)
+
+
+def detect_from_post_captures(images_base64):
+    """
+    Batched version of detect_from_post_capture: all the valid screenshots are given to the YOLO model in
+    batched forward passes (at most YOLO_BATCH_MAX_SIZE images per pass) and the text extraction of each image is run
+    concurrently on the batch_ocr_executor
+    :param images_base64: list with the screen_shots encoded in base64
+    :return: a list with one element for each image, in the same order: the same tuple returned by
+    detect_from_post_capture, or the CustomHTTPException raised for that image (e.g. invalid base64 format)
+    Throws 422 UNPROCESSABLE_ENTITY if the list is empty or has more than YOLO_MAX_BATCH_IMAGES images
+    """
+    logger.info(f'detect from {len(images_base64)} post captures')
+    return detect_batch(images_base64, yolo_registry_post, post_data_from_detections, detection_cache_post,
+                        layout_templates_post, class_names_labels_post)
+
+
+def detect_batch(images_base64, yolo_registry, data_from_detections, detection_cache, layout_templates=None,
+                 class_names=None):
+    """
+    Decodes the given images, runs the yolo model over the valid ones in batches and extracts the data from each
+    image with the given function
+    :param images_base64: list with the images encoded in base64
+    :param yolo_registry: the YoloModelRegistry of the model used for detection
+    :param data_from_detections: function(image, detections) which extracts the data from an image and its boxes
+    :param detection_cache: the DetectionCache of the model, the images found in it are not processed again
+    :param layout_templates: the LayoutTemplates of the model, the images with a known layout skip YOLO
+    :param class_names: the names of the labels of the model, enables the tiled detection of tall images
+    :return: list with the extracted data or the CustomHTTPException raised, for each image (same order)
+    Throws 422 UNPROCESSABLE_ENTITY if the list is empty or has more than YOLO_MAX_BATCH_IMAGES images
+    """
+    if len(images_base64) == 0 or len(images_base64) > YOLO_MAX_BATCH_IMAGES:
+        logger.error(f"Batch detection requires between 1 and {YOLO_MAX_BATCH_IMAGES} images")
+        raise CustomHTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            message=f"Batch detection requires between 1 and {YOLO_MAX_BATCH_IMAGES} images."
+        )
+
+    outputs = [None] * len(images_base64)
+
+    # DECODE ALL THE IMAGES, AN INVALID IMAGE DOESN'T FAIL THE WHOLE BATCH
+    # AND THE IMAGES ALREADY PROCESSED GET THEIR CACHED RESULTS
+    valid_indexes = []
+    valid_images = []
+    valid_fingerprints = []
+    for i, image_base64 in enumerate(images_base64):
+        try:
+            image_cv = base64_to_cv2_img(image_base64)
+        except CustomHTTPException as e:
+            outputs[i] = e
+            continue
+        cache_key, thumbnail = detection_cache.fingerprint(image_cv)
+        cached_result = detection_cache.get(cache_key, thumbnail)
+        if cached_result is not None:
+            outputs[i] = cached_result
+            continue
+        valid_images.append(image_cv)
+        valid_indexes.append(i)
+        valid_fingerprints.append((cache_key, thumbnail))
+
+    # DETECT FROM THE IMAGES USING THE YOLOv11 MODEL, THE SCHEDULER SPLITS THEM INTO BATCHED FORWARD PASSES
+    images_detections = detect_boxes(yolo_registry, valid_images, layout_templates, class_names)
+
+    # EXTRACT THE DATA OF EACH IMAGE CONCURRENTLY
+    futures = [batch_ocr_executor.submit(data_from_detections, image_cv, detections)
+               for image_cv, detections in zip(valid_images, images_detections)]
+    for i, (cache_key, thumbnail), future in zip(valid_indexes, valid_fingerprints, futures):
+        try:
+            outputs[i] = future.result()
+            detection_cache.put(cache_key, thumbnail, outputs[i])
+        except CustomHTTPException as e:
+            outputs[i] = e
+
+    return outputs
+
+
+def detect_boxes(yolo_registry, images, layout_templates=None, class_names=None):
+    """
+    Runs the YOLO model over reduced copies of the images (the longest side is reduced to the size the model was
+    trained with) and maps the boxes back to the coordinates of the original images, so the regions of interest are
+    still cropped at full resolution for OCR
+    The images which match a learned layout reuse its boxes and skip the model, the confident detections of the
+    other images are learned
+    If class_names is given, the tall images (scrolling captures) are split into overlapping tiles (see tile_offsets),
+    all the tiles of all the images go through the model together and the boxes of the tiles are merged
+    A sample of the calls also runs the candidate model of the registry in background (shadow mode)
+    :param yolo_registry: the YoloModelRegistry of the model
+    :param images: list with the decoded images (cv2)
+    :param layout_templates: the LayoutTemplates of the model (None = always use the model)
+    :param class_names: the names of the labels of the model, enables the tiled detection (None = no tiles)
+    :return: list with the Detections of each image (same order)
+    """
+    images_detections = [layout_templates.match(image_cv) if layout_templates is not None else None
+                         for image_cv in images]
+    missing = [i for i, detections in enumerate(images_detections) if detections is None]
+    if len(missing) == 0:
+        return images_detections
+
+    # THE TILES ARE VIEWS OF THE DECODED IMAGE (NO COPY), ONLY THEIR REDUCED COPIES ARE NEW IMAGES
+    images_tiles = {}
+    tiles = []
+    for i in missing:
+        height, width = images[i].shape[:2]
+        tile_height, offsets = tile_offsets(height, width) if class_names is not None else (height, [0])
+        images_tiles[i] = (tile_height, offsets)
+        tiles += [images[i][offset:offset + tile_height] for offset in offsets]
+
+    # THE SAME MODEL IS USED FOR ALL THE TILES, EVEN IF THE REGISTRY SWAPS IT MEANWHILE
+    yolo_registry.sync()
+    yolo_scheduler = yolo_registry.active.scheduler
+    reduced_tiles = [downscale_for_inference(tile) for tile in tiles]
+    started = time.monotonic()
+    results = iter(yolo_scheduler.predict_many([small for small, _, _ in reduced_tiles]))
+    active_ms = (time.monotonic() - started) * 1000
+    shadow_inputs = []
+    shadow_detections = []
+    tiles_iterator = iter(zip(tiles, reduced_tiles))
+    for i in missing:
+        tile_height, offsets = images_tiles[i]
+        tiles_detections = []
+        for _ in offsets:
+            tile, (small, scale_x, scale_y) = next(tiles_iterator)
+            tiles_detections.append(results_to_detections(next(results), scale_x, scale_y, tile.shape))
+            shadow_inputs.append((small, scale_x, scale_y, tile.shape))
+            shadow_detections.append(tiles_detections[-1])
+        if len(offsets) == 1:
+            images_detections[i] = tiles_detections[0]
+        else:
+            logger.info(f'tall image detected in {len(offsets)} tiles')
+            images_detections[i] = merge_tile_detections(tiles_detections, offsets, tile_height, images[i].shape,
+                                                         class_names)
+        if layout_templates is not None:
+            layout_templates.learn(images[i], images_detections[i])
+
+    yolo_registry.shadow(shadow_inputs, shadow_detections, active_ms)
+    return images_detections
+
+
+def profile_data_from_detections(image_cv, detections):
+    """
+    Extracts the profile data from a screenshot of an instagram profile and the boxes detected in that screenshot
+    :param image_cv: the decoded screenshot
+    :param detections: the Detections of the screenshot
+    :return: the profile photo encoded as jpeg (bytes), the texts of:description and username, and the numbers of
+    followers, following and posts (see detect_from_profile_capture)
+    """
+    profile_photo, text_boxes = extract_profile_data(image_cv, detections, class_names_labels_profile)
 
     # WE NEED THE TEXT FROM DESCRIPTION LABEL TO BE EXTRACTED WITH TESSERACT IN ITS LANGUAGE
     language_detected_texts = detect_description_text_with_specified_language(
@@ -71,41 +557,39 @@ def detect_from_profile_capture(image_base64):
     description = language_detected_texts
 
     if profile_photo is not None:
-        return cv2_img_to_base64(profile_photo), username, description, followers, following, posts
+        return cv2_img_to_bytes(profile_photo), username, description, followers, following, posts
     return profile_photo, username, description, followers, following, posts
 
 
-def detect_from_post_capture(image_base64):
+def post_data_from_detections(image_cv, detections, on_progress=None):
     """
-    Detects description, no_likes, date, comments and the post photo from a screen_shot of an instagram post
-    encoded in base64
-    :param image_base64: the screen_shot encoded
-    :return: the post photo base64 encoded, the texts of:description and comments, the no of likes,
-    the no of comments (cannot detect from image, so will always be -1 = private) and the date
-    Throws 400 BAD_REQUEST if the image is not a valid base64 format
-
-    If data wasn't detected in the image then the following invalid input will be assigned to each label:
-    post_photo: None
-    description = ''
-    comments: []
-    date = None
-    no_likes = -1
-    no_comments = -1
+    Extracts the post data from a screenshot of an instagram post and the boxes detected in that screenshot
+    :param image_cv: the decoded screenshot
+    :param detections: the Detections of the screenshot
+    :param on_progress: optional function(stage, data) called with the partial results, in this order:
+    'fields' with the post_photo (jpeg bytes), no_likes and date (ISO 8601) as soon as they are extracted (before the
+    comments OCR), then 'description' with the description (after its language pass)
+    :return: the post photo encoded as jpeg (bytes), the texts of:description and comments, the no of likes,
+    the no of comments and the date (see detect_from_post_capture)
     """
-    logger.info('detect from post capture')
-
-    image_cv = base64_to_cv2_img(image_base64)
+    fields = {}
 
-    # DETECT FROM IMAGE USING YOLOv11 MODEL
-    results = yolo_model_post(image_cv)
+    def on_fields(post_photo, text_boxes):
+        fields['post_photo'] = cv2_img_to_bytes(post_photo) if post_photo is not None else None
+        fields['no_likes'], fields['date'] = post_fields_from_texts(text_boxes)
+        if on_progress is not None:
+            on_progress('fields', {
+                'post_photo': fields['post_photo'],
+                'no_likes': fields['no_likes'],
+                'date': fields['date'].isoformat() if fields['date'] else None,
+            })
 
-    post_photo, text_boxes, comments_boxes = extract_post_data(image_cv, results[0], class_names_labels_post)
+    _, text_boxes, comments_boxes = extract_post_data(image_cv, detections, class_names_labels_post, on_fields)
 
     # WE NEED THE TEXT FROM DESCRIPTION AND COMMENTS TO BE EXTRACTED WITH TESSERACT IN THEIR LANGUAGES
     description_accurate_detected_texts = detect_description_text_with_specified_language(
         text_boxes.get('description')
     )
-    comments_accurate_detected_texts = detect_comments_text_with_specified_language(comments_boxes)
 
     # THE DESCRIPTION AND COMMENTS TEXT DETECTED WITH LANGUAGE SPECIFIED ARE NOW NORMALIZED BUT THE USERNAME
     # OF THE DESCRIPTION/COMMENT AT THE BEGINNING OF THE TEXTS ARE NOT REMOVED, WE NEED TO REMOVE THEM AND
@@ -113,12 +597,25 @@ def detect_from_post_capture(image_base64):
 
     # remove username from description
     description_accurate_detected_texts = re.sub(r'^\s*\S+\s*', '', description_accurate_detected_texts, count=1)
+    if on_progress is not None:
+        on_progress('description', {'description': description_accurate_detected_texts})
+
+    comments_accurate_detected_texts = detect_comments_text_with_specified_language(comments_boxes)
     # remove username from comments
     for i in range(0, len(comments_accurate_detected_texts)):
         comments_accurate_detected_texts[i] = re.sub(r'^\s*\S+\s*', '', comments_accurate_detected_texts[i], count=1)
 
-    no_likes = -1  # if no likes detected consider them private
     no_comments = -1  # cannot detect no of comments from posts screen_shots so suppose they are private
+    return (fields['post_photo'], description_accurate_detected_texts, fields['no_likes'],
+            no_comments, fields['date'], comments_accurate_detected_texts)
+
+
+def post_fields_from_texts(text_boxes):
+    """
+    :param text_boxes: the texts of the post labels (see extract_post_data)
+    :return: the no of likes (-1 if not detected) and the date (None if not detected) of the post
+    """
+    no_likes = -1  # if no likes detected consider them private
     date = None
 
     # Convert likes into numbers or if are not detected, consider them private
@@ -136,9 +633,36 @@ def detect_from_post_capture(image_base64):
             print('date parsed:', parsed_date)
             date = parsed_date
     # print("date:", date)
+    return no_likes, date
+
 
-    if post_photo is not None:
-        return (cv2_img_to_base64(post_photo),
-                description_accurate_detected_texts, no_likes, no_comments, date, comments_accurate_detected_texts)
-    return (post_photo, description_accurate_detected_texts, no_likes,
-            no_comments, date, comments_accurate_detected_texts)
+def get_detection_metrics():
+    """
+    :return: dictionary with the metrics of the detection pipeline (the queue/batch metrics of each YOLO model, the
+    loaded models and their shadow comparison, the metrics of the detection caches, of the layout templates and of
+    the OCR)
+    """
+    return {
+        'yolo_profile': yolo_registry_profile.active.scheduler.stats(),
+        'yolo_post': yolo_registry_post.active.scheduler.stats(),
+        'models_profile': yolo_registry_profile.stats(),
+        'models_post': yolo_registry_post.stats(),
+        'detection_cache_profile': detection_cache_profile.stats(),
+        'detection_cache_post': detection_cache_post.stats(),
+        'layout_templates_profile': layout_templates_profile.stats(),
+        'layout_templates_post': layout_templates_post.stats(),
+        'ocr': get_ocr_metrics(),
+    }
+
+
+def get_model_registry_metrics():
+    """
+    :return: dictionary with the loaded models of each kind and the comparison between their active and candidate
+    models (see YoloModelRegistry.stats)
+    """
+    yolo_registry_profile.sync()
+    yolo_registry_post.sync()
+    return {
+        'profile': yolo_registry_profile.stats(),
+        'post': yolo_registry_post.stats(),
+    }
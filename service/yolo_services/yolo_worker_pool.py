@@ -0,0 +1,370 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi import status
+from starlette.concurrency import run_in_threadpool
+
+from exceptions.custom_exceptions import CustomHTTPException
+from logging_config import logger
+
+# NUMBER OF WORKER PROCESSES RUNNING THE DETECTION PIPELINE (YOLO + TESSERACT + LANGUAGE DETECTION)
+# EACH WORKER LOADS ITS OWN COPY OF THE YOLO MODELS AND OF THE LANGUAGE DETECTORS (lid218 ALONE IS ~1GB OF RAM)
+# BY DEFAULT ONE WORKER FOR EVERY 4 CORES (AT MOST 4 WORKERS), EACH WORKER GETS THE OTHER CORES FOR ITS OCR THREADS
+# 0 = NO WORKER PROCESSES, THE PIPELINE RUNS ON THE THREADPOOL OF THE API PROCESS (STILL WITH BOUNDED QUEUEING)
+YOLO_INFERENCE_WORKERS = int(os.getenv("YOLO_INFERENCE_WORKERS", str(min(4, max(1, (os.cpu_count() or 1) // 4)))))
+# MAXIMUM NUMBER OF DETECTIONS RUNNING OR WAITING FOR A WORKER, THE NEXT ONES ARE REJECTED WITH 503
+YOLO_INFERENCE_MAX_QUEUED = int(os.getenv("YOLO_INFERENCE_MAX_QUEUED", str(4 * max(1, YOLO_INFERENCE_WORKERS))))
+# HOW OFTEN THE PARTIAL RESULTS OF A PROGRESSIVE DETECTION ARE COLLECTED
+YOLO_PROGRESS_POLL_SECONDS = float(os.getenv("YOLO_PROGRESS_POLL_SECONDS", "0.05"))
+# HOW OFTEN EACH WORKER PUBLISHES ITS METRICS (THE METRICS ENDPOINTS READ THEM WITHOUT SENDING A TASK TO THE WORKERS)
+YOLO_WORKER_METRICS_SECONDS = float(os.getenv("YOLO_WORKER_METRICS_SECONDS", "5"))
+
+detection_pool: ProcessPoolExecutor | None = None
+# THE WORKER PROCESSES SEND THEIR PARTIAL RESULTS AND THEIR METRICS BACK THROUGH THIS MANAGER (STARTED WITH THE APP)
+detection_manager = None
+detection_manager_lock = threading.Lock()
+# THE LAST METRICS PUBLISHED BY EACH WORKER (A DICTIONARY OF THE MANAGER, pid -> metrics)
+worker_metrics = None
+# NUMBER OF DETECTIONS SUBMITTED TO THE POOL AND NOT FINISHED YET (ONLY USED FROM THE EVENT LOOP THREAD)
+pending_detections = 0
+
+
+def publish_worker_metrics(metrics_store):
+    """
+    Runs on a daemon thread of each worker process, publishes the metrics of the worker every
+    YOLO_WORKER_METRICS_SECONDS (the models and the OCR are thread-safe, the detections are not interrupted)
+    :param metrics_store: the dictionary of the manager the metrics are published in
+    """
+    from service.yolo_services import yolo_service
+    while True:
+        try:
+            metrics_store[str(os.getpid())] = {
+                'pipeline': yolo_service.get_detection_metrics(),
+                'models': yolo_service.get_model_registry_metrics(),
+                'updated_at': time.time(),
+            }
+        except Exception as e:
+            logger.error(f'Could not publish the metrics of the detection worker {os.getpid()}: {e}')
+        time.sleep(YOLO_WORKER_METRICS_SECONDS)
+
+
+def init_detection_worker(ocr_workers: int, metrics_store):
+    """
+    Initializer of each worker process, loads the whole detection pipeline (YOLO models, language detectors) once
+    :param ocr_workers: the number of threads the worker may use for the text extraction (tesseract calls)
+    :param metrics_store: the dictionary of the manager the worker publishes its metrics in
+    """
+    # THE CORES ARE SHARED BETWEEN THE WORKERS, SO EACH WORKER GETS ITS SHARE OF OCR THREADS
+    os.environ.setdefault("YOLO_BATCH_OCR_WORKERS", str(ocr_workers))
+    os.environ.setdefault("OCR_MAX_WORKERS", str(ocr_workers))
+    # A WORKER RUNS ONE DETECTION AT A TIME, WAITING FOR OTHER IMAGES TO BATCH WITH WOULD ONLY ADD LATENCY
+    os.environ.setdefault("YOLO_BATCH_MAX_WAIT_MS", "0")
+
+    import service.yolo_services.yolo_service  # noqa: F401
+    threading.Thread(target=publish_worker_metrics, args=(metrics_store,), daemon=True).start()
+    logger.debug(f'DETECTION WORKER {os.getpid()} READY')
+
+
+def warm_up_detection_worker():
+    """
+    Task without work, submitted when the app starts so that each worker process is started (and loads the models)
+    before the first detection
+    """
+    return os.getpid()
+
+
+def run_detection_task(function_name: str, *args):
+    """
+    Runs a function of the yolo_service module (the function is given by name so that the API process doesn't need
+    to import the module and load the models)
+    :param function_name: the name of the function from yolo_service
+    :param args: the arguments of the function
+    :return: the result of the function
+    """
+    from service.yolo_services import yolo_service
+    return getattr(yolo_service, function_name)(*args)
+
+
+def start_detection_manager():
+    """
+    Starts the manager process holding the progress queues and the metrics of the workers (spawning it takes a while,
+    so it is started by the lifespan of the app, or from the threadpool if it isn't running, never on the event loop)
+    :return: the manager
+    """
+    global detection_manager, worker_metrics
+    with detection_manager_lock:
+        if detection_manager is None:
+            detection_manager = multiprocessing.get_context("spawn").Manager()
+            worker_metrics = detection_manager.dict()
+            logger.info('Detection manager started')
+        return detection_manager
+
+
+def get_detection_pool() -> ProcessPoolExecutor:
+    """
+    :return: the pool of detection worker processes, created when the app starts (see start_detection_workers), or
+    again at the first use after a worker crashed
+    """
+    global detection_pool
+    if detection_pool is None:
+        ocr_workers = max(1, (os.cpu_count() or 1) // YOLO_INFERENCE_WORKERS)
+        start_detection_manager()
+        # spawn: THE WORKERS DON'T INHERIT THE THREADS AND THE LOCKS OF THE API PROCESS (torch AND fork DON'T MIX)
+        detection_pool = ProcessPoolExecutor(max_workers=YOLO_INFERENCE_WORKERS,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=init_detection_worker,
+                                             initargs=(ocr_workers, worker_metrics))
+        logger.info(f'Detection pool started with {YOLO_INFERENCE_WORKERS} workers')
+    return detection_pool
+
+
+def start_detection_workers():
+    """
+    Starts the detection worker processes and the detection manager when the app starts (if YOLO_INFERENCE_WORKERS
+    > 0), so the first requests don't wait for the workers to load the models
+    """
+    if YOLO_INFERENCE_WORKERS > 0:
+        pool = get_detection_pool()
+        # THE POOL STARTS ITS PROCESSES ON DEMAND, ONE TASK FOR EACH WORKER STARTS THEM ALL (NOBODY WAITS FOR THEM)
+        for _ in range(YOLO_INFERENCE_WORKERS):
+            pool.submit(warm_up_detection_worker)
+
+
+def reset_detection_pool():
+    """
+    Stops the detection worker processes (if they were started), a new pool is created at the next use
+    """
+    global detection_pool
+    if detection_pool is not None:
+        detection_pool.shutdown(wait=False, cancel_futures=True)
+        detection_pool = None
+
+
+def shutdown_detection_pool():
+    """
+    Stops the detection worker processes and the detection manager (if they were started)
+    """
+    global detection_manager, worker_metrics
+    reset_detection_pool()
+    with detection_manager_lock:
+        if detection_manager is not None:
+            detection_manager.shutdown()
+            detection_manager = None
+            worker_metrics = None
+
+
+async def run_detection(function_name: str, *args):
+    """
+    Runs a function of the yolo_service module on the detection worker processes, or on the threadpool of the
+    API process if YOLO_INFERENCE_WORKERS is 0
+    :param function_name: the name of the function from yolo_service
+    :param args: the arguments of the function (they must be picklable)
+    :return: the result of the function
+    Throws 503 SERVICE_UNAVAILABLE if YOLO_INFERENCE_MAX_QUEUED detections are already running or waiting
+                                    or if a worker process crashed
+    """
+    global pending_detections
+    if pending_detections >= YOLO_INFERENCE_MAX_QUEUED:
+        logger.error('Detection queue is full')
+        raise CustomHTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            message="Too many detections in progress, try again later."
+        )
+
+    pending_detections += 1
+    try:
+        if YOLO_INFERENCE_WORKERS <= 0:
+            from service.yolo_services import yolo_service
+            return await run_in_threadpool(getattr(yolo_service, function_name), *args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_detection_pool(), run_detection_task, function_name, *args)
+    except BrokenProcessPool:
+        # A WORKER DIED (e.g. OUT OF MEMORY), THE POOL CANNOT BE USED ANYMORE SO A NEW ONE IS CREATED AT THE NEXT USE
+        # (THE DETECTION MANAGER IS KEPT, THE QUEUES OF THE OTHER REQUESTS ARE STILL IN USE)
+        logger.error('Detection worker process crashed')
+        reset_detection_pool()
+        raise CustomHTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            message="Detection worker crashed, try again later."
+        )
+    finally:
+        pending_detections -= 1
+
+
+def create_progress_queue():
+    """
+    Blocking (the queue is created by the manager process), call it from the threadpool
+    :return: a queue the detection function can put its partial results in (a queue of the manager process when the
+    function runs on the worker processes, a simple thread-safe queue otherwise)
+    """
+    if YOLO_INFERENCE_WORKERS <= 0:
+        return queue.Queue()
+    return start_detection_manager().Queue()
+
+
+async def run_detection_with_progress(function_name: str, *args):
+    """
+    Same as run_detection, but the function also receives a progress queue (as its last argument) and the partial
+    results it puts in the queue are yielded while it runs
+    :param function_name: the name of the function from yolo_service
+    :param args: the arguments of the function (they must be picklable)
+    :return: async generator with the (stage, data) partial results, and ('result', the result of the function) at
+    the end
+    Throws the same exceptions as run_detection and as the function
+    """
+    progress_queue = await run_in_threadpool(create_progress_queue)
+    task = asyncio.ensure_future(run_detection(function_name, *args, progress_queue))
+    try:
+        while True:
+            finished = task.done()
+            # THE PARTIAL RESULTS ARE DRAINED ONCE MORE AFTER THE FUNCTION FINISHED, SO NONE OF THEM IS LOST
+            while True:
+                try:
+                    yield progress_queue.get_nowait()
+                except queue.Empty:
+                    break
+            if finished:
+                break
+            await asyncio.wait({task}, timeout=YOLO_PROGRESS_POLL_SECONDS)
+        yield 'result', task.result()
+    finally:
+        if not task.done():
+            # THE CLIENT IS GONE, THE DETECTION FINISHES ON ITS OWN BUT NOBODY WAITS FOR IT
+            task.add_done_callback(lambda finished_task: finished_task.exception())
+
+
+def get_detection_pool_metrics():
+    """
+    :return: dictionary with the configuration and the queue depth of the detection worker pool
+    """
+    return {
+        'workers': YOLO_INFERENCE_WORKERS,
+        'max_queued': YOLO_INFERENCE_MAX_QUEUED,
+        'pending': pending_detections,
+    }
+
+
+async def detect_from_profile_capture(image_base64):
+    """
+    Awaitable version of yolo_service.detect_from_profile_capture, runs on the detection workers
+    """
+    return await run_detection('detect_from_profile_capture', image_base64)
+
+
+async def detect_from_post_capture(image_base64):
+    """
+    Awaitable version of yolo_service.detect_from_post_capture, runs on the detection workers
+    """
+    return await run_detection('detect_from_post_capture', image_base64)
+
+
+async def detect_from_auto_capture(image_base64):
+    """
+    Awaitable version of yolo_service.detect_from_auto_capture, runs on the detection workers
+    """
+    return await run_detection('detect_from_auto_capture', image_base64)
+
+
+async def detect_from_profile_bytes(image_bytes):
+    """
+    Awaitable version of yolo_service.detect_from_profile_bytes, runs on the detection workers
+    """
+    return await run_detection('detect_from_profile_bytes', image_bytes)
+
+
+def detect_from_post_capture_progressive(image_base64):
+    """
+    Progressive version of yolo_service.detect_from_post_capture, runs on the detection workers
+    :return: async generator with the partial results (see yolo_service.post_data_from_detections) and the result
+    """
+    return run_detection_with_progress('detect_from_post_capture_progressive', image_base64)
+
+
+async def detect_from_post_bytes(image_bytes):
+    """
+    Awaitable version of yolo_service.detect_from_post_bytes, runs on the detection workers
+    """
+    return await run_detection('detect_from_post_bytes', image_bytes)
+
+
+async def detect_from_post_sequence(images_base64):
+    """
+    Awaitable version of yolo_service.detect_from_post_sequence, runs on the detection workers
+    """
+    return await run_detection('detect_from_post_sequence', images_base64)
+
+
+def detect_from_post_video_progressive(video_path):
+    """
+    Progressive version of yolo_service.detect_from_post_video, runs on the detection workers (the whole recording is
+    read and detected by one worker, only the detected posts are sent back)
+    :return: async generator with the events of yolo_service.detect_from_post_video and the number of posts
+    """
+    return run_detection_with_progress('detect_from_post_video', video_path)
+
+
+async def detect_from_profile_captures(images_base64):
+    """
+    Awaitable version of yolo_service.detect_from_profile_captures, runs on the detection workers
+    """
+    return await run_detection('detect_from_profile_captures', images_base64)
+
+
+async def detect_from_post_captures(images_base64):
+    """
+    Awaitable version of yolo_service.detect_from_post_captures, runs on the detection workers
+    """
+    return await run_detection('detect_from_post_captures', images_base64)
+
+
+def get_workers_metrics(key: str) -> dict:
+    """
+    Blocking (the metrics are read from the manager process), call it from the threadpool
+    :param key: the metrics to return: 'pipeline' (see yolo_service.get_detection_metrics) or 'models'
+    (see yolo_service.get_model_registry_metrics)
+    :return: dictionary pid -> the last metrics published by each running worker (the workers which didn't publish for
+    3 * YOLO_WORKER_METRICS_SECONDS are gone, e.g. after a crash)
+    """
+    metrics_store = worker_metrics
+    if metrics_store is None:
+        return {}
+    now = time.time()
+    return {pid: {key: metrics[key], 'updated_at': metrics['updated_at']}
+            for pid, metrics in metrics_store.items()
+            if now - metrics['updated_at'] <= 3 * YOLO_WORKER_METRICS_SECONDS}
+
+
+async def get_detection_metrics():
+    """
+    Returns the metrics without sending a task to the detection workers (so the metrics don't wait for a free worker
+    and they are never rejected when the queue is full)
+    :return: the metrics of the worker pool (kept by the API process) and the metrics of the detection pipeline
+    (with worker processes, the last metrics published by each worker: 'workers' -> pid -> pipeline metrics)
+    """
+    if YOLO_INFERENCE_WORKERS <= 0:
+        from service.yolo_services import yolo_service
+        return {
+            'pool': get_detection_pool_metrics(),
+            **(await run_in_threadpool(yolo_service.get_detection_metrics)),
+        }
+    return {
+        'pool': get_detection_pool_metrics(),
+        'workers': await run_in_threadpool(get_workers_metrics, 'pipeline'),
+    }
+
+
+async def get_model_registry_metrics():
+    """
+    Returns the metrics of yolo_service.get_model_registry_metrics without sending a task to the detection workers
+    (with worker processes, the last metrics published by each worker: 'workers' -> pid -> models metrics)
+    """
+    if YOLO_INFERENCE_WORKERS <= 0:
+        from service.yolo_services import yolo_service
+        return await run_in_threadpool(yolo_service.get_model_registry_metrics)
+    return {'workers': await run_in_threadpool(get_workers_metrics, 'models')}
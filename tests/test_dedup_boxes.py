@@ -0,0 +1,85 @@
+import numpy as np
+
+from service.utils.yolo_utils import Detections, dedup_boxes
+
+CLASS_NAMES = {0: 'comment', 1: 'description', 2: 'likes'}
+
+
+def detections(boxes):
+    """
+    :param boxes: list with (x1, y1, x2, y2, class index, confidence)
+    :return: the Detections of the boxes
+    """
+    boxes = np.array(boxes, dtype=np.float32)
+    return Detections(xyxy=boxes[:, :4], cls=boxes[:, 4].astype(int), conf=boxes[:, 5])
+
+
+def sorted_boxes(result):
+    return sorted(tuple(box) + (int(cls), round(float(conf), 2))
+                  for box, cls, conf in zip(result.xyxy.tolist(), result.cls, result.conf))
+
+
+def test_overlapping_boxes_are_merged_into_their_union():
+    result = dedup_boxes(detections([
+        (10, 100, 500, 200, 0, 0.6),
+        (12, 105, 505, 210, 0, 0.9),
+    ]), CLASS_NAMES, ['comment'], 0.5, 0.8)
+
+    assert sorted_boxes(result) == [(10, 100, 505, 210, 0, 0.9)]
+
+
+def test_box_inside_another_box_is_merged():
+    result = dedup_boxes(detections([
+        (10, 100, 500, 400, 1, 0.8),
+        (20, 150, 300, 200, 1, 0.5),
+    ]), CLASS_NAMES, ['description'], 0.5, 0.8)
+
+    assert sorted_boxes(result) == [(10, 100, 500, 400, 1, 0.8)]
+
+
+def test_duplicates_are_merged_transitively():
+    # THE FIRST AND THE LAST BOX DON'T OVERLAP, BUT BOTH OVERLAP THE MIDDLE ONE
+    result = dedup_boxes(detections([
+        (0, 0, 100, 100, 0, 0.5),
+        (0, 10, 100, 110, 0, 0.7),
+        (0, 20, 100, 120, 0, 0.6),
+    ]), CLASS_NAMES, ['comment'], 0.5, 0.95)
+
+    assert sorted_boxes(result) == [(0, 0, 100, 120, 0, 0.7)]
+
+
+def test_separate_boxes_are_kept():
+    result = dedup_boxes(detections([
+        (10, 100, 500, 200, 0, 0.9),
+        (10, 220, 500, 320, 0, 0.8),
+    ]), CLASS_NAMES, ['comment'], 0.5, 0.8)
+
+    assert len(result.xyxy) == 2
+
+
+def test_boxes_of_different_labels_are_not_merged():
+    result = dedup_boxes(detections([
+        (10, 100, 500, 200, 0, 0.9),
+        (10, 100, 500, 200, 1, 0.8),
+    ]), CLASS_NAMES, ['comment', 'description'], 0.5, 0.8)
+
+    assert sorted_boxes(result) == [(10, 100, 500, 200, 0, 0.9), (10, 100, 500, 200, 1, 0.8)]
+
+
+def test_labels_not_deduplicated_are_kept_unchanged():
+    result = dedup_boxes(detections([
+        (10, 10, 100, 40, 2, 0.9),
+        (12, 10, 102, 40, 2, 0.8),
+        (10, 100, 500, 200, 0, 0.9),
+    ]), CLASS_NAMES, ['comment'], 0.5, 0.8)
+
+    assert sorted_boxes(result) == [(10, 10, 100, 40, 2, 0.9), (10, 100, 500, 200, 0, 0.9),
+                                    (12, 10, 102, 40, 2, 0.8)]
+
+
+def test_no_boxes():
+    empty = Detections(xyxy=np.zeros((0, 4), dtype=np.float32), cls=np.zeros(0, dtype=int),
+                       conf=np.zeros(0, dtype=np.float32))
+    result = dedup_boxes(empty, CLASS_NAMES, ['comment'], 0.5, 0.8)
+
+    assert len(result.xyxy) == 0
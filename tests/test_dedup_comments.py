@@ -0,0 +1,28 @@
+from service.yolo_services.yolo_posts import dedup_comments
+
+
+def test_comments_seen_in_multiple_screenshots_are_kept_once():
+    assert dedup_comments([
+        ['user1 nice photo', 'user2 where is this?'],
+        ['user2 where is this?', 'user3 amazing'],
+    ]) == ['user1 nice photo', 'user2 where is this?', 'user3 amazing']
+
+
+def test_comments_are_compared_ignoring_case_and_spaces():
+    assert dedup_comments([['user1 Nice  photo'], ['user1 nice photo']]) == ['user1 Nice  photo']
+
+
+def test_comments_with_small_ocr_differences_are_duplicates():
+    assert dedup_comments([
+        ['user2 this is the best place I have ever visited'],
+        ['user2 this is the best p1ace I have ever visited'],
+    ]) == ['user2 this is the best place I have ever visited']
+
+
+def test_different_comments_are_kept_in_order():
+    assert dedup_comments([['user1 first'], [], ['user2 second', 'user3 third']]) == \
+        ['user1 first', 'user2 second', 'user3 third']
+
+
+def test_no_comments():
+    assert dedup_comments([]) == []
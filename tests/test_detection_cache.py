@@ -0,0 +1,64 @@
+import os
+from datetime import datetime
+
+import numpy as np
+
+from service.utils import detection_cache
+from service.utils.detection_cache import DetectionCache, encode_result, decode_result
+
+
+def screenshot():
+    """
+    :return: a synthetic screenshot (white background with dark text-like bars)
+    """
+    image = np.full((1600, 740, 3), 255, dtype=np.uint8)
+    for top in range(40, 1560, 48):
+        image[top:top + 20, 20:20 + 300 + top % 400] = 30
+    return image
+
+
+def post_result():
+    return b'\xff\xd8jpeg', 'description', 120, -1, datetime(2024, 5, 1, 10, 30), ['first', 'second']
+
+
+def test_encode_decode_result_round_trip():
+    result_json, blobs = encode_result(post_result())
+
+    assert blobs == [b'\xff\xd8jpeg']
+    assert decode_result(result_json, blobs) == post_result()
+
+
+def test_disk_tier_is_shared_between_caches(tmp_path, monkeypatch):
+    monkeypatch.setattr(detection_cache, 'YOLO_CACHE_DIR', str(tmp_path))
+    writer = DetectionCache('post')
+    key, thumbnail = writer.fingerprint(screenshot())
+    writer.put(key, thumbnail, post_result())
+
+    reader = DetectionCache('post')
+
+    assert os.listdir(tmp_path) == [f'{key}.npz']
+    assert reader.get(*reader.fingerprint(screenshot())) == post_result()
+    assert reader.stats()['disk_hits'] == 1
+
+
+def test_disk_keys_are_listed_again_only_after_the_index_interval(tmp_path, monkeypatch):
+    monkeypatch.setattr(detection_cache, 'YOLO_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(detection_cache, 'YOLO_CACHE_DISK_INDEX_SECONDS', 3600)
+    reader = DetectionCache('post')
+    key, thumbnail = reader.fingerprint(screenshot())
+    assert reader.get(key, thumbnail) is None
+
+    DetectionCache('post').put(key, thumbnail, post_result())
+
+    assert reader.get(key, thumbnail) is None
+    reader.disk_keys_listed_at = None
+    assert reader.get(key, thumbnail) == post_result()
+
+
+def test_pickle_files_are_ignored(tmp_path, monkeypatch):
+    monkeypatch.setattr(detection_cache, 'YOLO_CACHE_DIR', str(tmp_path))
+    cache = DetectionCache('post')
+    key, thumbnail = cache.fingerprint(screenshot())
+    (tmp_path / f'{key}.pkl').write_bytes(b'not loaded')
+
+    assert cache.get(key, thumbnail) is None
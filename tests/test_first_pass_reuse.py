@@ -0,0 +1,29 @@
+from service.utils import ocr_utils
+from service.utils.ocr_utils import first_pass_is_reusable
+
+
+def test_confident_text_and_language_are_reused():
+    assert first_pass_is_reusable(ocr_utils.OCR_REUSE_MIN_TEXT_CONFIDENCE,
+                                  ocr_utils.OCR_REUSE_MIN_LANGUAGE_CONFIDENCE)
+    assert first_pass_is_reusable(99.0, 0.99)
+
+
+def test_low_text_confidence_is_not_reused():
+    assert not first_pass_is_reusable(ocr_utils.OCR_REUSE_MIN_TEXT_CONFIDENCE - 1, 0.99)
+
+
+def test_low_language_confidence_is_not_reused():
+    assert not first_pass_is_reusable(99.0, ocr_utils.OCR_REUSE_MIN_LANGUAGE_CONFIDENCE - 0.01)
+
+
+def test_unknown_text_confidence_is_not_reused():
+    # THE TEXT WAS EXTRACTED WITHOUT CONFIDENCE (e.g. pytesseract image_to_string)
+    assert not first_pass_is_reusable(None, 0.99)
+
+
+def test_thresholds_are_configurable(monkeypatch):
+    monkeypatch.setattr(ocr_utils, 'OCR_REUSE_MIN_TEXT_CONFIDENCE', 50.0)
+    monkeypatch.setattr(ocr_utils, 'OCR_REUSE_MIN_LANGUAGE_CONFIDENCE', 0.5)
+
+    assert first_pass_is_reusable(60.0, 0.6)
+    assert not first_pass_is_reusable(40.0, 0.6)
@@ -0,0 +1,104 @@
+import cv2
+import numpy as np
+
+from service.utils.cache_utils import LRUCache
+from service.utils.yolo_utils import perceptual_hash, hash_distance
+
+
+def screenshot(seed=0):
+    """
+    :return: a synthetic screenshot (white background with dark text-like bars)
+    """
+    rng = np.random.default_rng(seed)
+    image = np.full((1600, 740, 3), 255, dtype=np.uint8)
+    for top in range(40, 1560, 48):
+        width = int(rng.integers(200, 700))
+        image[top:top + 20, 20:20 + width] = rng.integers(0, 80)
+    return image
+
+
+def test_perceptual_hash_is_stable_after_jpeg_reencoding():
+    image = screenshot()
+    _, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 50])
+    reencoded = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+    assert hash_distance(perceptual_hash(image), perceptual_hash(reencoded)) <= 8
+
+
+def test_perceptual_hash_is_stable_after_resizing():
+    image = screenshot()
+    resized = cv2.resize(image, (370, 800), interpolation=cv2.INTER_AREA)
+
+    assert hash_distance(perceptual_hash(image), perceptual_hash(resized)) <= 8
+
+
+def test_perceptual_hash_differs_for_other_screenshots():
+    assert hash_distance(perceptual_hash(screenshot(0)), perceptual_hash(screenshot(1))) > 40
+
+
+def test_perceptual_hash_size():
+    assert len(perceptual_hash(screenshot())) == 64
+    assert len(perceptual_hash(screenshot(), hash_size=8)) == 16
+
+
+def test_hash_distance():
+    assert hash_distance('00', '00') == 0
+    assert hash_distance('00', 'ff') == 8
+    assert hash_distance('0f0f', '0f0e') == 1
+
+
+def test_lru_cache_evicts_the_least_recently_used_entry():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.keys() == ['a', 'c']
+    assert cache.stats()['evictions'] == 1
+
+
+def test_lru_cache_counts_hits_and_misses():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.get('a')
+    cache.get('missing', 'default')
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, 0.5)
+
+
+def test_lru_cache_expired_entries_are_misses(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('service.utils.cache_utils.time.monotonic', lambda: now[0])
+    cache = LRUCache(2, ttl_seconds=10)
+    cache.put('a', 1)
+    now[0] += 5
+    assert cache.get('a') == 1
+    now[0] += 10
+
+    assert cache.get('a', 'expired') == 'expired'
+    assert cache.keys() == []
+
+
+def test_lru_cache_disabled():
+    cache = LRUCache(0)
+    cache.put('a', 1)
+
+    assert cache.get('a') is None
+    assert cache.stats()['size'] == 0
+
+
+def test_lru_cache_remove_and_clear():
+    cache = LRUCache(3)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.remove('a')
+    cache.remove('missing')
+    assert cache.keys() == ['b']
+
+    cache.clear()
+    assert cache.keys() == []
@@ -0,0 +1,64 @@
+import cv2
+import numpy as np
+
+from service.utils.yolo_utils import estimate_scroll_offset
+
+SCREEN_HEIGHT, SCREEN_WIDTH = 1600, 740
+
+
+def post_page(seed=0, height=4000):
+    """
+    :return: a synthetic scrolling page (white background with dark text-like lines of different lengths)
+    """
+    rng = np.random.default_rng(seed)
+    page = np.full((height, SCREEN_WIDTH, 3), 255, dtype=np.uint8)
+    top = 0
+    while top < height:
+        line_height = int(rng.integers(14, 30))
+        page[top:top + line_height, 20:20 + int(rng.integers(100, 700))] = int(rng.integers(0, 120))
+        top += line_height + int(rng.integers(8, 40))
+    return page
+
+
+def screen(page, scroll):
+    """
+    :return: the screenshot of the page scrolled by the given number of pixels, the status bar (header) and the
+    navigation bar (footer) don't scroll
+    """
+    screenshot = page[scroll:scroll + SCREEN_HEIGHT].copy()
+    screenshot[:120] = 30
+    screenshot[-100:] = 240
+    return screenshot
+
+
+def reencoded(image, quality):
+    _, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+
+def test_scroll_is_estimated():
+    page = post_page()
+    for scroll in (0, 137, 600, 1000):
+        assert estimate_scroll_offset(screen(page, 0), screen(page, scroll)) == scroll
+
+
+def test_scroll_is_estimated_on_reencoded_screenshots():
+    page = post_page()
+
+    assert estimate_scroll_offset(reencoded(screen(page, 0), 40), reencoded(screen(page, 450), 40)) == 450
+
+
+def test_unrelated_screenshots_dont_overlap():
+    assert estimate_scroll_offset(screen(post_page(0), 0), screen(post_page(1), 0)) is None
+
+
+def test_screenshots_of_different_sizes_dont_overlap():
+    page = post_page()
+
+    assert estimate_scroll_offset(screen(page, 0), cv2.resize(screen(page, 200), (370, 800))) is None
+
+
+def test_empty_screenshots_dont_overlap():
+    empty = np.full((SCREEN_HEIGHT, SCREEN_WIDTH, 3), 255, dtype=np.uint8)
+
+    assert estimate_scroll_offset(empty, empty) is None
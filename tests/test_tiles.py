@@ -0,0 +1,79 @@
+import numpy as np
+
+from service.utils import yolo_utils
+from service.utils.yolo_utils import Detections, tile_offsets, merge_tile_detections
+
+CLASS_NAMES = {0: 'comment', 1: 'likes', 2: 'photo'}
+
+
+def detections(boxes):
+    """
+    :param boxes: list with (x1, y1, x2, y2, class index, confidence), in the coordinates of the tile
+    :return: the Detections of the boxes
+    """
+    boxes = np.array(boxes, dtype=np.float32).reshape(-1, 6)
+    return Detections(xyxy=boxes[:, :4], cls=boxes[:, 4].astype(int), conf=boxes[:, 5])
+
+
+def sorted_boxes(result):
+    return sorted(tuple(box) + (int(cls),) for box, cls in zip(result.xyxy.tolist(), result.cls))
+
+
+def test_normal_screenshot_is_a_single_tile():
+    assert tile_offsets(1600, 740) == (1600, [0])
+
+
+def test_tall_screenshot_tiles_cover_the_image_and_overlap():
+    height, width = 5000, 800
+    tile_height, offsets = tile_offsets(height, width)
+
+    assert tile_height == int(width * yolo_utils.YOLO_TILE_ASPECT_RATIO)
+    assert offsets[0] == 0
+    assert offsets[-1] + tile_height == height
+    for previous, current in zip(offsets, offsets[1:]):
+        assert 0 < current - previous <= tile_height * (1 - yolo_utils.YOLO_TILE_OVERLAP)
+
+
+def test_boxes_are_moved_to_the_image_coordinates():
+    result = merge_tile_detections([detections([(10, 100, 200, 150, 1, 0.9)]),
+                                    detections([(10, 700, 200, 750, 1, 0.8)])],
+                                   [0, 1200], 1600, (2800, 800, 3), CLASS_NAMES)
+
+    assert sorted_boxes(result) == [(10, 100, 200, 150, 1), (10, 1900, 200, 1950, 1)]
+
+
+def test_comment_cut_by_a_seam_is_merged():
+    # THE FIRST TILE (ROWS 0-1600) CUTS THE COMMENT AT ITS BOTTOM EDGE, THE SECOND TILE (ROWS 1200-2800) SEES IT WHOLE
+    result = merge_tile_detections([detections([(10, 1550, 500, 1598, 0, 0.7)]),
+                                    detections([(12, 350, 505, 500, 0, 0.9)])],
+                                   [0, 1200], 1600, (2800, 800, 3), CLASS_NAMES)
+
+    assert sorted_boxes(result) == [(10, 1550, 505, 1700, 0)]
+    assert result.conf.tolist() == [np.float32(0.9)]
+
+
+def test_comment_split_in_two_halves_is_merged():
+    # THE LAST TILE IS ALIGNED WITH THE BOTTOM OF THE IMAGE, THE COMMENT IS CUT BY THE TOP EDGE OF THE SECOND TILE
+    # (ROW 1000) AND ITS TWO HALVES DON'T OVERLAP ENOUGH TO BE DUPLICATES BY IoU
+    result = merge_tile_detections([detections([(10, 900, 500, 1100, 0, 0.8)]),
+                                    detections([(10, 1, 300, 300, 0, 0.8)])],
+                                   [0, 1000], 1600, (2600, 800, 3), CLASS_NAMES)
+
+    assert sorted_boxes(result) == [(10, 900, 500, 1300, 0)]
+
+
+def test_other_labels_are_not_merged():
+    # THE SAME likes BOX DETECTED IN THE OVERLAP OF BOTH TILES STAYS TWO CANDIDATES (see rank_label_candidates)
+    result = merge_tile_detections([detections([(10, 1300, 200, 1350, 1, 0.9)]),
+                                    detections([(12, 100, 202, 150, 1, 0.85)])],
+                                   [0, 1200], 1600, (2800, 800, 3), CLASS_NAMES)
+
+    assert sorted_boxes(result) == [(10, 1300, 200, 1350, 1), (12, 1300, 202, 1350, 1)]
+
+
+def test_separate_comments_are_kept():
+    result = merge_tile_detections([detections([(10, 100, 500, 200, 0, 0.9)]),
+                                    detections([(10, 1000, 500, 1100, 0, 0.9)])],
+                                   [0, 1200], 1600, (2800, 800, 3), CLASS_NAMES)
+
+    assert sorted_boxes(result) == [(10, 100, 500, 200, 0), (10, 2200, 500, 2300, 0)]
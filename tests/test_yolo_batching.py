@@ -0,0 +1,99 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from service.yolo_services.yolo_batching import YoloBatchScheduler
+
+
+class FakeModel:
+    """
+    Stands for a YOLO model: records the size (and imgsz) of each forward pass and returns one result per image,
+    the forward passes wait for the gate to be opened
+    """
+
+    def __init__(self, gate_open=True):
+        self.calls = []
+        self.started = threading.Event()
+        self.gate = threading.Event()
+        if gate_open:
+            self.gate.set()
+
+    def __call__(self, images, imgsz=None):
+        self.calls.append((len(images), imgsz))
+        self.started.set()
+        self.gate.wait(5)
+        return [f'result-{image}' for image in images]
+
+
+def test_concurrent_callers_are_batched_up_to_the_max_size():
+    model = FakeModel(gate_open=False)
+    scheduler = YoloBatchScheduler(model, 'test', max_batch_size=4, max_wait_ms=200)
+    try:
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            futures = [executor.submit(scheduler.predict, i) for i in range(10)]
+            model.started.wait(5)
+            model.gate.set()
+            results = [future.result(5) for future in futures]
+    finally:
+        scheduler.close()
+
+    assert results == [f'result-{i}' for i in range(10)]
+    assert sum(size for size, _ in model.calls) == 10
+    assert max(size for size, _ in model.calls) == 4
+    assert len(model.calls) == 3
+    assert scheduler.stats()['no_images'] == 10
+
+
+def test_partial_batch_is_flushed_after_the_max_wait():
+    model = FakeModel()
+    scheduler = YoloBatchScheduler(model, 'test', max_batch_size=8, max_wait_ms=50)
+    try:
+        started = time.monotonic()
+        futures = [scheduler.submit(i) for i in range(2)]
+        results = [future.result(5) for future in futures]
+        elapsed = time.monotonic() - started
+    finally:
+        scheduler.close()
+
+    assert results == ['result-0', 'result-1']
+    assert model.calls == [(2, None)]
+    assert 0.04 <= elapsed < 2
+
+
+def test_images_with_another_imgsz_get_their_own_forward_pass():
+    model = FakeModel(gate_open=False)
+    scheduler = YoloBatchScheduler(model, 'test', max_batch_size=8, max_wait_ms=0)
+    try:
+        first = scheduler.submit('first')
+        model.started.wait(5)
+        futures = [scheduler.submit('a'), scheduler.submit('b', 320), scheduler.submit('c')]
+        model.gate.set()
+        results = [future.result(5) for future in [first, *futures]]
+    finally:
+        scheduler.close()
+
+    assert results == ['result-first', 'result-a', 'result-b', 'result-c']
+    assert model.calls == [(1, None), (2, None), (1, 320)]
+
+
+def test_close_fails_the_queued_images_and_rejects_new_ones():
+    model = FakeModel(gate_open=False)
+    scheduler = YoloBatchScheduler(model, 'test', max_batch_size=1, max_wait_ms=0)
+    running = scheduler.submit('running')
+    model.started.wait(5)
+    queued = [scheduler.submit('queued-1'), scheduler.submit('queued-2')]
+
+    scheduler.close()
+    model.gate.set()
+
+    assert running.result(5) == 'result-running'
+    for future in queued:
+        with pytest.raises(RuntimeError):
+            future.result(5)
+    with pytest.raises(RuntimeError):
+        scheduler.submit('late')
+    scheduler.worker.join(5)
+    assert not scheduler.worker.is_alive()
+    assert model.calls == [(1, None)]
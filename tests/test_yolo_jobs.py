@@ -0,0 +1,163 @@
+import asyncio
+
+import pytest
+
+from exceptions.custom_exceptions import CustomHTTPException
+from service.yolo_services import yolo_jobs
+from service.yolo_services.yolo_jobs import submit_detection_job, get_detection_job, JOB_QUEUED, JOB_DONE, \
+    JOB_FAILED
+from websocket.ws_types import WebsocketType
+
+
+@pytest.fixture
+def notifications(monkeypatch):
+    """
+    Jobs module without jobs, with a fast retry, one job at a time and the websocket messages recorded
+    :return: the list with the (user id, payload, type) of the websocket messages
+    """
+    sent = []
+
+    async def notify_client(user_id, payload, websocket_type):
+        sent.append((user_id, payload, websocket_type))
+
+    monkeypatch.setattr(yolo_jobs, 'notify_client', notify_client)
+    monkeypatch.setattr(yolo_jobs, 'detection_jobs', {})
+    monkeypatch.setattr(yolo_jobs, 'detection_job_tasks', set())
+    # THE SEMAPHORE IS CREATED AGAIN INSIDE THE EVENT LOOP OF EACH TEST
+    monkeypatch.setattr(yolo_jobs, 'detection_jobs_semaphore', None)
+    monkeypatch.setattr(yolo_jobs, 'YOLO_JOBS_CONCURRENCY', 1)
+    monkeypatch.setattr(yolo_jobs, 'YOLO_JOBS_RETRY_SECONDS', 0.05)
+    return sent
+
+
+async def wait_for_jobs():
+    while yolo_jobs.detection_job_tasks:
+        await asyncio.gather(*yolo_jobs.detection_job_tasks)
+
+
+def test_job_lifecycle(notifications):
+    async def detect(job):
+        return {'username': 'user1'}
+
+    async def scenario():
+        job = submit_detection_job(1, 'profile', detect)
+        assert job.status == JOB_QUEUED
+        await wait_for_jobs()
+        return job
+
+    job = asyncio.run(scenario())
+
+    assert job.status == JOB_DONE
+    assert job.finished_at is not None
+    assert get_detection_job(job.id, 1).to_dict() == {'job_id': job.id, 'kind': 'profile', 'status': JOB_DONE,
+                                                      'result': {'username': 'user1'}}
+    assert notifications == [(1, job.to_dict(), WebsocketType.DETECTION_JOB_DONE)]
+
+
+def test_failed_job_keeps_the_error(notifications):
+    async def detect(job):
+        raise CustomHTTPException(status_code=400, message="Invalid image format.")
+
+    async def scenario():
+        job = submit_detection_job(1, 'post', detect)
+        await wait_for_jobs()
+        return job
+
+    job = asyncio.run(scenario())
+
+    assert job.status == JOB_FAILED
+    assert job.result == {'message': "Invalid image format.", 'status_code': 400}
+    assert notifications[0][1]['status'] == JOB_FAILED
+
+
+def test_unexpected_error_fails_the_job(notifications):
+    async def detect(job):
+        raise RuntimeError('worker failed')
+
+    async def scenario():
+        job = submit_detection_job(1, 'post', detect)
+        await wait_for_jobs()
+        return job
+
+    job = asyncio.run(scenario())
+
+    assert job.status == JOB_FAILED
+    assert job.result['status_code'] == 500
+
+
+def test_rejected_job_is_retried_without_holding_its_slot(notifications):
+    calls = []
+
+    async def busy(job):
+        calls.append('busy')
+        if calls.count('busy') < 3:
+            raise CustomHTTPException(status_code=503, message="Too many detections in progress, try again later.")
+        return {'retried': True}
+
+    async def quick(job):
+        calls.append('quick')
+        return {}
+
+    async def scenario():
+        busy_job = submit_detection_job(1, 'post', busy)
+        await asyncio.sleep(0.01)
+        quick_job = submit_detection_job(1, 'post', quick)
+        await wait_for_jobs()
+        return busy_job, quick_job
+
+    busy_job, quick_job = asyncio.run(scenario())
+
+    # THE SECOND JOB RAN WHILE THE FIRST ONE WAITED FOR ITS RETRY (ONLY ONE JOB RUNS AT A TIME)
+    assert calls == ['busy', 'quick', 'busy', 'busy']
+    assert (busy_job.status, busy_job.result) == (JOB_DONE, {'retried': True})
+    assert quick_job.status == JOB_DONE
+
+
+def test_job_of_another_user_is_not_found(notifications):
+    async def detect(job):
+        return {}
+
+    async def scenario():
+        job = submit_detection_job(1, 'profile', detect)
+        await wait_for_jobs()
+        return job
+
+    job = asyncio.run(scenario())
+
+    with pytest.raises(CustomHTTPException) as error:
+        get_detection_job(job.id, 2)
+    assert error.value.status_code == 404
+
+
+def test_expired_job_is_forgotten(notifications):
+    async def detect(job):
+        return {}
+
+    async def scenario():
+        job = submit_detection_job(1, 'profile', detect)
+        await wait_for_jobs()
+        return job
+
+    job = asyncio.run(scenario())
+    job.finished_at -= yolo_jobs.YOLO_JOBS_TTL_SECONDS + 1
+
+    with pytest.raises(CustomHTTPException) as error:
+        get_detection_job(job.id, 1)
+    assert error.value.status_code == 404
+
+
+def test_too_many_jobs_are_rejected(notifications, monkeypatch):
+    monkeypatch.setattr(yolo_jobs, 'YOLO_JOBS_MAX_QUEUED', 1)
+
+    async def detect(job):
+        await asyncio.sleep(0.05)
+        return {}
+
+    async def scenario():
+        submit_detection_job(1, 'post', detect)
+        with pytest.raises(CustomHTTPException) as error:
+            submit_detection_job(1, 'post', detect)
+        await wait_for_jobs()
+        return error.value
+
+    assert asyncio.run(scenario()).status_code == 503
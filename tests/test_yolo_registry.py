@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+from exceptions.custom_exceptions import CustomHTTPException
+from service.yolo_services import yolo_registry
+from service.yolo_services.yolo_registry import get_registry_state, set_candidate_model, remove_candidate_model, \
+    promote_candidate_model, rollback_model
+
+
+@pytest.fixture
+def models_dir(tmp_path, monkeypatch):
+    """
+    Registry with its state file and its weights in a temporary directory
+    :return: the directory of the weights
+    """
+    models_dir = tmp_path / 'ai_models'
+    models_dir.mkdir()
+    for name in ('profile.pt', 'post.pt', 'candidate.pt'):
+        (models_dir / name).write_bytes(b'weights')
+    monkeypatch.setattr(yolo_registry, 'YOLO_MODELS_DIR', str(models_dir))
+    monkeypatch.setattr(yolo_registry, 'YOLO_REGISTRY_STATE_FILE', str(tmp_path / 'yolo_registry.json'))
+    monkeypatch.setattr(yolo_registry, 'DEFAULT_WEIGHTS', {'profile': str(models_dir / 'profile.pt'),
+                                                           'post': str(models_dir / 'post.pt')})
+    return models_dir
+
+
+def test_default_state(models_dir):
+    state = get_registry_state()
+
+    assert state['post'] == {'active': str(models_dir / 'post.pt'), 'previous': None, 'candidate': None,
+                             'shadow_rate': yolo_registry.YOLO_SHADOW_SAMPLE_RATE}
+    assert state['profile']['active'] == str(models_dir / 'profile.pt')
+
+
+def test_set_candidate(models_dir):
+    state = set_candidate_model('post', str(models_dir / 'candidate.pt'), 0.5)
+
+    assert state['post']['candidate'] == str(models_dir / 'candidate.pt')
+    assert state['post']['shadow_rate'] == 0.5
+    # THE STATE IS WRITTEN TO THE FILE READ BY THE WORKERS
+    with open(yolo_registry.YOLO_REGISTRY_STATE_FILE) as f:
+        assert json.load(f)['post']['candidate'] == str(models_dir / 'candidate.pt')
+
+
+def test_remove_candidate(models_dir):
+    set_candidate_model('post', str(models_dir / 'candidate.pt'))
+    state = remove_candidate_model('post')
+
+    assert state['post']['candidate'] is None
+    assert state['post']['active'] == str(models_dir / 'post.pt')
+
+
+def test_promote_then_rollback(models_dir):
+    set_candidate_model('post', str(models_dir / 'candidate.pt'))
+
+    state = promote_candidate_model('post')
+    assert state['post']['active'] == str(models_dir / 'candidate.pt')
+    assert state['post']['previous'] == str(models_dir / 'post.pt')
+    assert state['post']['candidate'] is None
+    # THE OTHER KIND OF MODELS IS NOT CHANGED
+    assert state['profile']['active'] == str(models_dir / 'profile.pt')
+
+    state = rollback_model('post')
+    assert state['post']['active'] == str(models_dir / 'post.pt')
+    assert state['post']['previous'] is None
+
+
+def test_promote_without_candidate(models_dir):
+    with pytest.raises(CustomHTTPException) as error:
+        promote_candidate_model('post')
+    assert error.value.status_code == 409
+
+
+def test_rollback_without_previous(models_dir):
+    with pytest.raises(CustomHTTPException) as error:
+        rollback_model('profile')
+    assert error.value.status_code == 409
+
+
+def test_unknown_kind(models_dir):
+    with pytest.raises(CustomHTTPException) as error:
+        remove_candidate_model('story')
+    assert error.value.status_code == 404
+
+
+def test_candidate_outside_the_models_dir(models_dir, tmp_path):
+    outside = tmp_path / 'outside.pt'
+    outside.write_bytes(b'weights')
+
+    with pytest.raises(CustomHTTPException) as error:
+        set_candidate_model('post', str(outside))
+    assert error.value.status_code == 422
+
+
+def test_missing_candidate_weights(models_dir):
+    with pytest.raises(CustomHTTPException) as error:
+        set_candidate_model('post', str(models_dir / 'missing.pt'))
+    assert error.value.status_code == 404
+
+
+def test_invalid_shadow_rate(models_dir):
+    with pytest.raises(CustomHTTPException) as error:
+        set_candidate_model('post', str(models_dir / 'candidate.pt'), 1.5)
+    assert error.value.status_code == 422
+    assert get_registry_state()['post']['candidate'] is None
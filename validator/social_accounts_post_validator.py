@@ -6,17 +6,19 @@ from exceptions.custom_exceptions import CustomHTTPException
 from datetime import datetime
 
 from logging_config import logger
+from validator.social_accounts_validator import validate_staged_photo
 
 
-def validate_social_account_post_add(post: AddSocialAccountPostReq):
+def validate_social_account_post_add(post: AddSocialAccountPostReq, user_id: int):
     """
     Validate that all required fields in social_account_post are present and valid.
     - description can be empty
     - noLikes and noComments must be >= -1
     - datePosted must be a non-empty string and in ISO format (YYYY-MM-DD)
-    - comments and photos must be lists (can be empty)
+    - comments and photos must be lists (can be empty), the staged photos (crop ids) must not be expired
     - social_account_id must be a positive integer
     :param post: the post to be validated
+    :param user_id: the id of the current user (the owner of the staged photos)
     :return: none
     throws HTTP 422 UNPROCESSABLE_ENTITY if the post is invalid
     """
@@ -56,6 +58,8 @@ def validate_social_account_post_add(post: AddSocialAccountPostReq):
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             message="Photos must be a list."
         )
+    for photo in post.photos:
+        validate_staged_photo(photo, user_id)
 
     if post.social_account_id is None or post.social_account_id < 0:
         logger.error("Social account ID must be a positive integer")
@@ -65,15 +69,16 @@ def validate_social_account_post_add(post: AddSocialAccountPostReq):
         )
 
 
-def validate_social_account_post_update(post: UpdateSocialAccountPostReq):
+def validate_social_account_post_update(post: UpdateSocialAccountPostReq, user_id: int):
     """
     Validate that all required fields in social_account_post are present and valid.
     - description can be empty
     - noLikes and noComments must be >= -1
     - datePosted must be a non-empty string and in ISO format (YYYY-MM-DD)
-    - comments and photos must be lists (can be empty)
+    - comments and photos must be lists (can be empty), the staged photos (crop ids) must not be expired
     - social_account_id must be a positive integer
     :param post: the post to be validated
+    :param user_id: the id of the current user (the owner of the staged photos)
     :return: none
     throws HTTP 422 UNPROCESSABLE_ENTITY if the post is invalid
     """
@@ -114,3 +119,5 @@ def validate_social_account_post_update(post: UpdateSocialAccountPostReq):
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             message="Photos must be a list."
         )
+    for photo in post.photos:
+        validate_staged_photo(photo.photo_url, user_id)
@@ -4,15 +4,17 @@ from app_requests.accounts_requests.add_social_account_req import AddSocialAccou
 from app_requests.accounts_requests.update_social_account_req import UpdateSocialAccountReq
 from exceptions.custom_exceptions import CustomHTTPException
 from logging_config import logger
+from service.utils.photos_utils import is_crop_id, staged_photo_exists
 
 
-def validate_social_account_add(social_account: AddSocialAccountReq):
+def validate_social_account_add(social_account: AddSocialAccountReq, user_id: int):
     """
     Validate that all required fields in social_account entity for Add request are valid.
     No of followers/following/posts should be >=0 and not empty.
-    Username and profile_photo cannot be empty.
+    Username and profile_photo cannot be empty, the staged profile_photo (crop id) must not be expired.
     Only description can be empty.
     :param social_account: the account to be validated
+    :param user_id: the id of the current user (the owner of the staged photo)
     :return: none
     throws HTTP 422 UNPROCESSABLE_ENTITY if the social_account is invalid
     """
@@ -50,14 +52,17 @@ def validate_social_account_add(social_account: AddSocialAccountReq):
             message="Profile photo cannot be empty."
         )
 
+    validate_staged_photo(social_account.profile_photo, user_id)
 
-def validate_social_account_update(social_account: UpdateSocialAccountReq):
+
+def validate_social_account_update(social_account: UpdateSocialAccountReq, user_id: int):
     """
     Validate that all required fields in social_account entity for Update request are valid.
     No of followers/following/posts should be >=0 and not empty.
-    Username and profile_photo cannot be empty.
+    Username and profile_photo cannot be empty, the staged profile_photo (crop id) must not be expired.
     Only description can be empty.
     :param social_account: the account to be validated
+    :param user_id: the id of the current user (the owner of the staged photo)
     :return: none
     throws HTTP 422 UNPROCESSABLE_ENTITY if the social_account is invalid
     """
@@ -94,3 +99,22 @@ def validate_social_account_update(social_account: UpdateSocialAccountReq):
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             message="Profile photo cannot be empty."
         )
+
+    validate_staged_photo(social_account.profile_photo, user_id)
+
+
+def validate_staged_photo(photo: str, user_id: int):
+    """
+    Validate that a photo given as crop id (see photos_utils.stage_photo) is still in the staging directory of the
+    user, so the request fails before any photo is saved
+    :param photo: the photo (crop id or base64)
+    :param user_id: the id of the current user
+    :return: none
+    throws HTTP 422 UNPROCESSABLE_ENTITY if the staged photo expired or it belongs to another user
+    """
+    if is_crop_id(photo) and not staged_photo_exists(photo, user_id):
+        logger.error(f"Staged photo {photo} expired")
+        raise CustomHTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            message="The photo expired, detect it again."
+        )
@@ -10,3 +10,5 @@ class WebsocketType(Enum):
     POST_EDITED = 'POST_EDITED'
     POST_DELETED = 'POST_DELETED'
     USER_ACCOUNT_DELETED = 'USER_ACCOUNT_DELETED'
+    DETECTION_JOB_DONE = 'DETECTION_JOB_DONE'
+    DETECTION_JOB_PROGRESS = 'DETECTION_JOB_PROGRESS'